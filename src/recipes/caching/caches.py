@@ -1,16 +1,67 @@
 
 # std
-from collections import OrderedDict as odict
+import re
+import time
+from collections import OrderedDict as odict, defaultdict
 
 # relative
 from ..logging import LoggingMixin
 from ..string import remove_suffix
+from ..oo.size import get_object_size
 
 
 DEFAULT_CAPACITY = 2 ** 7
+DEFAULT_TTL = 60 * 60  # seconds
+
+
+# Binary multiples for parsing capacity given in bytes eg: '512MB'
+BYTE_UNITS = {unit: 2 ** (10 * i) for i, unit in enumerate(' KMGTP')}
+RGX_BYTES = re.compile(r'\s*([\d.]+)\s*(?:([KMGTP])i?)?B?\s*', re.IGNORECASE)
 
 # TODO: sqlite, yaml, dill, msgpack, srsly
 
+
+# ---------------------------------------------------------------------------- #
+
+def parse_bytes(size):
+    """
+    Convert a size in bytes, optionally given as a string with binary multiple
+    units, to int.
+
+    Examples
+    --------
+    >>> parse_bytes('512MB')
+    536870912
+    >>> parse_bytes('1.5 KiB')
+    1536
+    """
+    if not isinstance(size, str):
+        return int(size)
+
+    if not (match := RGX_BYTES.fullmatch(size)):
+        raise ValueError(f'Could not interpret {size!r} as a size in bytes.')
+
+    value, unit = match.groups()
+    return int(float(value) * BYTE_UNITS[(unit or ' ').upper()])
+
+
+def sizeof(obj):
+    """
+    Estimate the memory footprint of an object in bytes. Array-like objects
+    (eg. numpy arrays) report their `nbytes`, objects supporting the buffer
+    protocol report the size of the buffer, and anything else is traversed
+    recursively by `get_object_size`.
+    """
+    if isinstance(nbytes := getattr(obj, 'nbytes', None), int):
+        return nbytes
+
+    try:
+        with memoryview(obj) as view:
+            return view.nbytes
+    except TypeError:
+        return get_object_size(obj)
+
+
 # # ------------------------------- json helpers ------------------------------- #
 
 
@@ -63,7 +114,7 @@ class Cache(LoggingMixin):  # abc.MutableMapping
 
         Examples
         --------
-        >>> Cache.oftype('rlu')(capacity=128)
+        >>> Cache.oftype('lru')(capacity=128)
 
         Returns
         -------
@@ -86,11 +137,29 @@ class Cache(LoggingMixin):  # abc.MutableMapping
         return kls
 
     def __init_subclass__(cls):
-        # add the subclass to the types dict
-        cls.types[cls.__name__.replace('Cache', '').lower()] = cls
+        # add the subclass to the types dict. Private base classes are skipped
+        if not cls.__name__.startswith('_'):
+            cls.types[cls.__name__.replace('Cache', '').lower()] = cls
 
-    def __init__(self, capacity=DEFAULT_CAPACITY, *args, **kws):
-        self.capacity = int(capacity)
+    def __init__(self, capacity=DEFAULT_CAPACITY, maxbytes=None, *args, **kws):
+        """
+        Parameters
+        ----------
+        capacity : int or str, optional
+            Size limit in number of items, by default 128. Alternatively, a
+            string with units, eg. '512MB', sets a limit on the total size of
+            the cache items in bytes instead.
+        maxbytes : int or str, optional
+            Size limit in bytes, by default None, meaning no limit.
+        """
+        if isinstance(capacity, str):
+            capacity, maxbytes = None, capacity
+
+        self.capacity = None if capacity is None else int(capacity)
+        self.maxbytes = None if maxbytes is None else parse_bytes(maxbytes)
+        # per-entry sizes are only tracked for caches limited in bytes
+        self.sizes = {}
+        self.nbytes = 0
         super().__init__(*args, **kws)
 
     # def __reduce__(self):
@@ -101,6 +170,10 @@ class Cache(LoggingMixin):  # abc.MutableMapping
     def policy(self):
         return remove_suffix(type(self).__name__, 'Cache').lower()
 
+    def params(self):
+        """Initialization parameters. Used for pickling and serialization."""
+        return {'capacity': self.capacity, 'maxbytes': self.maxbytes}
+
     # def __contains__(self, key):
     #     self._update_from_file()
     #     return super().__contains__(key)
@@ -141,6 +214,53 @@ class Cache(LoggingMixin):  # abc.MutableMapping
         while self:
             self.popitem()
 
+    def _track(self, key, value):
+        # update the total size of the cache for a new / updated item
+        if self.maxbytes is not None:
+            self._untrack(key)
+            self.sizes[key] = size = sizeof(key) + sizeof(value)
+            self.nbytes += size
+
+    def _untrack(self, key):
+        self.nbytes -= self.sizes.pop(key, 0)
+
+    def _discard(self, key):
+        # Remove replacement policy metadata for an item that has been removed
+        # from the cache. Subclasses extend this for their own bookkeeping.
+        self._untrack(key)
+
+    def _reset(self):
+        # Remove all replacement policy metadata
+        self.sizes.clear()
+        self.nbytes = 0
+
+    def _full(self):
+        return ((self.capacity is not None and len(self) > self.capacity) or
+                (self.maxbytes is not None and self.nbytes > self.maxbytes))
+
+    def _fits(self, key):
+        # whether the item can be held by an otherwise empty cache
+        return (self.capacity != 0 and
+                (self.maxbytes is None or self.sizes.get(key, 0) <= self.maxbytes))
+
+    def _shrink(self, key=None):
+        # An item (`key`) that alone exceeds the size limit is not kept, rather
+        # than flushing the entire cache to make room for it
+        if not self._fits(key):
+            del self[key]
+            return
+
+        # evict items until we are within capacity
+        while self._full():
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove an item from the cache according to the replacement policy.
+        Subclasses should implement this.
+        """
+        raise NotImplementedError
+
 
 class LRUCache(odict, Cache):
     """
@@ -154,11 +274,15 @@ class LRUCache(odict, Cache):
 
     """
 
-    def __init__(self, capacity=DEFAULT_CAPACITY):
+    def __init__(self, capacity=DEFAULT_CAPACITY, maxbytes=None):
         # initialising capacity
-        # print('LRU.__init__')
-        Cache.__init__(self, capacity)
-        self._move = True
+        Cache.__init__(self, capacity, maxbytes)
+
+    def __reduce__(self):
+        # Re-initialize with the same limits so that items are not evicted when
+        # unpickling. Sizes are restored from the instance state.
+        return (type(self), tuple(self.params().values()), vars(self), None,
+                iter(self.items()))
 
     def __str__(self):
         return Cache.__str__(self)
@@ -171,8 +295,7 @@ class LRUCache(odict, Cache):
         # if we don't find the key in out dict / cache. Also move key to end to
         # show that it was recently used.
         item = super().__getitem__(key)
-        if self._move:
-            self.move_to_end(key)
+        self.move_to_end(key)
         return item
 
     def __setitem__(self, key, value):
@@ -181,10 +304,459 @@ class LRUCache(odict, Cache):
         # exceeded capacity, if so remove first key (least recently used)
         super().__setitem__(key, value)
         self.move_to_end(key)
+        self._track(key, value)
+        self._shrink(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._discard(key)
+
+    def _evict(self):
+        # NOTE: `popitem` may call __getitem__ on subclasses (which would
+        # fail on `move_to_end`). Deleting the oldest key directly avoids
+        # this without toggling shared state, which is not thread safe.
+        del self[next(iter(self))]
+
+    def pop(self, key, *default):
+        self._discard(key)
+        return super().pop(key, *default)
+
+    def popitem(self, last=True):
+        key, value = super().popitem(last)
+        self._discard(key)
+        return key, value
+
+    def clear(self):
+        super().clear()
+        self._reset()
+
+
+class TTLCache(LRUCache):
+    """
+    A Least Recently Used cache in which items additionally expire after a
+    fixed time-to-live since they were inserted or last updated.
+
+    Expired items are purged lazily: on lookup, and before any least recently
+    used item is evicted. Since expiry times are wall clock times, the cache
+    can be persisted and will honour expiry across sessions. Note that the
+    length of the cache may include expired items that have not been purged.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, maxbytes=None, ttl=DEFAULT_TTL):
+        self.ttl = float(ttl)
+        # expiry times ordered by insertion so the first item expires first
+        self.expires = odict()
+        super().__init__(capacity, maxbytes)
+
+    def params(self):
+        return {**super().params(), 'ttl': self.ttl}
+
+    def __contains__(self, key):
+        if not super().__contains__(key):
+            return False
+
+        if self._expired(key):
+            del self[key]
+            return False
+
+        return True
+
+    def __getitem__(self, key):
+        if super().__contains__(key) and self._expired(key):
+            del self[key]
+            raise KeyError(key)
+
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._purge()
+        self.expires.pop(key, None)
+        self.expires[key] = time.time() + self.ttl
+        super().__setitem__(key, value)
+
+    def _expired(self, key):
+        return self.expires.get(key, float('inf')) <= time.time()
+
+    def _purge(self):
+        # remove expired items, returning the number removed
+        now = time.time()
+        expired = []
+        for key, deadline in self.expires.items():
+            if deadline > now:
+                break
+            expired.append(key)
+
+        for key in expired:
+            del self[key]
+
+        return len(expired)
+
+    def _evict(self):
+        # only evict an unexpired item if there are no expired ones
+        if not self._purge():
+            super()._evict()
+
+    def _discard(self, key):
+        self.expires.pop(key, None)
+        super()._discard(key)
+
+    def _reset(self):
+        self.expires.clear()
+        super()._reset()
+
+
+# ---------------------------------------------------------------------------- #
+class _DictCache(dict, Cache):
+    """
+    Base class for caches that keep their replacement policy metadata in
+    auxiliary structures alongside a plain dict. Subclasses implement the
+    following hooks:
+
+        _hit(key):      An item in the cache was accessed or updated.
+        _miss(key):     A new item is about to be admitted. This is called
+                        before making room for it, so the new item is never
+                        chosen for eviction by `_evict`.
+        _evict():       Remove one item according to the replacement policy.
+        _admit(key):    Register a new item after room has been made for it.
+        _discard(key):  Remove metadata for an item that left the cache.
+        _reset():       Remove all metadata.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, maxbytes=None):
+        Cache.__init__(self, capacity, maxbytes)
+        self._reset()
+
+    def __reduce__(self):
+        # Restore items and policy metadata as is. Re-inserting the items would
+        # alter the metadata, or even reject items depending on the policy.
+        return type(self), tuple(self.params().values()), (dict(self), vars(self))
+
+    def __setstate__(self, state):
+        items, attrs = state
+        dict.update(self, items)
+        vars(self).update(attrs)
+
+    def __str__(self):
+        return Cache.__str__(self)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self._hit(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self:
+            super().__setitem__(key, value)
+            self._hit(key)
+            self._track(key, value)
+            self._shrink(key)
+            return
+
+        super().__setitem__(key, value)
+        self._track(key, value)
+        self._miss(key)
+        self._shrink(key)
+        if super().__contains__(key):
+            self._admit(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._discard(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def update(self, *args, **kws):
+        # NOTE: `dict.update` does not call `__setitem__`
+        for key, value in dict(*args, **kws).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+
+        value = super().pop(key)
+        self._discard(key)
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._discard(key)
+        return key, value
+
+    def clear(self):
+        super().clear()
+        self._reset()
+
+    def _hit(self, key):
+        pass
+
+    def _miss(self, key):
+        pass
+
+    def _admit(self, key):
+        pass
+
+
+class LFUCache(_DictCache):
+    """
+    A Least Frequently Used cache with O(1) lookup, insertion and eviction.
+    Items are kept in buckets of equal access frequency. Ties are resolved by
+    evicting the least recently used item from the lowest frequency bucket.
+
+    See:
+    http://dhruvbird.com/lfu.pdf
+    """
+
+    def _reset(self):
+        super()._reset()
+        self.counts = {}
+        self.buckets = defaultdict(odict)
+        self.minfreq = 0
+
+    def _unlink(self, key):
+        # remove key from its frequency bucket
+        freq = self.counts.pop(key)
+        bucket = self.buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[freq]
+        return freq
+
+    def _link(self, key, freq):
+        self.counts[key] = freq
+        self.buckets[freq][key] = None
+
+    def _hit(self, key):
+        freq = self._unlink(key)
+        if self.minfreq == freq and freq not in self.buckets:
+            self.minfreq += 1
+        self._link(key, freq + 1)
+
+    def _admit(self, key):
+        self._link(key, 1)
+        self.minfreq = 1
+
+    def _evict(self):
+        if self.minfreq not in self.buckets:
+            # bucket emptied by consecutive evictions or explicit deletion
+            self.minfreq = min(self.buckets)
+
+        del self[next(iter(self.buckets[self.minfreq]))]
+
+    def _discard(self, key):
+        if key in self.counts:
+            self._unlink(key)
+        super()._discard(key)
+
+
+class ARCCache(_DictCache):
+    """
+    Adaptive Replacement Cache. Balances recency and frequency by splitting
+    the cache into a list of items seen once recently (T1) and items seen at
+    least twice recently (T2). Ghost lists (B1, B2) remember the keys recently
+    evicted from each. A hit on a ghost entry adapts the target size `p` of T1
+    towards the list that would have produced a hit, which makes ARC resistant
+    to scans that would flush an LRU cache.
+
+    Caches limited only by size in bytes use the current number of items as
+    the adaptation scale.
+
+    See:
+    https://www.usenix.org/legacy/events/fast03/tech/full_papers/megiddo/megiddo.pdf
+    """
+
+    def _reset(self):
+        super()._reset()
+        self.t1, self.t2, self.b1, self.b2 = odict(), odict(), odict(), odict()
+        self.p = 0.
+        self._ghost = None
+
+    def _scale(self):
+        return self.capacity or max(len(self), 1)
+
+    def _hit(self, key):
+        # item seen (at least) twice: move to most recently used end of T2
+        self.t1.pop(key, None)
+        self.t2.pop(key, None)
+        self.t2[key] = None
+
+    def _miss(self, key):
+        # adapt the target size of T1 on ghost hits
+        c = self._scale()
+        self._ghost = None
+        if key in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) / len(self.b1), 1))
+            del self.b1[key]
+            self._ghost = self.b1
+        elif key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) / len(self.b2), 1))
+            del self.b2[key]
+            self._ghost = self.b2
+
+    def _evict(self):
+        # REPLACE: demote the LRU item from T1 or T2 to the corresponding ghost
+        # list depending on the target size of T1
+        t1 = len(self.t1)
+        if self.t1 and (t1 > self.p or (self._ghost is self.b2 and t1 == self.p)
+                        or not self.t2):
+            key, ghosts = next(iter(self.t1)), self.b1
+        else:
+            key, ghosts = next(iter(self.t2)), self.b2
+
+        del self[key]
+        ghosts[key] = None
+
+    def _admit(self, key):
+        # items that were recently evicted are promoted to the frequent list
+        (self.t1 if self._ghost is None else self.t2)[key] = None
+        self._ghost = None
+
+        # bound the directory size: |T1| + |B1| <= c, and total <= 2c
+        c = self._scale()
+        while self.b1 and len(self.t1) + len(self.b1) > c:
+            self.b1.popitem(last=False)
+
+        while self.b2 and (len(self.t1) + len(self.t2) +
+                           len(self.b1) + len(self.b2)) > 2 * c:
+            self.b2.popitem(last=False)
+
+    def _discard(self, key):
+        self.t1.pop(key, None)
+        self.t2.pop(key, None)
+        super()._discard(key)
+
+
+class _FrequencySketch:
+    """
+    Count-min sketch of approximate access frequencies with 4 hash functions
+    and small saturating counters. Counters are halved periodically so that
+    the frequencies of items that are no longer popular decay.
+    """
+
+    __slots__ = ('table', 'mask', 'samples', 'period')
+
+    SEEDS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+    MAXCOUNT = 15
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        width = 1 << max(4, (int(capacity) - 1).bit_length())
+        self.table = [[0] * width for _ in self.SEEDS]
+        self.mask = width - 1
+        self.samples = 0
+        self.period = 10 * width
+
+    def _indices(self, key):
+        h = hash(key)
+        return (((h ^ (h >> 16)) * seed >> 8) & self.mask for seed in self.SEEDS)
+
+    def __getitem__(self, key):
+        return min(row[i] for row, i in zip(self.table, self._indices(key)))
+
+    def increment(self, key):
+        for row, i in zip(self.table, self._indices(key)):
+            if row[i] < self.MAXCOUNT:
+                row[i] += 1
+
+        self.samples += 1
+        if self.samples >= self.period:
+            self.age()
+
+    def age(self):
+        for row in self.table:
+            row[:] = [count >> 1 for count in row]
+        self.samples //= 2
+
+
+class TinyLFUCache(_DictCache):
+    """
+    Window TinyLFU (W-TinyLFU) cache. New items enter a small LRU window. Items
+    evicted from the window are candidates for the main cache, which is a
+    segmented LRU with a probationary and a protected segment. A candidate is
+    only admitted to the main cache if its estimated access frequency exceeds
+    that of the main cache's eviction victim, otherwise the candidate itself is
+    evicted. Frequencies are estimated by an aging count-min sketch, so the
+    admission filter adapts to changing popularity at a small memory cost.
+    This makes the cache robust to scans and one-hit wonders that thrash LRU.
+
+    See:
+    https://arxiv.org/abs/1512.00727
+    """
 
-        if len(self) > self.capacity:
-            # `popitem` will call __getitem__, but fail on `move_to_end`
-            # unless we set `_move` to False. bit hackish
-            self._move = False
-            self.popitem(last=False)
-            self._move = True
+    def __init__(self, capacity=DEFAULT_CAPACITY, maxbytes=None, window=0.01):
+        self.window = float(window)
+        super().__init__(capacity, maxbytes)
+
+    def params(self):
+        return {**super().params(), 'window': self.window}
+
+    def _reset(self):
+        super()._reset()
+        self.sketch = _FrequencySketch(self.capacity or DEFAULT_CAPACITY)
+        self.lru = odict()          # admission window
+        self.probation = odict()    # main cache, seen once in main
+        self.protected = odict()    # main cache, seen again while in main
+
+    def _limits(self):
+        # size limits for the window and protected segments
+        c = self.capacity or max(len(self), 1)
+        return max(1, int(c * self.window)), int(0.8 * c)
+
+    def _hit(self, key):
+        self.sketch.increment(key)
+        if key in self.lru:
+            self.lru.move_to_end(key)
+        elif key in self.protected:
+            self.protected.move_to_end(key)
+        elif key in self.probation:
+            # promote to protected, demoting the LRU protected item if needed
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self._limits()[1]:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+
+    def _miss(self, key):
+        self.sketch.increment(key)
+
+    def _victim(self):
+        for segment in (self.probation, self.protected):
+            if segment:
+                return next(iter(segment))
+
+    def _evict(self):
+        candidate = next(iter(self.lru)) if self.lru else None
+        victim = self._victim()
+        if candidate is None or victim is None:
+            del self[victim if candidate is None else candidate]
+            return
+
+        if len(self.lru) < self._limits()[0]:
+            # window not full: evict from main
+            del self[victim]
+            return
+
+        # admission filter: the window candidate duels the main victim
+        if self.sketch[candidate] > self.sketch[victim]:
+            del self[victim]
+            del self.lru[candidate]
+            self.probation[candidate] = None
+        else:
+            del self[candidate]
+
+    def _admit(self, key):
+        self.lru[key] = None
+        # overflow from the window moves to the main cache while there is room
+        if len(self.lru) > self._limits()[0]:
+            candidate, _ = self.lru.popitem(last=False)
+            self.probation[candidate] = None
+
+    def _discard(self, key):
+        for segment in (self.lru, self.probation, self.protected):
+            segment.pop(key, None)
+        super()._discard(key)
@@ -4,6 +4,7 @@ Cache / Memoization decorators and helpers.
 
 
 # std
+import time
 import numbers
 import warnings
 from collections import abc
@@ -16,11 +17,36 @@ from ..decorators import Decorator
 from ..logging import LoggingMixin
 from ..pprint.callers import describe
 from ..oo.property import CachedProperty
-from .manager import CacheManager
+from .manager import CacheManager, null
 from .caches import DEFAULT_CAPACITY
 
 
 # ---------------------------------------------------------------------------- #
+# Builtin types whose instances are immutable and hashable (when their elements
+# are). Parameter values of these types are used in the cache key as is.
+ATOMIC_TYPES = (int, float, complex, bool, str, bytes, tuple, frozenset, range,
+                type, type(None), type(...))
+
+# Template for generated key functions
+KEY_FUNC_TEMPLATE = """\
+def {name}{signature}:
+{body}    return ({key})
+"""
+
+# ---------------------------------------------------------------------------- #
+
+
+class _Source:
+    # Object with custom repr, used to render parameter defaults in the source
+    # code of the generated key function
+
+    __slots__ = ('text', )
+
+    def __init__(self, text):
+        self.text = str(text)
+
+    def __repr__(self):
+        return self.text
 
 
 def check_hashable_defaults(func):
@@ -93,34 +119,41 @@ class Cached(Decorator, LoggingMixin):
           the caching is merely skipped instead of raising a TypeError.
         * Raises TypeError when attempting to decorate a function with
           non-hashable default arguments.
+        * Optional thread safety with single-flight de-duplication: concurrent
+          calls with the same parameters trigger exactly one computation.
+        * Usage statistics are available via the `cache_info` method on the
+          decorated function. These include hit / miss / eviction counts as
+          well as the mean compute time of misses and the total time saved by
+          cache hits, to see if the cache is amortising compute costs.
 
     TODO:
-        thread safety.
-        some stats like ftl.lru_cache
-        limit capacity in MB
         more serialization formats
-        more cache types
-        telemetry to see if chache is amortising compute costs or not
 
     """
 
     @classmethod
     def to_file(cls, filename, capacity=DEFAULT_CAPACITY, policy='lru',
-                ignore=(), typed=(), enabled=True):
+                ignore=(), typed=(), enabled=True, concurrent=False,
+                write_behind=False, shared=False, **kws):
         """
         Decorator for persistent function memoization that saves cache to file
-        as a pickle / json / ...
+        as a pickle / json / ... A filename with extension '.db' or '.sqlite'
+        selects an SQLite database, and '.cache' a compact binary file with a
+        memory-mapped key index. In both, entries are written individually on
+        insertion and looked up without loading the entire cache.
         """
 
         # this here simply to make `filename` a required arg
-        return cls(filename, capacity, policy, ignore, typed, enabled)
+        return cls(filename, capacity, policy, ignore, typed, enabled,
+                   concurrent, write_behind, shared, **kws)
 
     @staticmethod
     def property(depends_on=(), read_only=False):
         return CachedProperty(depends_on, read_only)
 
     def __init__(self, filename=None, capacity=DEFAULT_CAPACITY, policy='lru',
-                 ignore=(), typed=(), enabled=True):
+                 ignore=(), typed=(), enabled=True, concurrent=False,
+                 write_behind=False, shared=False, **kws):
         """
         A general purpose decorator for function return value caching
         (memoization).
@@ -130,10 +163,13 @@ class Cached(Decorator, LoggingMixin):
         filename : str or Path, optional
             Location on disc for persistent caching. If None, the default, the
             cache will be active for the duration of the main programme only.
-        capacity : int, optional
-            Size limit in number of items, by default 128.
-        policy : str, optional
-            Replacent policy, by default 'lru'. Currently only lru support.
+        capacity : int or str, optional
+            Size limit in number of items, by default 128. Alternatively, a
+            size limit in bytes can be given as a string with units, eg:
+            '512MB'. Items are then evicted according to the replacement
+            policy until the estimated total size is within budget.
+        policy : {'lru', 'lfu', 'ttl', 'arc', 'tinylfu'}, optional
+            Replacement policy, by default 'lru'.
         ignore : collection of str
             Parameter names that will be ignored when computing the hash key.
         typed : dict, optional
@@ -145,7 +181,38 @@ class Cached(Decorator, LoggingMixin):
             given in the `typed` by their name (string), or position (int) for
             position-only or positional-or-keyword parameters. If a parameter is
             not found in the `typed` mapping, we default to the builtin hash
-            mechanism.
+            mechanism. Types can also be used as keys, in which case the
+            function is applied to all parameter values of that type, eg:
+            `{np.ndarray: hashers.hexdigest}` to cache calls with array
+            parameters by their content. See `recipes.caching.hashers` for
+            stable content hashes of arrays and nested data.
+        enabled : bool, optional
+            Whether caching is active, by default True.
+        concurrent : bool, optional
+            Make the cache safe for use from multiple threads, by default False.
+            Cache access is then locked, and concurrent calls that miss the
+            cache with the same key are de-duplicated, so that only one thread
+            computes the result while the others wait for it.
+        write_behind : bool or float or dict, optional
+            Save a persistent cache to file in a background thread, by default
+            False. Insertions then only mark the cache as dirty, and the
+            decorated function returns without waiting for the file to be
+            written. Pending changes are flushed periodically, once the number
+            of pending changes reaches a threshold, and at interpreter exit. A
+            number sets the flush interval in seconds, while a dict may set
+            both the `interval` and `threshold` parameters.
+        shared : bool, optional
+            Share a persistent cache between processes, by default False. Saves
+            are serialized with an advisory file lock, and merge the entries
+            saved by other processes instead of overwriting them. Lookups that
+            miss check whether the file has changed, so that results computed
+            in one process can be used in another. Pickle and json caches can
+            be shared in this way, and SQLite caches are always safe to share
+            between processes. Packed ('.cache') files support only a single
+            writing process, and raise ValueError if shared.
+        **kws
+            Additional parameters for the replacement policy. For example `ttl`,
+            the time-to-live of cache items in seconds for the 'ttl' policy.
 
         Examples
         --------
@@ -190,7 +257,8 @@ class Cached(Decorator, LoggingMixin):
         self.sig = None
         self.typed = {abc.MutableSequence: tuple,
                       **_check_hashers(typed, ignore)}
-        self.cache = CacheManager(capacity, filename, policy, enabled)
+        self.cache = CacheManager(capacity, filename, policy, enabled,
+                                  concurrent, write_behind, shared, **kws)
 
         # file rotation
         # filename = self.cache.filename
@@ -229,8 +297,9 @@ class Cached(Decorator, LoggingMixin):
             # return the patched object
             return func
 
-        # create decorator
-        decorated = super().__call__(func)
+        # create decorator. Arguments are passed through to the wrapper as is,
+        # since the key function binds them to parameters itself
+        decorated = super().__call__(func, kwsyntax=True)
 
         # check for non-hashable defaults: it is generally impossible to
         #  correctly memoize something that depends on non-hashable arguments.
@@ -244,6 +313,9 @@ class Cached(Decorator, LoggingMixin):
         # resolve typed keys to parameter names
         self.typed, self.retyped = self.resolve_types(self.typed)
 
+        # generate the key function for this signature
+        self._key = self.compile_key()
+
         # since functools.wraps does not work on methods, explicitly decalare
         # decorated function here
         # ftl.update_wrapper(decorated, func)
@@ -252,6 +324,7 @@ class Cached(Decorator, LoggingMixin):
         # convenience. this will allow us to more easily add cache items
         # manually etc.
         decorated.__cache__ = self.cache
+        decorated.cache_info = self.cache.info
         return decorated
 
     def resolve_types(self, mapping, strict=True):
@@ -286,54 +359,126 @@ class Cached(Decorator, LoggingMixin):
             # recasting mutable types as immutable
             for frm, to in self.retyped.items():
                 if isinstance(val, frm):
-                    return to(map(self._convert, val))
+                    # containers are converted item by item, while other
+                    # callables (eg. hash functions) convert the whole value
+                    if isinstance(to, type):
+                        return to(map(self._convert, val))
+                    return to(val)
 
         if convert:
             return convert(val)
 
         return val
 
-    def _gen_hash_key(self, mapping):
+    def _ignored(self, name, val):
+        # Check if parameter should be excluded from the key, logging the
+        # value for non-silent ignores
+        convert = self.typed.get(name)
+        if not isinstance(convert, Ignore):
+            return False
+
+        if not convert.silent:
+            self.logger.opt(lazy=True).debug(
+                'Ignoring argument in {}',
+                lambda: f'{describe(self.__wrapped__)}: {name!r} = {val!r}'
+            )
+        return True
+
+    def _convert_kws(self, kws):
+        # Variadic keyword args (**kws). Keywords are kept in the order they
+        # were passed, and converted to a tuple of 2-tuples (key value pairs)
+        # so we can hash.
+        return tuple((name, self._convert(val, name))
+                     for name, val in kws.items()
+                     if not self._ignored(name, val))
 
-        for name, val in mapping.items():
-            convert = self.typed.get(name)
+    def compile_key(self):
+        """
+        Generate the function that computes the cache key from the parameter
+        values of a call. This is done once at decoration time. The generated
+        function has the same signature as the decorated function, so binding
+        of arguments to parameters (including defaults) is done by the
+        interpreter instead of `inspect.Signature.bind`. The key is built in a
+        single tuple expression specialised to the parameters: Ignored
+        parameters are dropped, `typed` converters are only called for
+        parameters that have them, and values of immutable builtin types skip
+        the `retyped` conversion entirely.
 
-            # Filter ignored params
+        Returns
+        -------
+        function
+            Key function that accepts the same parameters as the decorated
+            function.
+        """
+        # Builtin types that are unaffected by the retyped conversions
+        atomic = tuple(kind for kind in ATOMIC_TYPES
+                       if not issubclass(kind, tuple(self.retyped)))
+
+        # Names of the helpers in the namespace of the key function. These are
+        # padded with underscores until they differ from the names of the
+        # parameters and the function, which would otherwise shadow them
+        name = getattr(self.__wrapped__, '__name__', '')
+        name = name if name.isidentifier() else 'key'
+        reserved = {*self.sig.parameters, name}
+        pad = '_'
+        while True:
+            h = {helper: f'{pad}{helper}_'
+                 for helper in ('type', 'atomic', 'convert', 'convert_kws',
+                                'ignored', 'typed', 'defaults')}
+            if reserved.isdisjoint(h.values()):
+                break
+            pad += '_'
+
+        namespace = {h['type']: type,
+                     h['atomic']: frozenset(atomic),
+                     h['convert']: self._convert,
+                     h['convert_kws']: self._convert_kws,
+                     h['ignored']: self._ignored,
+                     h['typed']: {},
+                     h['defaults']: {}}
+
+        params, body, key = [], [], []
+        for pname, par in self.sig.parameters.items():
+            if par.default is not _empty:
+                namespace[h['defaults']][pname] = par.default
+                par = par.replace(default=_Source(f'{h["defaults"]}[{pname!r}]'))
+            params.append(par.replace(annotation=_empty))
+
+            convert = self.typed.get(pname)
             if isinstance(convert, Ignore):
                 if not convert.silent:
-                    # emit warning on non-silent ignore
-                    self.logger.opt(lazy=True).debug(
-                        'Ignoring argument in {}',
-                        lambda: f'{describe(self.__wrapped__)}: {name!r} = {val!r}'
-                    )
-                # go to next parameter
+                    body.append(f'{h["ignored"]}({pname!r}, {pname})')
                 continue
 
-            # parameter not ignored
-            if (par := self.sig.parameters.get(name)) and (par.kind is _VKW):
-                # deal with variadic keyword args (**kws):
-                yield tuple(zip(val.keys(), self._gen_hash_key(val)))
-
+            if par.kind is _VKW:
+                key.append(f'{h["convert_kws"]}({pname}) if {pname} else ()')
+            elif convert:
+                namespace[h['typed']][pname] = convert
+                key.append(f'{h["typed"]}[{pname!r}]({pname})')
+            elif self.retyped:
+                key.append(f'{pname} if {h["type"]}({pname}) in {h["atomic"]} '
+                           f'else {h["convert"]}({pname})')
             else:
-                yield self._convert(val, name)
-
-            # remove the keys that have been bound to other position-or-keyword
-            # parameters. variadic keyword args can come in any order. To ensure
-            # we resolve calls like foo(a=1, b=2) and foo(b=2, a=1) to the same
-            # cache item, we need to order the keywords. Finally convert to
-            # tuple of 2-tuples (key value pairs) so we can hash
+                key.append(pname)
+
+        code = KEY_FUNC_TEMPLATE.format(
+            name=name,
+            signature=self.sig.replace(parameters=params,
+                                       return_annotation=_empty),
+            body=''.join(f'    {line}\n' for line in body),
+            key=''.join(f'({item}), ' for item in key)
+        )
 
-            # keys = sorted(set(val.keys()) - set(mapping.keys()))
-            # kws = dict(zip(keys, map(val.get, keys)))
-            # yield tuple(self._gen_hash_key(kws))
+        exec(code, namespace)
+        func = namespace[name]
+        func.__source__ = code
+        return func
 
     def get_key(self, *args, **kws):
         """
         Compute cache key from function parameter values
         """
-        bound = self.sig.bind(*args, **kws)
-        bound.apply_defaults()
-        return tuple(self._gen_hash_key(bound.arguments))
+        return self._key(*args, **kws)
 
     def is_hashable(self, params):
         """
@@ -383,17 +528,21 @@ class Cached(Decorator, LoggingMixin):
                               describe(func))
             return func(*args, **kws)
 
-        key = self.get_key(*args, **kws)
-        if not self.is_hashable(key):
-            return func(*args, **kws)
+        key = self._key(*args, **kws)
+        try:
+            hash(key)
+        except TypeError:
+            # find the offending parameter and warn, unless it is nested
+            # inside a hashable container, in which case the lookup below will
+            # fail and be logged
+            if not self.is_hashable(key):
+                self.cache.stats.reject()
+                return func(*args, **kws)
 
         # if we are here, we should be ok to lookup / cache the answer
         # pylint: disable=broad-except
         try:
-            if key in self.cache:
-                self.logger.debug('Intercepted {:s} call: Loading result from '
-                                  'cache.', describe(func))
-                return self.cache[key]
+            answer = self.cache.get(key, null)
         except Exception as error:
             # since caching is not mission critical, just log the error and
             # then run the function
@@ -402,9 +551,42 @@ class Cached(Decorator, LoggingMixin):
                                   describe(func), error)
             return func(*args, **kws)
 
+        if answer is not null:
+            self.logger.opt(lazy=True).debug(
+                'Intercepted {:s} call: Loading result from cache.',
+                lambda: describe(func)
+            )
+            self.cache.stats.hit()
+            return answer
+
         # If we are here, it means there is no cache entry for this call
         # signature. Compute!
+        if self.cache.concurrent:
+            # Collapse concurrent calls with the same key into a single
+            # computation. Callers that receive the result of another thread's
+            # computation are counted as hits.
+            answer, shared = self.cache.flights.do(key, self._fetch,
+                                                   func, key, args, kws)
+            if shared:
+                self.cache.stats.hit()
+            return answer
+
+        return self._compute(func, key, args, kws)
+
+    def _fetch(self, func, key, args, kws):
+        # Lookup again in case a previous flight for this key has landed
+        # between our initial lookup and becoming the leader of this flight
+        answer = self.cache.get(key, null)
+        if answer is null:
+            return self._compute(func, key, args, kws)
+
+        self.cache.stats.hit()
+        return answer
+
+    def _compute(self, func, key, args, kws):
+        start = time.perf_counter()
         answer = func(*args, **kws)
+        self.cache.stats.miss(time.perf_counter() - start)
 
         # If function call succeeded, add result to cache
         try:
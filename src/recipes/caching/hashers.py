@@ -1,11 +1,245 @@
+"""
+Stable content hashing for cache keys.
 
+Unlike the builtin `hash`, the digests computed here do not depend on the
+interpreter's hash seed, so they are repeatable across sessions and processes,
+and can be used for unhashable objects like numpy arrays, lists and dicts. Use
+them to compute cache keys for parameters of memoized functions:
+
+>>> @cached(typed={'data': hashers.hexdigest})
+... def compute(data, n=1):
+...     ...
+
+Objects are hashed by dispatch on their type. Support for new types can be
+added by registering a function that feeds the content of the object into the
+hash state:
+
+>>> @hashers.update.register(MyType)
+... def _(obj, state):
+...     hashers.update(obj.some_attribute, state)
+"""
+
+# std
+import os
+import mmap
+import struct
+import pickle
 import hashlib
+import functools as ftl
+from collections import abc
+
+# third-party
+import numpy as np
+
+# optional
+try:
+    import xxhash
+except ImportError:  # pragma: no cover
+    xxhash = None
+
+
+# ---------------------------------------------------------------------------- #
+DIGEST_SIZE = 16  # bytes
+
+# Fixed pickle protocol for objects that are hashed via their pickled
+# representation, so digests are stable across interpreter versions
+PICKLE_PROTOCOL = 4
+
+# Size of the blocks in which non-contiguous arrays are hashed
+BUFFER_SIZE = 2 ** 16
+
+
+# ---------------------------------------------------------------------------- #
+def new():
+    """
+    New hash state. This is the 128 bit XXH3 hash if the `xxhash` library is
+    available, otherwise blake2b with a 128 bit digest.
+    """
+    if xxhash:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def digest(obj):
+    """Stable digest of the content of `obj` as bytes."""
+    state = new()
+    update(obj, state)
+    return state.digest()
+
+
+def hexdigest(obj):
+    """Stable digest of the content of `obj` as a hexadecimal string."""
+    state = new()
+    update(obj, state)
+    return state.hexdigest()
 
 
 def array(a):
-    #  NOTE: salted hash changes between different python processes so
-    # >>> hash(a.data) # is not reliable
+    """
+    Hash function for array parameters of memoized functions. None and False
+    are passed through unchanged, so that optional array parameters can still
+    be left unset.
+    """
+    return a if (a is None or a is False) else hexdigest(np.asanyarray(a))
+
+
+# ---------------------------------------------------------------------------- #
+# Each object is fed into the hash state with a type tag, and variable length
+# data with its length, so that the encoding is unambiguous. eg: ('ab', 'c') and
+# ('a', 'bc') hash differently, as do 1, 1.0, '1' and b'1'.
+
+def _feed(state, tag, data=b''):
+    state.update(tag)
+    state.update(struct.pack('<Q', len(data)))
+    state.update(data)
+
+
+@ftl.singledispatch
+def update(obj, state):
+    """
+    Feed the content of `obj` into the hash `state`. Objects without a
+    registered implementation are hashed via their pickled representation.
+    """
+    if _is_frame_like(obj):
+        _update_frame(obj, state)
+        return
+
+    try:
+        data = pickle.dumps(obj, PICKLE_PROTOCOL)
+    except Exception as err:
+        raise TypeError(f'Cannot hash object of type {type(obj).__name__}.'
+                        ) from err
+
+    _feed(state, b'P', data)
+
+
+@update.register(type(None))
+@update.register(type(...))
+def _(obj, state):
+    _feed(state, b'N', repr(obj).encode())
+
+
+@update.register(bool)
+def _(obj, state):
+    _feed(state, b'B', b'\x01' if obj else b'\x00')
+
+
+@update.register(int)
+def _(obj, state):
+    _feed(state, b'I', str(obj).encode())
+
+
+@update.register(float)
+def _(obj, state):
+    _feed(state, b'F', struct.pack('<d', obj))
+
+
+@update.register(complex)
+def _(obj, state):
+    _feed(state, b'C', struct.pack('<dd', obj.real, obj.imag))
+
+
+@update.register(str)
+def _(obj, state):
+    _feed(state, b'S', obj.encode('utf-8', 'surrogatepass'))
+
+
+@update.register(bytes)
+@update.register(bytearray)
+@update.register(memoryview)
+def _(obj, state):
+    _feed(state, b'Y', obj)
+
+
+@update.register(type)
+def _(obj, state):
+    _feed(state, b'T', f'{obj.__module__}.{obj.__qualname__}'.encode())
+
+
+@update.register(tuple)
+@update.register(list)
+def _(obj, state):
+    # Sequences are hashed in order. Lists and tuples with the same items hash
+    # equal, in keeping with the `retyped` conversion of lists to tuples for
+    # cache keys.
+    _feed(state, b'L', struct.pack('<Q', len(obj)))
+    for item in obj:
+        update(item, state)
+
+
+@update.register(abc.Set)
+def _(obj, state):
+    # Iteration order of sets is not deterministic across sessions for str
+    # items. Hash the sorted digests of the items.
+    _feed(state, b'E', b''.join(sorted(map(digest, obj))))
+
+
+@update.register(abc.Mapping)
+def _(obj, state):
+    # Mappings hash equal irrespective of insertion order
+    _feed(state, b'M', b''.join(sorted(digest(item) for item in obj.items())))
+
+
+@update.register(np.generic)
+def _(obj, state):
+    update(np.asarray(obj), state)
+
+
+@update.register(np.ndarray)
+def _(a, state):
+    # Arrays are hashed by their data type, shape and content, so that arrays
+    # with the same bytes but different shape (eg: zeros((2, 3)) and
+    # zeros((3, 2))) or type do not collide.
+    if isinstance(a, np.memmap) and isinstance(a.base, mmap.mmap) and \
+            a.mode == 'r':
+        _update_memmap(a, state)
+        return
+
+    if a.dtype.hasobject:
+        # data buffer contains pointers: hash the objects
+        _feed(state, b'O', repr(a.shape).encode())
+        for item in a.flat:
+            update(item, state)
+        return
+
+    # The header holds the full description of the data type, since `dtype.str`
+    # is the same for all structured types of equal size (eg: '|V8').
+    _feed(state, b'A', f'{a.dtype.descr}|{a.shape}'.encode())
+
+    # Content is always hashed in logical (C) order, so arrays hash equal
+    # irrespective of their memory layout. C contiguous arrays are hashed
+    # directly from their buffer without copying.
+    if a.flags.c_contiguous:
+        state.update(a.reshape(-1).view(np.uint8).data)
+        return
+
+    # Other arrays (eg: strided views, Fortran ordered arrays) are hashed in
+    # blocks, copying only one buffer at a time
+    with np.nditer(a, flags=['external_loop', 'buffered', 'zerosize_ok'],
+                   buffersize=BUFFER_SIZE // max(a.itemsize, 1),
+                   order='C') as blocks:
+        for block in blocks:
+            state.update(np.ascontiguousarray(block).view(np.uint8).data)
+
+
+def _update_memmap(a, state):
+    # Read-only memory maps of a file are identified by the file's path,
+    # modification time and size, and the offset, type and shape of the mapped
+    # array, so large files need not be read to be hashed.
+    stat = os.stat(a.filename)
+    _feed(state, b'R',
+          f'{os.path.realpath(a.filename)}|{stat.st_mtime_ns}|{stat.st_size}|'
+          f'{a.offset}|{a.dtype.descr}|{a.shape}|{a.strides}'.encode())
+
+
+def _is_frame_like(obj):
+    # Duck-type check for pandas Series / DataFrame
+    return all(hasattr(obj, name) for name in ('to_numpy', 'index', 'dtypes'))
+
 
-    # NOTE: this is fast enough for small arrays and *repeatable*
-    return (a if (a is None or a is False)
-            else hashlib.md5(a.tobytes()).hexdigest())
+def _update_frame(obj, state):
+    _feed(state, b'D', type(obj).__name__.encode())
+    update(obj.index.to_numpy(), state)
+    if (columns := getattr(obj, 'columns', None)) is not None:
+        update(columns.to_numpy(), state)
+    update(obj.to_numpy(), state)
@@ -0,0 +1,117 @@
+"""
+Synchronization primitives for concurrent cache access.
+"""
+
+# std
+import threading
+
+
+# ---------------------------------------------------------------------------- #
+DEFAULT_STRIPES = 2 ** 4
+
+
+# ---------------------------------------------------------------------------- #
+class StripedLock:
+    """
+    A fixed pool of locks indexed by key hash. Threads operating on keys that
+    map to different stripes never contend with each other.
+    """
+
+    __slots__ = ('locks', )
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        if (stripes := int(stripes)) < 1:
+            raise ValueError(f'Number of stripes should be positive, not {stripes}.')
+
+        self.locks = tuple(threading.Lock() for _ in range(stripes))
+
+    def __len__(self):
+        return len(self.locks)
+
+    def __getitem__(self, key):
+        return self.locks[self.index(key)]
+
+    def index(self, key):
+        """Index of the stripe guarding `key`."""
+        return hash(key) % len(self.locks)
+
+
+class _Flight:
+    """A computation in progress, awaited by all callers of the same key."""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Duplicate call suppression. Concurrent calls for the same key are collapsed
+    so that the first caller (the leader) does the computation, while all other
+    callers block until the result is available and then share it. Each stripe
+    owns its own table of in-flight keys, so registering a flight only contends
+    with threads asking for keys in the same stripe.
+
+    Examples
+    --------
+    >>> flights = SingleFlight()
+    ... flights('key', expensive, *args)
+    ... result, shared = flights.do('key', expensive, *args)
+    """
+
+    __slots__ = ('locks', 'flights')
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        self.locks = StripedLock(stripes)
+        self.flights = tuple({} for _ in range(len(self.locks)))
+
+    def __call__(self, key, func, *args, **kws):
+        return self.do(key, func, *args, **kws)[0]
+
+    def do(self, key, func, *args, **kws):
+        """
+        Call `func(*args, **kws)` unless a call for `key` is already in flight,
+        in which case wait for that call to complete and share its result.
+
+        Returns
+        -------
+        result : object
+            The return value of the function call.
+        shared : bool
+            Whether the result was computed by a different caller.
+        """
+        index = self.locks.index(key)
+        lock, flights = self.locks.locks[index], self.flights[index]
+
+        with lock:
+            flight = flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = flights[key] = _Flight()
+
+        if not leader:
+            return flight.wait(), True
+
+        try:
+            flight.result = func(*args, **kws)
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with lock:
+                del flights[key]
+            flight.done.set()
+
+        return flight.result, False
+
+    def __len__(self):
+        """Number of computations currently in flight."""
+        return sum(map(len, self.flights))
@@ -1,27 +1,57 @@
 
 
 # std
+import os
 import json
+import tempfile
+import threading
+import contextlib as ctx
 from pathlib import Path
+from collections import abc, OrderedDict as odict
 
 # third-party
 from loguru import logger
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # advisory file locks are not available on windows
+    fcntl = None
+
 # relative
 from ..logging import LoggingMixin
 from ..pprint.mapping import pformat
+from ..oo.size import get_object_size
 from ..io import deserialize, guess_format, serialize
 from . import DEFAULT_CAPACITY, Cache
+from .locks import SingleFlight
+from .packed import PackedCache, EXTENSIONS as PACKED_EXTENSIONS
+from .sqlite import SQLiteCache, EXTENSIONS as SQLITE_EXTENSIONS
+from .stats import CacheInfo, CacheStats
+from .writer import WriteBehind
 
 
 # TODO: serializing the Cache class is error prone and hard to maintain.
 # Better to simply serialize the dict and init the cache from that??
 
-# TODO: sqlite, yaml, dill, jsons, msgpack
+# TODO: yaml, dill, jsons, msgpack
 
 
 null = object()
 
+# Backends that read and write entries individually, by file extension
+BACKENDS = {**dict.fromkeys(SQLITE_EXTENSIONS, SQLiteCache),
+            **dict.fromkeys(PACKED_EXTENSIONS, PackedCache)}
+
+
+def get_backend(filename):
+    """
+    Get the incremental cache class for `filename` based on its extension, or
+    None if the file extension selects a format that is saved in one go.
+    """
+    return BACKENDS.get(Path(filename).suffix) if filename else None
+
+
 # ------------------------------- json helpers ------------------------------- #
 
 
@@ -50,8 +80,9 @@ class JSONCacheEncoder(json.JSONEncoder):
             # note json does not support tuples, so hashability is lost here
             return {
                 obj.__class__.__name__: {
-                    **{at: getattr(obj, at) for at in obj.__slots__},
-                    **{'data': tuple(obj.data.items())}
+                    **{at: getattr(obj, at) for at in obj.__persist__},
+                    **{'data': tuple(obj.data.items()),
+                       'params': obj.data.params()}
                 }
             }
 
@@ -71,7 +102,8 @@ def cache_decoder(mapping):
     kws = mapping[name]
     # since json convert all tuples to list, we have to remap
     # to tuples to preserve hashability
-    cache = Cache.oftype(kws['policy'])(kws['capacity'])
+    params = kws.pop('params', {'capacity': kws['capacity']})
+    cache = Cache.oftype(kws['policy'])(**params)
     cache.update({lists_to_tuples(key): val
                   for key, val in kws.pop('data')})
     kws['data'] = cache
@@ -81,8 +113,9 @@ def cache_decoder(mapping):
 
     # load Manager
     obj = object.__new__(CacheManager)
-    for at in CacheManager.__slots__:
+    for at in CacheManager.__persist__:
         setattr(obj, at, kws[at])
+    obj._init_runtime()
 
     # kls = Cache.types_by_name().get(name)
     # if not kls:
@@ -103,6 +136,65 @@ class CacheDecoder(json.JSONDecoder):
 LOAD_KWS = {json: {'object_hook': cache_decoder}}
 SAVE_KWS = {json: {'cls': JSONCacheEncoder}}
 
+
+def _fsync(path):
+    # Flush a file, or the entries of a folder, to disk
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # pragma: no cover
+        # folders cannot be opened on windows
+        return
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@ctx.contextmanager
+def atomic(filename):
+    """
+    Context manager yielding a temporary file name in the same folder as
+    `filename`, which atomically replaces `filename` if the context exits
+    without error. Readers therefore never see a partially written file.
+    """
+    path = Path(filename)
+    fd, tmp = tempfile.mkstemp(prefix=f'.{path.name}.', dir=path.parent)
+    os.close(fd)
+    # mkstemp creates files readable only by the owner
+    os.chmod(tmp, path.stat().st_mode if path.exists() else 0o644)
+    try:
+        yield tmp
+        # the new file has to be complete on disk before it replaces the old
+        # one, or a crash could leave a truncated file behind
+        _fsync(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink()
+        raise
+
+    # persist the rename
+    _fsync(path.parent)
+
+
+@ctx.contextmanager
+def file_lock(filename):
+    """
+    Context manager holding an exclusive advisory lock on `filename`.lock. The
+    lock is held on a separate file since atomic replacement of `filename`
+    changes its inode.
+    """
+    if fcntl is None:
+        raise NotImplementedError('File locking requires the `fcntl` module '
+                                  'which is unavailable on this platform.')
+
+    with open(f'{filename}.lock', 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
 # ---------------------------------------------------------------------------- #
 
 
@@ -111,21 +203,71 @@ class CacheManager(LoggingMixin):
     Manages cache saving and loading etc.
     """
 
-    __slots__ = ('capacity', 'policy', 'data', 'enabled', 'stale', '_filename')
+    __slots__ = ('capacity', 'policy', 'data', 'enabled', 'stale', '_filename',
+                 'lock', 'flights', 'stats', 'writer', 'shared', 'synced',
+                 'pending', '__weakref__')
+
+    # attributes that are saved to file. The remaining slots hold runtime state
+    # (locks, usage statistics, background writer, file synchronization) which
+    # is not serialized
+    __persist__ = ('capacity', 'policy', 'data', 'enabled', 'stale', '_filename')
 
     def __init__(self, capacity=DEFAULT_CAPACITY, filename=None, policy='lru',
-                 enabled=True):
+                 enabled=True, concurrent=False, write_behind=False,
+                 shared=False, **kws):
 
-        self.capacity = int(capacity)
+        # capacity is either an item count, or a size in bytes eg: '512MB'
+        self.capacity = capacity if isinstance(capacity, str) else int(capacity)
         self.policy = str(policy).lower()
+        self._init_runtime(concurrent, write_behind, shared)
+        # database backed caches are set up when assigning the filename
+        self.data = None
         self.filename = str(filename) if filename else None
         # self.logger.debug(self.__name__, f'{capacity=}; {filename=}')
 
-        # if caching to disc and file exists, flag that we need to load it
-        self.data = Cache.oftype(policy)(capacity)  # the actual cache
-        self.stale = bool(self.filename) and self.path.exists()
+        if self.data is None:
+            # the actual cache. Additional keywords are policy parameters eg: ttl
+            self.data = Cache.oftype(policy)(capacity, **kws)
+            # if caching to disc and file exists, flag that we need to load it
+            self.stale = bool(self.filename) and self.path.exists()
+
         self.enabled = bool(enabled)
 
+    def _init_runtime(self, concurrent=False, write_behind=False, shared=False):
+        # The re-entrant lock guards the replacement-policy bookkeeping of the
+        # underlying cache (which mutates even on lookup), while computations
+        # are de-duplicated per key by the lock-striped `SingleFlight`. The
+        # lock is also needed to save the cache from the background thread.
+        locked = concurrent or write_behind
+        self.lock = threading.RLock() if locked else ctx.nullcontext()
+        self.flights = SingleFlight() if concurrent else None
+        self.stats = CacheStats(self.lock)
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehind(self._flush, **(
+                write_behind if isinstance(write_behind, abc.Mapping) else
+                {} if write_behind is True else
+                {'interval': write_behind}
+            ))
+
+        # Multi-process synchronization: file signature at last load / save,
+        # and insertions since then
+        if shared and fcntl is None:
+            raise NotImplementedError('Sharing a cache between processes '
+                                      'requires file locking via `fcntl`, '
+                                      'which is unavailable on this platform.')
+        self.shared = bool(shared)
+        self.synced = None
+        self.pending = odict()
+
+    def __getstate__(self):
+        return {at: getattr(self, at) for at in self.__persist__}
+
+    def __setstate__(self, state):
+        for at, val in state.items():
+            setattr(self, at, val)
+        self._init_runtime()
+
     def __str__(self):
         info = {}
         if self.filename:
@@ -133,6 +275,7 @@ class CacheManager(LoggingMixin):
 
         info.update(polcy=self.policy,
                     active=self.enabled,
+                    concurrent=self.concurrent,
                     size=f'{len(self.data)}/{self.capacity}')
 
         info = pformat(info, type(self).__name__, lhs=str, rhs=str, brackets='[]')
@@ -154,34 +297,116 @@ class CacheManager(LoggingMixin):
         self.stale = True
         path.parent.mkdir(exist_ok=True)
 
+        if backend := get_backend(path):
+            if self.shared and backend is PackedCache:
+                raise ValueError(
+                    f'Packed cache files ({", ".join(PACKED_EXTENSIONS)}) '
+                    'support only a single writing process, and cannot be '
+                    'shared. Use an SQLite database (".db") instead.'
+                )
+
+            # Entries are read and written incrementally from the database /
+            # packed file, so there is never anything to load. Existing entries
+            # are migrated.
+            self.stale = False
+            data = self.data
+            self.data = backend(path, self.capacity, policy=self.policy)
+            if data:
+                self.data.update(data.items())
+
     @property
     def path(self):
         if self.filename:
             return Path(self.filename)
 
+    @property
+    def incremental(self):
+        """Whether entries are written to file individually on insertion."""
+        return isinstance(self.data, tuple(BACKENDS.values()))
+
+    @property
+    def nbytes(self):
+        """Estimated memory footprint of the cached items in bytes."""
+        if self.data.maxbytes is None and not self.incremental:
+            # sizes not tracked for caches limited by item count
+            return get_object_size(self.data)
+        return self.data.nbytes
+
+    @property
+    def concurrent(self):
+        return self.flights is not None
+
     def __eq__(self, other):
+        # NOTE: staleness is runtime state that depends on when the cache
+        # was saved, so it is not compared
         return (isinstance(other, type(self)) and
-                (self.data == other.data) and
-                (self.__dict__ == other.__dict__))
+                all(getattr(self, at) == getattr(other, at)
+                    for at in self.__persist__ if at != 'stale'))
 
     def __contains__(self, key):
-        self._update_from_file()
-        return key in self.data
+        with self.lock:
+            self._update_from_file()
+            return key in self.data or (self._refresh() and key in self.data)
 
     def __getitem__(self, key):
-        self._update_from_file()
-        return self.data[key]
+        with self.lock:
+            self._update_from_file()
+            if key not in self.data:
+                self._refresh()
+            return self.data[key]
 
     def __setitem__(self, key, val):
-        self.data[key] = val
-
-        # TODO: save in a thread so we can return value immediately!
-        if self.filename:
-            self.save()
-            self.stale = False
+        with self.lock:
+            # count items dropped by the replacement policy
+            size = len(self.data) + (key not in self.data)
+            self.data[key] = val
+            if (evicted := size - len(self.data)):
+                self.stats.evict(evicted)
+
+            if self.filename and not self.incremental:
+                if self.shared:
+                    self.pending[key] = None
+
+                if self.writer:
+                    # defer saving to the background thread
+                    self.writer.mark()
+                else:
+                    self.save()
+                self.stale = False
         return val
 
+    def _flush(self):
+        with self.lock:
+            if self.filename and not self.incremental:
+                self.save()
+
+    def flush(self):
+        """Write any changes that are pending in write-behind mode."""
+        if self.writer:
+            self.writer.flush()
+
+    def close(self):
+        """
+        Stop the background thread in write-behind mode, writing any pending
+        changes.
+        """
+        writer = getattr(self, 'writer', None)
+        if writer:
+            writer.close()
+            if writer.dirty:
+                # The writer holds us by weak reference, which is already dead
+                # when we are collected as part of a reference cycle
+                self._flush()
+                writer.dirty = 0
+
+    def __del__(self):
+        self.close()
+
     def _update_from_file(self):
+        if self.stale and self.shared:
+            self._refresh()
+            self.stale = False
+
         if self.stale and self.filename and self.path.exists():
             clone = self.load(self.filename)
             # self.data.update(clone.data)
@@ -190,7 +415,52 @@ class CacheManager(LoggingMixin):
             self.stale = False
 
     def get(self, key, default=None):
-        return self.data.get(key, default)
+        # NOTE: A single locked lookup. Testing `key in self` before `self[key]`
+        # is not atomic and may fail if the item is evicted in between.
+        with self.lock:
+            self._update_from_file()
+            value = self.data.get(key, null)
+            if value is null and self._refresh():
+                # entry may have been added by another process
+                value = self.data.get(key, null)
+            return default if value is null else value
+
+    # ------------------------------------------------------------------------ #
+    # Multi-process synchronization
+
+    def _signature(self):
+        # Identifies a version of the cache file. Since files are replaced
+        # atomically on save, the inode changes with every write.
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        """
+        Merge entries that were saved by other processes since our last load or
+        save. Returns True if the cache file changed, False otherwise.
+        """
+        if not (self.shared and self.filename) or self.incremental:
+            return False
+        return self._merge()
+
+    def _merge(self):
+        # Replace the in-memory cache with the one on disk, re-applying
+        # insertions that have not been saved yet
+        signature = self._signature()
+        if signature is None or signature == self.synced:
+            return False
+
+        data = self.load(self.filename).data
+        for key in self.pending:
+            if key in self.data:
+                data[key] = self.data.get(key)
+
+        self.data = data
+        self.synced = signature
+        return True
 
     def enable(self, filename=None):
         """
@@ -211,6 +481,26 @@ class CacheManager(LoggingMixin):
     def disable(self):
         self.enabled = False
 
+    def info(self):
+        """
+        Cache usage statistics.
+
+        Note that computing the memory footprint (`bytes`) requires traversing
+        all items in the cache.
+
+        Returns
+        -------
+        CacheInfo
+            Named tuple with fields: hits, misses, evictions, rejected, size,
+            capacity, bytes, mean_compute_time, time_saved.
+        """
+        with self.lock:
+            stats = self.stats
+            return CacheInfo(stats.hits, stats.misses, stats.evictions,
+                             stats.rejected, len(self.data), self.capacity,
+                             self.nbytes,
+                             stats.mean_compute_time, stats.time_saved)
+
     @classmethod
     def load(cls, filename, **kws):
         """
@@ -236,17 +526,36 @@ class CacheManager(LoggingMixin):
         # load existing cache
         cls.logger.info('Loading cache at {!r}.', filename)
 
+        if backend := get_backend(filename):
+            return cls._from_backend(backend, filename)
+
         # dispatch loading on file extension
         fmt = guess_format(filename)
         cache = deserialize(filename, fmt, **{**kws, **LOAD_KWS.get(fmt, {})})
 
         # print info
-        logger.debug('Loaded {!r} containing {:d}/{:d} entries.',
+        logger.debug('Loaded {!r} containing {:d}/{} entries.',
                      type(cache.data).__name__, len(cache.data),
                      cache.capacity)
 
         return cache
 
+    @classmethod
+    def _from_backend(cls, backend, filename):
+        # Open database / packed file with the limits and replacement policy
+        # stored in it
+        data = backend(filename)
+        obj = object.__new__(cls)
+        obj.capacity = (f'{data.maxbytes}B' if data.capacity is None
+                        else data.capacity)
+        obj.policy = data.policy
+        obj.data = data
+        obj.enabled = True
+        obj.stale = False
+        obj._filename = str(filename)
+        obj._init_runtime()
+        return obj
+
     def check_filename(self, filename):
         filename = filename or self.filename
         if filename is None:
@@ -256,17 +565,31 @@ class CacheManager(LoggingMixin):
     def save(self, filename=None, **kws):
         """save the cache in chosen format."""
         filename = self.check_filename(filename)
+        if self.incremental and filename == self.filename:
+            # nothing to do: entries are written as they are inserted
+            return
 
         self.logger.debug('Saving cache: {!r}.', filename)
         fmt = guess_format(filename)
 
-        if fmt is json:
-            self.to_json()
-        else:
-            # TODO: might be slow for large caches - do in thread?
-            # more optimal save methods might also exist for specific policies!
-            serialize(filename, self, fmt,
-                      **{**kws, **SAVE_KWS.get(fmt, {})})
+        # Processes sharing a cache merge their entries with those saved by
+        # other processes while holding the file lock, instead of overwriting
+        shared = self.shared and filename == self.filename
+        with self.lock, (file_lock(filename) if shared else ctx.nullcontext()):
+            if shared:
+                self._merge()
+
+            # write to a temporary file which then replaces the cache file
+            with atomic(filename) as tmp:
+                if fmt is json:
+                    self.to_json(tmp, **kws)
+                else:
+                    # more optimal save methods might exist for specific policies!
+                    serialize(tmp, self, fmt, **{**kws, **SAVE_KWS.get(fmt, {})})
+
+            if shared:
+                self.synced = self._signature()
+                self.pending.clear()
         #
         self.logger.debug('Saved: {!r}.', filename)
 
@@ -0,0 +1,461 @@
+"""
+Compact binary cache file format with a memory-mapped key index.
+
+File layout (all integers little-endian)::
+
+    header      magic, table size, counters and cache limits (128 bytes)
+    index       open addressing hash table of key digests. Each slot holds the
+                digest, record offset and length, value size and the
+                replacement policy metadata (56 bytes per slot)
+    records     length-prefixed records: key size, value size, pickled
+                value, pickled key
+
+Only the header and index are memory-mapped. A lookup probes the index and
+then reads the single requested value from disk, so it does not depend on the
+size of the file. New records are appended to the end of the file and
+registered in the index in place. The file is rewritten (with a larger index,
+and without the records of deleted entries) only when the index fills up, or
+when dead records take up more space than live ones.
+"""
+
+# std
+import os
+import mmap
+import struct
+import pickle
+import threading
+from pathlib import Path
+from collections import abc
+
+# third-party
+import numpy as np
+
+# relative
+from ..logging import LoggingMixin
+from .caches import DEFAULT_CAPACITY, parse_bytes
+from .sqlite import EVICTION_ORDER, KEY_PROTOCOL, digest
+
+
+# ---------------------------------------------------------------------------- #
+EXTENSIONS = ('.cache', )
+
+MAGIC = b'RCPACK\x00\x01'
+# magic, slots, count, tombstones, nbytes, dead, clock, capacity, maxbytes,
+# policy
+HEADER = struct.Struct('<8sQQQQQQqq8s')
+HEADER_SIZE = 128
+RECORD = struct.Struct('<QQ')   # key size, value size
+
+INDEX_DTYPE = np.dtype([('digest', 'V16'),
+                        ('offset', '<u8'),
+                        ('length', '<u8'),
+                        ('size', '<u8'),
+                        ('accessed', '<u8'),
+                        ('hits', '<u8')])
+
+# Slot states are encoded in the record offset, since records can only start
+# after the index
+EMPTY, DELETED = 0, 1
+
+MIN_SLOTS = 2 ** 6
+MAX_LOAD = 0.5              # fraction of occupied slots (including deleted)
+MIN_DEAD_BYTES = 2 ** 20    # compact only once this much space can be freed
+
+
+# ---------------------------------------------------------------------------- #
+def _table_size(count):
+    # smallest power of two that keeps the index at most half full after
+    # doubling the current number of entries
+    slots = MIN_SLOTS
+    while slots * MAX_LOAD < 2 * count:
+        slots *= 2
+    return slots
+
+
+# ---------------------------------------------------------------------------- #
+class PackedCache(LoggingMixin, abc.MutableMapping):
+    """
+    A persistent cache stored in a single binary file with a memory-mapped
+    hash index of key digests at its head. Lookups read only the index and the
+    requested value, and insertions append a single record, so neither scales
+    with the size of the cache. This makes cold-start lookups on very large
+    caches cheap, since nothing needs to be loaded up front.
+
+    Values are pickled. The size of an entry is taken as the size of its
+    pickled value.
+
+    The file supports a single writing process at a time. Use the SQLite
+    backend to share a cache between processes.
+    """
+
+    def __init__(self, filename, capacity=None, maxbytes=None, policy=None):
+        """
+        Parameters
+        ----------
+        filename : str or Path
+            Location of the cache file.
+        capacity : int or str, optional
+            Size limit in number of items, or in bytes if given as a string with
+            units eg: '512MB'. If neither `capacity` nor `maxbytes` are given,
+            the limits stored in an existing file are used, otherwise the
+            default capacity of 128 items.
+        maxbytes : int or str, optional
+            Size limit in bytes.
+        policy : {'lru', 'lfu'}, optional
+            Replacement policy, by default the one stored in an existing
+            file, otherwise 'lru'.
+        """
+        self.filename = Path(filename)
+        self.lock = threading.RLock()
+        self.fd = self.mm = self.index = None
+        self.capacity = self.maxbytes = self.policy = None
+        self.clock = 0
+
+        if self.filename.exists():
+            self._open()
+            if capacity is None and maxbytes is None:
+                capacity, maxbytes = self.capacity, self.maxbytes
+            policy = policy or self.policy
+        elif capacity is None and maxbytes is None:
+            capacity = DEFAULT_CAPACITY
+
+        if isinstance(capacity, str):
+            capacity, maxbytes = None, capacity
+
+        capacity = None if capacity is None else int(capacity)
+        maxbytes = None if maxbytes is None else parse_bytes(maxbytes)
+        policy = str(policy or 'lru').lower()
+        if policy not in EVICTION_ORDER:
+            raise ValueError(
+                f'Unsupported replacement policy {policy!r} for packed cache. '
+                f'Currently supported: {tuple(EVICTION_ORDER)}.'
+            )
+
+        self.capacity, self.maxbytes, self.policy = capacity, maxbytes, policy
+        with self.lock:
+            if self.mm is None:
+                self._rebuild()
+            else:
+                # limits may have changed
+                self._shrink()
+                self._write_header()
+
+    def __reduce__(self):
+        return type(self), (self.filename, *self.params().values())
+
+    def __repr__(self):
+        return (f'{type(self).__name__}({str(self.filename)!r}, '
+                f'capacity={self.capacity}, maxbytes={self.maxbytes}, '
+                f'policy={self.policy!r})')
+
+    def params(self):
+        return {'capacity': self.capacity,
+                'maxbytes': self.maxbytes,
+                'policy': self.policy}
+
+    # ------------------------------------------------------------------------ #
+    # File handling
+
+    def _open(self):
+        self.fd = os.open(self.filename, os.O_RDWR)
+        header = os.pread(self.fd, HEADER.size, 0)
+        if len(header) < HEADER.size or not header.startswith(MAGIC):
+            os.close(self.fd)
+            raise ValueError(f'Not a packed cache file: {str(self.filename)!r}.')
+
+        (_, self.slots, self.count, self.tombstones, self.nbytes, self.dead,
+         self.clock, capacity, maxbytes, policy) = HEADER.unpack(header)
+
+        if self.capacity is None and self.maxbytes is None:
+            self.capacity = None if capacity < 0 else capacity
+            self.maxbytes = None if maxbytes < 0 else maxbytes
+            self.policy = policy.rstrip(b'\0').decode()
+
+        self.mm = mmap.mmap(self.fd, HEADER_SIZE + self.slots * INDEX_DTYPE.itemsize)
+        self.index = np.ndarray(self.slots, INDEX_DTYPE, self.mm, HEADER_SIZE)
+        self.end = os.fstat(self.fd).st_size
+
+    def _close(self):
+        if self.mm is None:
+            return
+
+        # the index array holds a reference to the memory map buffer, and has
+        # to be released before the map can be closed
+        self.index = None
+        self.mm.flush()
+        self.mm.close()
+        os.close(self.fd)
+        self.fd = self.mm = None
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _header(self, slots, count, tombstones, nbytes, dead):
+        return HEADER.pack(
+            MAGIC, slots, count, tombstones, nbytes, dead, self.clock,
+            -1 if self.capacity is None else self.capacity,
+            -1 if self.maxbytes is None else self.maxbytes,
+            self.policy.encode()
+        )
+
+    def _write_header(self):
+        self.mm[:HEADER.size] = self._header(
+            self.slots, self.count, self.tombstones, self.nbytes, self.dead)
+
+    def _rebuild(self):
+        # Write a new file with an index sized for the current number of
+        # entries, copying only the live records, then swap it in atomically
+        from .manager import atomic
+
+        live = self._live() if self.mm else ()
+        slots = _table_size(len(live))
+        index = np.zeros(slots, INDEX_DTYPE)
+        end = HEADER_SIZE + slots * INDEX_DTYPE.itemsize
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        with atomic(self.filename) as tmp, open(tmp, 'wb') as fp:
+            fp.seek(end)
+            for i in live:
+                slot = self.index[i]
+                j, _ = self._probe(index, bytes(slot['digest']))
+                index[j] = slot
+                index['offset'][j] = end
+                end += fp.write(os.pread(self.fd, int(slot['length']),
+                                         int(slot['offset'])))
+
+            nbytes = int(index['size'].sum())
+            fp.seek(HEADER_SIZE)
+            fp.write(index.tobytes())
+            fp.seek(0)
+            fp.write(self._header(slots, len(live), 0, nbytes, 0))
+            # the new file has to be complete on disk before it replaces the
+            # old one, or a crash could leave an empty header behind
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        self._close()
+        self.slots, self.count, self.tombstones = slots, len(live), 0
+        self.nbytes = nbytes
+        self.dead = 0
+        self.fd = os.open(self.filename, os.O_RDWR)
+        self.mm = mmap.mmap(self.fd, HEADER_SIZE + slots * INDEX_DTYPE.itemsize)
+        self.index = np.ndarray(slots, INDEX_DTYPE, self.mm, HEADER_SIZE)
+        self.end = end
+
+    def _maintain(self):
+        # Grow the index once it is too full to probe efficiently, and compact
+        # once most of the file is taken up by records of removed entries.
+        if ((self.count + self.tombstones > MAX_LOAD * self.slots) or
+                (self.dead > max(MIN_DEAD_BYTES, self.end - self.dead))):
+            self._rebuild()
+
+    # ------------------------------------------------------------------------ #
+    # Index
+
+    @staticmethod
+    def _probe(index, uid):
+        # Linear probing. Returns the slot holding `uid` and True if found,
+        # otherwise the slot where it should be inserted and False.
+        mask = len(index) - 1
+        i = int.from_bytes(uid[:8], 'little') & mask
+        offsets = index['offset']
+        free = None
+        while True:
+            offset = offsets[i]
+            if offset == EMPTY:
+                return (i if free is None else free), False
+
+            if offset == DELETED:
+                if free is None:
+                    free = i
+            elif index['digest'][i].tobytes() == uid:
+                return i, True
+
+            i = (i + 1) & mask
+
+    def _live(self):
+        # slots of live entries in eviction order
+        live = np.flatnonzero(self.index['offset'] > DELETED)
+        return live[np.argsort(self._priority(live), kind='stable')]
+
+    def _priority(self, slots):
+        # Single integer key giving the eviction order of entries in `slots`.
+        # Both access times and hit counts are bounded by the clock, so the
+        # combined key for 'lfu' fits in 64 bits until the clock reaches 2**32
+        columns = EVICTION_ORDER[self.policy]
+        if len(columns) == 1:
+            return self.index[columns[0]][slots]
+
+        if self.clock < 2 ** 32 - 1:
+            key = np.zeros(len(slots), np.uint64)
+            for col in columns:
+                key = key * np.uint64(self.clock + 1) + self.index[col][slots]
+            return key
+
+        # rank in the full ordering
+        order = np.lexsort([self.index[col][slots] for col in reversed(columns)])
+        return np.argsort(order)
+
+    def _evictable(self, n, keep=None):
+        # The `n` (or fewer) live slots first in eviction order, sorted. Only
+        # these are ordered, so the cost is linear in the size of the cache.
+        live = np.flatnonzero(self.index['offset'] > DELETED)
+        if keep is not None:
+            live = live[live != keep]
+
+        priority = self._priority(live)
+        if n < len(live):
+            first = np.argpartition(priority, n - 1)[:n]
+            live, priority = live[first], priority[first]
+        return live[np.argsort(priority, kind='stable')]
+
+    def _remove(self, slots):
+        index = self.index
+        self.count -= len(slots)
+        self.tombstones += len(slots)
+        self.nbytes -= int(index['size'][slots].sum())
+        self.dead += int(index['length'][slots].sum())
+        index['offset'][slots] = DELETED
+
+    def _shrink(self, keep=None):
+        # Evict entries in order of priority until within limits. The slot
+        # `keep` holds the item that was just inserted, which is excluded from
+        # the candidates for eviction.
+        if ((self.capacity is None or self.count <= self.capacity) and
+                (self.maxbytes is None or self.nbytes <= self.maxbytes)):
+            return
+
+        if self.capacity is not None and self.count > self.capacity:
+            self._remove(self._evictable(self.count - self.capacity, keep))
+
+        if self.maxbytes is not None and self.nbytes > self.maxbytes:
+            # evict the shortest run of entries in eviction order that frees
+            # enough space, looking further down the order as needed
+            n = max(1, self.count // 64)
+            while True:
+                candidates = self._evictable(n, keep)
+                if not len(candidates):
+                    break
+
+                freed = np.cumsum(self.index['size'][candidates])
+                excess = self.nbytes - self.maxbytes
+                if freed[-1] >= excess or len(candidates) < n:
+                    self._remove(candidates[:np.searchsorted(freed, excess) + 1])
+                    break
+                n *= 4
+
+    def _read(self, i, value=True):
+        # read the pickled value or key of the record in slot `i`
+        slot = self.index[i]
+        offset, length, size = (int(slot['offset']), int(slot['length']),
+                                int(slot['size']))
+        if value:
+            return os.pread(self.fd, size, offset + RECORD.size)
+
+        start = RECORD.size + size
+        return os.pread(self.fd, length - start, offset + start)
+
+    # ------------------------------------------------------------------------ #
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        with self.lock:
+            keys = [self._read(i, False) for i in self._by_access()]
+        for key in keys:
+            yield pickle.loads(key)
+
+    def _by_access(self):
+        # slots of live entries ordered by last access
+        live = np.flatnonzero(self.index['offset'] > DELETED)
+        return live[np.argsort(self.index['accessed'][live], kind='stable')]
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._probe(self.index, digest(key))[1]
+
+    def __getitem__(self, key):
+        with self.lock:
+            i, found = self._probe(self.index, digest(key))
+            if not found:
+                raise KeyError(key)
+
+            self.clock += 1
+            slot = self.index[i]
+            slot['accessed'] = self.clock
+            slot['hits'] += 1
+            self._write_header()
+            blob = self._read(i)
+
+        return pickle.loads(blob)
+
+    def get(self, key, default=None):
+        # single probe instead of `__contains__` followed by `__getitem__`
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        size = len(blob)
+        if self.capacity == 0 or (self.maxbytes is not None and
+                                  size > self.maxbytes):
+            # item does not fit in the cache at all
+            self.logger.debug('Item of size {} does not fit in cache with '
+                              'capacity {}.', size, self.maxbytes)
+            return
+
+        uid = digest(key)
+        kblob = pickle.dumps(key, KEY_PROTOCOL)
+        record = RECORD.pack(len(kblob), size) + blob + kblob
+        with self.lock:
+            # append the record before registering it in the index, so the
+            # index never points to incomplete data
+            offset = self.end
+            os.pwrite(self.fd, record, offset)
+            self.end += len(record)
+
+            i, found = self._probe(self.index, uid)
+            slot = self.index[i]
+            if found:
+                # upsert: the replaced record is dead, hit count is preserved
+                self.dead += int(slot['length'])
+                self.nbytes -= int(slot['size'])
+            else:
+                if slot['offset'] == DELETED:
+                    self.tombstones -= 1
+                self.count += 1
+                slot['digest'] = np.void(uid)
+                slot['hits'] = 0
+
+            self.clock += 1
+            slot['offset'], slot['length'], slot['size'] = offset, len(record), size
+            slot['accessed'] = self.clock
+            self.nbytes += size
+
+            self._shrink(i)
+            self._write_header()
+            self._maintain()
+
+    def __delitem__(self, key):
+        with self.lock:
+            i, found = self._probe(self.index, digest(key))
+            if not found:
+                raise KeyError(key)
+
+            self._remove([i])
+            self._write_header()
+            self._maintain()
+
+    def items(self):
+        with self.lock:
+            slots = self._by_access()
+            return [(pickle.loads(self._read(i, False)),
+                     pickle.loads(self._read(i)))
+                    for i in slots]
+
+    def clear(self):
+        with self.lock:
+            self._remove(np.flatnonzero(self.index['offset'] > DELETED))
+            self._rebuild()
@@ -0,0 +1,289 @@
+"""
+SQLite backed persistent cache with incremental writes.
+"""
+
+# std
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from collections import abc
+
+# relative
+from ..logging import LoggingMixin
+from .caches import DEFAULT_CAPACITY, parse_bytes
+
+
+# ---------------------------------------------------------------------------- #
+EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+# Fixed pickle protocol for key digests so they are stable across interpreter
+# versions
+KEY_PROTOCOL = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    digest      BLOB PRIMARY KEY,
+    key         BLOB NOT NULL,
+    value       BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    accessed    REAL NOT NULL,
+    hits        INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_lru ON cache (accessed);
+CREATE INDEX IF NOT EXISTS cache_lfu ON cache (hits, accessed);
+CREATE TABLE IF NOT EXISTS meta (
+    name        TEXT PRIMARY KEY,
+    value
+);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE meta SET value = value + 1 WHERE name = 'count';
+    UPDATE meta SET value = value + NEW.size WHERE name = 'nbytes';
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache BEGIN
+    UPDATE meta SET value = value + NEW.size - OLD.size WHERE name = 'nbytes';
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE meta SET value = value - 1 WHERE name = 'count';
+    UPDATE meta SET value = value - OLD.size WHERE name = 'nbytes';
+END;
+"""
+
+# Running totals kept in the meta table by the triggers above
+TOTALS = """
+INSERT OR IGNORE INTO meta
+    SELECT 'count', COUNT(*) FROM cache
+    UNION ALL
+    SELECT 'nbytes', COALESCE(SUM(size), 0) FROM cache
+"""
+
+# Eviction order for supported replacement policies
+EVICTION_ORDER = {'lru': ('accessed', ),
+                  'lfu': ('hits', 'accessed')}
+
+
+# ---------------------------------------------------------------------------- #
+class _SortedSet(tuple):
+    # Canonical form of a set in a cache key: its pickled items, sorted
+    __slots__ = ()
+
+
+def _canonical(key):
+    # The iteration order of sets, and therefore their pickle, depends on the
+    # hash seed for str items. Sets are replaced by their sorted pickled items.
+    if isinstance(key, abc.Set):
+        return _SortedSet(sorted(pickle.dumps(_canonical(item), KEY_PROTOCOL)
+                                 for item in key))
+
+    if type(key) is tuple:
+        return tuple(map(_canonical, key))
+
+    return key
+
+
+def digest(key):
+    """
+    Stable 128 bit digest of a cache key. Unlike the builtin `hash`, this does
+    not depend on the interpreter's hash seed, so can be used for lookups
+    across sessions.
+    """
+    return hashlib.blake2b(pickle.dumps(_canonical(key), KEY_PROTOCOL),
+                           digest_size=16).digest()
+
+
+# ---------------------------------------------------------------------------- #
+class SQLiteCache(LoggingMixin, abc.MutableMapping):
+    """
+    A persistent cache backed by an SQLite database. Each insertion is a single
+    row upsert, and lookups are indexed by a stable digest of the key, so
+    neither reads nor writes scale with the size of the cache. Replacement
+    policy metadata (last access time and hit count) is kept in indexed
+    columns, and the number and total size of the entries are kept up to date
+    by triggers, so eviction only visits the entries it removes.
+
+    Values are pickled. The size of an entry is taken as the size of its
+    pickled value.
+    """
+
+    def __init__(self, filename, capacity=None, maxbytes=None, policy=None):
+        """
+        Parameters
+        ----------
+        filename : str or Path
+            Location of the database file.
+        capacity : int or str, optional
+            Size limit in number of items, or in bytes if given as a string with
+            units eg: '512MB'. If neither `capacity` nor `maxbytes` are given,
+            the limits stored in an existing database are used, otherwise the
+            default capacity of 128 items.
+        maxbytes : int or str, optional
+            Size limit in bytes.
+        policy : {'lru', 'lfu'}, optional
+            Replacement policy, by default the one stored in an existing
+            database, otherwise 'lru'.
+        """
+        self.filename = Path(filename)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.filename), timeout=60,
+                                  check_same_thread=False)
+        # Write-ahead logging makes each commit a cheap append
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+        meta = dict(self.db.execute('SELECT name, value FROM meta'))
+        if capacity is None and maxbytes is None:
+            capacity = meta.get('capacity', DEFAULT_CAPACITY)
+            maxbytes = meta.get('maxbytes')
+
+        if isinstance(capacity, str):
+            capacity, maxbytes = None, capacity
+
+        self.capacity = None if capacity is None else int(capacity)
+        self.maxbytes = None if maxbytes is None else parse_bytes(maxbytes)
+        self.policy = str(policy or meta.get('policy', 'lru')).lower()
+        if self.policy not in EVICTION_ORDER:
+            raise ValueError(
+                f'Unsupported replacement policy {self.policy!r} for SQLite '
+                f'cache. Currently supported: {tuple(EVICTION_ORDER)}.'
+            )
+
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                self.params().items())
+            # totals for databases created before they were tracked
+            self.db.execute(TOTALS)
+
+    def __reduce__(self):
+        return type(self), (self.filename, *self.params().values())
+
+    def __repr__(self):
+        return (f'{type(self).__name__}({str(self.filename)!r}, '
+                f'capacity={self.capacity}, maxbytes={self.maxbytes}, '
+                f'policy={self.policy!r})')
+
+    def params(self):
+        return {'capacity': self.capacity,
+                'maxbytes': self.maxbytes,
+                'policy': self.policy}
+
+    def _execute(self, sql, *params):
+        with self.lock:
+            return self.db.execute(sql, params)
+
+    def _totals(self):
+        # number of entries and their total size
+        rows = dict(self.db.execute(
+            "SELECT name, value FROM meta WHERE name IN ('count', 'nbytes')"
+        ))
+        return rows['count'], rows['nbytes']
+
+    # ------------------------------------------------------------------------ #
+    def __len__(self):
+        with self.lock:
+            return self._totals()[0]
+
+    def __iter__(self):
+        rows = self._execute('SELECT key FROM cache ORDER BY accessed').fetchall()
+        for (key, ) in rows:
+            yield pickle.loads(key)
+
+    def __contains__(self, key):
+        return self._execute('SELECT 1 FROM cache WHERE digest = ?',
+                             digest(key)).fetchone() is not None
+
+    def __getitem__(self, key):
+        uid = digest(key)
+        with self.lock, self.db:
+            row = self.db.execute('SELECT value FROM cache WHERE digest = ?',
+                                  (uid, )).fetchone()
+            if row is None:
+                raise KeyError(key)
+
+            self.db.execute('UPDATE cache SET accessed = ?, hits = hits + 1 '
+                            'WHERE digest = ?', (time.time(), uid))
+
+        return pickle.loads(row[0])
+
+    def get(self, key, default=None):
+        # single query instead of `__contains__` followed by `__getitem__`
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        uid = digest(key)
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        size = len(blob)
+        if self.capacity == 0 or (self.maxbytes is not None and
+                                  size > self.maxbytes):
+            # item does not fit in the cache at all
+            self.logger.debug('Item of size {} does not fit in cache with '
+                              'capacity {}.', size, self.maxbytes)
+            return
+
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT INTO cache (digest, key, value, size, accessed) '
+                'VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (digest) DO UPDATE SET '
+                'value = excluded.value, size = excluded.size, '
+                'accessed = excluded.accessed',
+                (uid, pickle.dumps(key, KEY_PROTOCOL), blob, size, time.time())
+            )
+            self._shrink(uid)
+
+    def _shrink(self, uid):
+        # Evict only when a limit is exceeded, visiting candidates in eviction
+        # order through the index. The item that was just inserted (`uid`) is
+        # excluded from the candidates for eviction.
+        count, nbytes = self._totals()
+        excess_count = 0 if self.capacity is None else count - self.capacity
+        excess_bytes = 0 if self.maxbytes is None else nbytes - self.maxbytes
+        if excess_count <= 0 and excess_bytes <= 0:
+            return
+
+        order = ', '.join(EVICTION_ORDER[self.policy])
+        candidates = self.db.execute(
+            f'SELECT digest, size FROM cache WHERE digest != ? ORDER BY {order}',
+            (uid, )
+        )
+        evict = []
+        for key, nbytes in candidates:
+            if excess_count <= 0 and excess_bytes <= 0:
+                break
+
+            evict.append((key, ))
+            excess_count -= 1
+            excess_bytes -= nbytes
+
+        candidates.close()
+        self.db.executemany('DELETE FROM cache WHERE digest = ?', evict)
+
+    def __delitem__(self, key):
+        with self.lock, self.db:
+            if not self.db.execute('DELETE FROM cache WHERE digest = ?',
+                                   (digest(key), )).rowcount:
+                raise KeyError(key)
+
+    def items(self):
+        rows = self._execute('SELECT key, value FROM cache ORDER BY accessed')
+        return [(pickle.loads(key), pickle.loads(value))
+                for key, value in rows.fetchall()]
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM cache')
+
+    @property
+    def nbytes(self):
+        """Total size of the pickled values in bytes."""
+        with self.lock:
+            return self._totals()[1]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
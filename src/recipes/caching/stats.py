@@ -0,0 +1,74 @@
+"""
+Cache usage statistics and amortisation telemetry.
+"""
+
+# std
+import contextlib as ctx
+from collections import namedtuple
+
+
+# ---------------------------------------------------------------------------- #
+CacheInfo = namedtuple(
+    'CacheInfo',
+    ('hits', 'misses', 'evictions', 'rejected', 'size', 'capacity', 'bytes',
+     'mean_compute_time', 'time_saved')
+)
+CacheInfo.__doc__ = """\
+Snapshot of cache usage statistics. Times are in seconds. `time_saved` is
+estimated as the number of hits multiplied by the mean compute time of misses.
+"""
+
+
+# ---------------------------------------------------------------------------- #
+class CacheStats:
+    """
+    Counters for cache hits, misses, evictions and rejected calls, as well as
+    the total time spent computing results on cache misses.
+    """
+
+    __slots__ = ('hits', 'misses', 'evictions', 'rejected', 'compute_time',
+                 'lock')
+
+    def __init__(self, lock=None):
+        self.lock = lock or ctx.nullcontext()
+        self.reset()
+
+    def __repr__(self):
+        return (f'{type(self).__name__}(hits={self.hits}, misses={self.misses}, '
+                f'evictions={self.evictions}, rejected={self.rejected})')
+
+    def reset(self):
+        """Zero all counters."""
+        with self.lock:
+            self.hits = self.misses = self.evictions = self.rejected = 0
+            self.compute_time = 0.
+
+    def hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def miss(self, duration):
+        with self.lock:
+            self.misses += 1
+            self.compute_time += duration
+
+    def evict(self, n=1):
+        with self.lock:
+            self.evictions += n
+
+    def reject(self):
+        with self.lock:
+            self.rejected += 1
+
+    @property
+    def mean_compute_time(self):
+        return (self.compute_time / self.misses) if self.misses else 0.
+
+    @property
+    def time_saved(self):
+        return self.hits * self.mean_compute_time
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return (self.hits / total) if total else 0.
@@ -0,0 +1,128 @@
+"""
+Write-behind persistence: coalesce cache writes in a background thread.
+"""
+
+# std
+import atexit
+import inspect
+import weakref
+import threading
+
+# third-party
+from loguru import logger
+
+
+# ---------------------------------------------------------------------------- #
+DEFAULT_FLUSH_INTERVAL = 1.     # seconds
+DEFAULT_FLUSH_THRESHOLD = 2 ** 7  # number of pending writes
+
+# Open writers, flushed at interpreter exit
+_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _close_all():
+    for writer in list(_writers):
+        writer.close()
+
+
+def _run(ref, wake, interval):
+    # Background flush loop. The writer is only referenced while flushing, so
+    # that it can be garbage collected along with its cache.
+    while True:
+        wake.wait(interval)
+        wake.clear()
+        writer = ref()
+        if writer is None or writer.closed:
+            return
+
+        writer.flush()
+        del writer
+
+
+# ---------------------------------------------------------------------------- #
+class WriteBehind:
+    """
+    Defer and batch writes of a cache to disk. Insertions only mark the cache
+    as dirty, while a background thread flushes the pending changes once every
+    `interval` seconds, or sooner when the number of pending changes reaches
+    `threshold`. Any pending changes are flushed when the writer is closed,
+    which happens automatically at interpreter exit.
+
+    A bound method `func` is held by weak reference, so the writer does not
+    keep its owner alive.
+    """
+
+    __slots__ = ('func', 'interval', 'threshold', 'dirty', 'lock', 'wake',
+                 'closed', 'thread', '__weakref__')
+
+    def __init__(self, func, interval=DEFAULT_FLUSH_INTERVAL,
+                 threshold=DEFAULT_FLUSH_THRESHOLD):
+        """
+        Parameters
+        ----------
+        func : callable
+            Function that writes the cache to disk.
+        interval : float, optional
+            Maximum time in seconds that changes remain pending, by default 1.
+        threshold : int, optional
+            Number of pending changes that trigger an immediate flush, by
+            default 128.
+        """
+        self.func = (weakref.WeakMethod(func) if inspect.ismethod(func) else
+                     (lambda: func))
+        self.interval = float(interval)
+        self.threshold = int(threshold)
+        self.dirty = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(
+            target=_run, args=(weakref.ref(self), self.wake, self.interval),
+            daemon=True, name=f'{type(self).__name__}'
+        )
+        self.thread.start()
+        _writers.add(self)
+
+    def __repr__(self):
+        return (f'{type(self).__name__}(interval={self.interval}, '
+                f'threshold={self.threshold}, dirty={self.dirty})')
+
+    def mark(self):
+        """Register a pending change."""
+        with self.lock:
+            self.dirty += 1
+            if self.dirty >= self.threshold:
+                self.wake.set()
+
+    def flush(self):
+        """Write pending changes, if any."""
+        func = self.func()
+        if func is None:
+            # owner was garbage collected
+            return
+
+        with self.lock:
+            if not self.dirty:
+                return
+            # changes marked while we are writing will trigger another flush
+            self.dirty = 0
+
+        try:
+            func()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Write-behind flush failed. Will retry.')
+            with self.lock:
+                self.dirty += 1
+
+    def close(self):
+        """Stop the background thread and flush any pending changes."""
+        if self.closed:
+            return
+
+        self.closed = True
+        self.wake.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+        _writers.discard(self)
@@ -0,0 +1,235 @@
+"""
+Task broker for distributing `Executor` jobs across machines.
+
+The broker keeps the state of each task in an SQLite database. Workers claim
+chunks of pending tasks, and report them as done or failed. Workers on machines
+that share a file system can use the database directly, otherwise the broker
+can be served over TCP (or a Unix socket) with `serve`, and reached with
+`connect`.
+
+Claims are leases: tasks claimed by a worker that has not reported back within
+`lease` seconds (eg. because the worker died) are handed out again.
+
+Examples
+--------
+On the coordinating machine:
+
+>>> exe = MyExecutor()
+>>> exe.init_memory(n, '/shared/results.npy')
+>>> broker = exe.distribute('/shared/tasks.db')
+>>> server = serve(broker, ('', 50000), b'secret')
+
+On each worker machine:
+
+>>> exe = MyExecutor()
+>>> exe.init_memory(n, '/shared/results.npy')
+>>> exe.work(connect(('coordinator', 50000), b'secret'), data)
+
+Once all tasks are done, on the coordinating machine:
+
+>>> exe.gather(broker)
+"""
+
+# std
+import time
+import sqlite3
+import threading
+import contextlib as ctx
+from pathlib import Path
+from multiprocessing.managers import BaseManager
+
+# relative
+from ..logging import LoggingMixin
+
+
+# ---------------------------------------------------------------------------- #
+# Seconds after which a claimed task is handed out again
+LEASE = 3600
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS tasks (
+    idx         INTEGER PRIMARY KEY,
+    state       TEXT NOT NULL DEFAULT '{PENDING}',
+    worker      TEXT,
+    claimed     REAL,
+    message     TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, idx);
+"""
+
+
+# ---------------------------------------------------------------------------- #
+class TaskBroker(LoggingMixin):
+    """
+    Task queue for `Executor` jobs, backed by an SQLite database.
+    """
+
+    def __init__(self, filename, lease=LEASE):
+        """
+        Parameters
+        ----------
+        filename : str or Path
+            Location of the database.
+        lease : float, optional
+            Seconds after which tasks claimed by a worker that did not report
+            back are handed out again.
+        """
+        self.filename = Path(filename)
+        self.lease = float(lease)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.filename), timeout=60,
+                                  check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def __reduce__(self):
+        return type(self), (self.filename, self.lease)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self.filename)!r}, {self.counts()})'
+
+    @ctx.contextmanager
+    def _immediate(self):
+        # Write transactions take the database lock up front, so that
+        # concurrent claims from other processes never overlap
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def _transaction(self, sql, *params, many=False):
+        with self._immediate() as db:
+            return (db.executemany if many else db.execute)(sql, *params
+                                                            ).fetchall()
+
+    def _query(self, sql, *params):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    # ------------------------------------------------------------------------ #
+    def submit(self, indices):
+        """Add tasks, resetting any that exist to pending."""
+        self._transaction(
+            f"INSERT INTO tasks (idx) VALUES (?) ON CONFLICT (idx) DO UPDATE "
+            f"SET state = '{PENDING}', worker = NULL, claimed = NULL, "
+            f"message = NULL",
+            [(int(i), ) for i in indices], many=True
+        )
+
+    def claim(self, worker, n=1):
+        """
+        Claim up to `n` pending tasks for `worker`. Returns a list of task
+        indices, which is empty once no tasks remain.
+        """
+        now = time.time()
+        # Select, then update in the same transaction, since `RETURNING` needs
+        # SQLite 3.35
+        with self._immediate() as db:
+            indices = [i for i, in db.execute(
+                f"SELECT idx FROM tasks WHERE state = '{PENDING}' OR "
+                f"(state = '{RUNNING}' AND claimed < ?) ORDER BY idx LIMIT ?",
+                (now - self.lease, int(n))
+            )]
+            db.executemany(
+                f"UPDATE tasks SET state = '{RUNNING}', worker = ?, claimed = ? "
+                f"WHERE idx = ?",
+                [(str(worker), now, i) for i in indices]
+            )
+        return indices
+
+    def complete(self, indices):
+        """Mark tasks as done."""
+        self._transaction(
+            f"UPDATE tasks SET state = '{DONE}', message = NULL WHERE idx = ?",
+            [(int(i), ) for i in indices], many=True
+        )
+
+    def fail(self, indices, message=''):
+        """Mark tasks as failed. Returns the total number of failed tasks."""
+        self._transaction(
+            f"UPDATE tasks SET state = '{FAILED}', message = ? WHERE idx = ?",
+            [(str(message), int(i)) for i in indices], many=True
+        )
+        return self.nfailed()
+
+    def release(self, indices):
+        """Return claimed tasks that were not attempted to the queue."""
+        self._transaction(
+            f"UPDATE tasks SET state = '{PENDING}', worker = NULL, "
+            f"claimed = NULL WHERE idx = ? AND state = '{RUNNING}'",
+            [(int(i), ) for i in indices], many=True
+        )
+
+    # ------------------------------------------------------------------------ #
+    # NOTE: These are methods rather than properties, so that they are
+    # available through the proxies returned by `connect`.
+
+    def nfailed(self):
+        """Number of failed tasks."""
+        return self._query(
+            f"SELECT COUNT(*) FROM tasks WHERE state = '{FAILED}'")[0][0]
+
+    def counts(self):
+        """Number of tasks in each state."""
+        return dict(self._query('SELECT state, COUNT(*) FROM tasks '
+                                'GROUP BY state'))
+
+    def indices(self, state=DONE):
+        """Indices of tasks in `state`."""
+        return [i for i, in self._query('SELECT idx FROM tasks WHERE state = ? '
+                                        'ORDER BY idx', state)]
+
+    def finished(self):
+        """Whether no tasks are pending or running."""
+        counts = self.counts()
+        return not (counts.get(PENDING) or counts.get(RUNNING))
+
+
+# ---------------------------------------------------------------------------- #
+class BrokerManager(BaseManager):
+    pass
+
+
+BrokerManager.register('broker')
+
+
+def _serve(server):
+    # `serve_forever` exits with `SystemExit` once stopped
+    try:
+        server.serve_forever()
+    except SystemExit:
+        pass
+
+
+def serve(broker, address, authkey):
+    """
+    Serve `broker` to remote workers at `address` (a `(host, port)` tuple, or
+    the path of a Unix socket), in a background thread of this process.
+
+    Returns
+    -------
+    multiprocessing.managers.Server
+        The server. Stop it with `server.stop_event.set()`.
+    """
+    # register the broker on a new class for each server, since registering
+    # on `BrokerManager` would change the broker served by all of them
+    manager = type('_BrokerManager', (BrokerManager, ), {})
+    manager.register('broker', callable=lambda: broker)
+    server = manager(address, authkey).get_server()
+    threading.Thread(target=_serve, args=(server, ), daemon=True).start()
+    broker.logger.info('Serving tasks at {}.', server.address)
+    return server
+
+
+def connect(address, authkey):
+    """Connect to a broker served at `address`. Returns a proxy."""
+    manager = BrokerManager(address, authkey)
+    manager.connect()
+    return manager.broker()
@@ -1,11 +1,15 @@
 # std
+import inspect
+import threading
 import traceback
 import multiprocessing as mp
+from queue import Empty, Full
 
 # relative
 from ..decorators import Decorator
 from ..logging import LoggingMixin
 from ..pprint import caller, describe
+from .pool import RemoteTraceback, WorkerLost, _picklable
 
 
 class Delayed(Decorator):
@@ -451,3 +455,258 @@ class AutoTriggerConsumer2(
             self.inq.task_done()
 
         return
+
+
+# ---------------------------------------------------------------------------- #
+# Default capacity of the queues between pipeline stages
+MAXSIZE = 64
+# Interval in seconds at which the pipeline feeder checks for shutdown while
+# the input queue is full, and the consumer checks for lost workers while
+# waiting for results
+POLL_INTERVAL = 0.1
+
+
+class _Failure:
+    # Record of an item on which a stage function raised. Passed on through the
+    # following stages to the consumer, which re-raises the error.
+
+    __slots__ = ('error', 'traceback')
+
+    def __init__(self, error, tb):
+        self.error = _picklable(error)
+        self.traceback = tb
+
+
+class StageWorker(ConsumerBase):
+    """
+    Worker for a stage of a `Pipeline`. Applies the stage function to each item
+    from the input queue and puts the result in the output queue. Generator
+    functions may produce any number of results for each item. Results that are
+    None are dropped.
+
+    Puts block while the output queue is full, so a stage can never run ahead
+    of the next stage by more than the capacity of the queue between them.
+
+    Items on which the stage function raises are logged, and passed on as
+    failure records, which the following stages forward to the consumer.
+
+    The stage shuts down when each of its workers has received a sentinel. The
+    last worker to exit passes one sentinel on for each worker of the next
+    stage.
+    """
+
+    def __init__(self, func, inq, outq, active, nsentinels, **kws):
+        super().__init__(inq, outq, target=func, **kws)
+        # number of workers of this stage that are still running, and number
+        # of workers in the next stage
+        self.active = active
+        self.nsentinels = nsentinels
+
+    def run(self):
+        self.logger.debug('Running {:s}.', self.name)
+        try:
+            while (item := self.inq.get()) is not SENTINEL:
+                if isinstance(item, _Failure):
+                    self.outq.put(item)
+                    continue
+
+                try:
+                    self.main(item)
+                except Exception as err:
+                    self.logger.exception('{} failed on item: {}.',
+                                          self.name, item)
+                    self.outq.put(_Failure(err, traceback.format_exc()))
+        finally:
+            self.shutdown()
+
+    def main(self, item):
+        result = self._target(item)
+        results = result if inspect.isgenerator(result) else (result, )
+        for result in results:
+            if result is not None and self.has_outq:
+                self.outq.put(result)
+
+    def shutdown(self):
+        with self.active.get_lock():
+            self.active.value -= 1
+            last = (self.active.value == 0)
+
+        if last and self.has_outq:
+            self.logger.debug('{} passing on {} sentinel(s).', self.name,
+                              self.nsentinels)
+            for _ in range(self.nsentinels):
+                self.outq.put(SENTINEL)
+
+
+class Pipeline(LoggingMixin):
+    """
+    Multi-stage producer / consumer pipeline with bounded queues. Each stage
+    runs a function in a number of worker processes, with the results of each
+    stage fed to the next. Loading, computing and writing thereby overlap,
+    while memory use is bounded by the capacity of the queues, since producers
+    block while the next stage is busy.
+
+    Examples
+    --------
+    >>> pipeline = Pipeline(load, (compute, 4), save, maxsize=16)
+    >>> for result in pipeline.run(filenames):
+    ...     ...
+    """
+
+    def __init__(self, *stages, maxsize=MAXSIZE):
+        """
+        Parameters
+        ----------
+        *stages : callable or tuple
+            Stage functions, or `(func, nworkers)` pairs. Each function takes a
+            single item from the previous stage (or from the input iterable
+            for the first stage).
+        maxsize : int, optional
+            Capacity of the queues between stages.
+        """
+        if not stages:
+            raise ValueError('Pipeline requires at least one stage.')
+
+        self.stages = []
+        for stage in stages:
+            func, nworkers = stage if isinstance(stage, tuple) else (stage, 1)
+            if not callable(func) or int(nworkers) < 1:
+                raise ValueError(f'Invalid pipeline stage: {stage!r}.')
+            self.stages.append((func, int(nworkers)))
+
+        self.maxsize = int(maxsize)
+        self.workers = []
+        self.queues = []
+        self.feeder = None
+        self.stopped = threading.Event()
+
+    def __call__(self, items):
+        return list(self.run(items))
+
+    def run(self, items):
+        """
+        Feed `items` through the pipeline, yielding the results of the final
+        stage as they become available. Results are not in the order of the
+        input.
+
+        Raises
+        ------
+        Exception
+            The first error raised by a stage function (or while loading the
+            input), once all other results have been yielded.
+        WorkerLost
+            If a worker process died, in which case the pipeline cannot
+            complete.
+        """
+        queues = self.queues = [mp.Queue(self.maxsize)
+                                for _ in range(len(self.stages) + 1)]
+        self.stopped = stopped = threading.Event()
+        # sentinels each stage has to pass on
+        nsentinels = [n for _, n in self.stages[1:]] + [1]
+        for (func, n), inq, outq, nsent in zip(self.stages, queues, queues[1:],
+                                               nsentinels):
+            active = mp.Value('i', n)
+            for i in range(n):
+                name = f'{getattr(func, "__name__", "stage")}-{i}'
+                worker = StageWorker(func, inq, outq, active, nsent, name=name,
+                                     daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+        # Load the input in a thread, so that results can be consumed while the
+        # input queue is full
+        errors = []
+        feeder = self.feeder = threading.Thread(
+            target=self._feed, args=(items, queues[0], stopped, errors),
+            daemon=True
+        )
+        feeder.start()
+
+        failures = []
+        try:
+            while (result := self._get(queues[-1])) is not SENTINEL:
+                if isinstance(result, _Failure):
+                    failures.append(result)
+                else:
+                    yield result
+
+            feeder.join()
+            for worker in self.workers:
+                worker.join()
+        finally:
+            self.close()
+
+        if errors:
+            raise errors[0]
+
+        if failures:
+            failure = failures[0]
+            raise failure.error from RemoteTraceback(failure.traceback)
+
+    def _get(self, queue):
+        # Wait for the next result, checking that no worker died, since the
+        # pipeline then never receives its final sentinel
+        while True:
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                pass
+
+            lost = [worker for worker in self.workers
+                    if worker.exitcode not in (None, 0)]
+            if not lost and any(worker.is_alive() for worker in self.workers):
+                continue
+
+            # results put by workers before they exited are already in the pipe
+            try:
+                return queue.get_nowait()
+            except Empty:
+                raise WorkerLost(
+                    'Pipeline worker(s) died: ' +
+                    ', '.join(f'{worker.name} (exit code {worker.exitcode})'
+                              for worker in lost or self.workers)
+                ) from None
+
+    def _feed(self, items, queue, stopped, errors):
+        try:
+            for item in items:
+                if not self._put(queue, item, stopped):
+                    return
+        except Exception as err:
+            self.logger.exception('Loading pipeline input failed.')
+            errors.append(err)
+        finally:
+            for _ in range(self.stages[0][1]):
+                self._put(queue, SENTINEL, stopped)
+
+    @staticmethod
+    def _put(queue, item, stopped):
+        # Block while the queue is full, but give up once the pipeline stopped,
+        # which may happen while no worker is consuming
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def close(self):
+        """Stop the input feeder and all workers."""
+        self.stopped.set()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        self.workers = []
+
+        if self.feeder:
+            self.feeder.join()
+            self.feeder = None
+
+        # Items left in the queues are discarded, instead of blocking until
+        # they are flushed to the pipes that nobody reads anymore
+        for queue in self.queues:
+            queue.cancel_join_thread()
+            queue.close()
+        self.queues = []
@@ -1,19 +1,32 @@
 
 # std
+import os
+import sys
+import time
+import socket
+import inspect
+import threading
+import itertools as itt
 import contextlib as ctx
 import multiprocessing as mp
+from pathlib import Path
 
 # third-party
 import numpy as np
 import more_itertools as mit
 from tqdm import tqdm
 from loguru import logger
-from joblib import Parallel, delayed
+from joblib import delayed
 
+# optional
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
 
 # relative
 from .. import pprint as pp
-from ..io import load_memmap
+from ..io import RecordStore, load_bitmap, load_memmap
 from ..string import pluralize
 from ..config import ConfigNode
 from ..oo.property import Alias
@@ -21,7 +34,9 @@ from ..oo.slots import SlotHelper
 from ..oo.represent import Represent
 from ..flow.contexts import ContextStack
 from ..logging import LoggingMixin, TqdmLogAdapter, TqdmStreamAdapter
-from .joblib import initialized
+from .shared import shared
+from .broker import DONE, FAILED, TaskBroker
+from .backends import PROCESS_BACKENDS, Counter, get_backend
 
 
 # ---------------------------------------------------------------------------- #
@@ -45,15 +60,34 @@ del prg
 
 # ---------------------------------------------------------------------------- #
 # Multiprocessing
-sync_manager = mp.Manager()
+# Per-task statistics recorded by `Executor`: wall and cpu time in seconds,
+# peak resident memory of the worker process in bytes, start time (unix epoch),
+# and native thread id of the worker. Note cpu time is that of the worker
+# process, so it includes other threads of the process.
+STATS_DTYPE = np.dtype([('wall', 'f4'),
+                        ('cpu', 'f4'),
+                        ('rss', 'f8'),
+                        ('start', 'f8'),
+                        ('worker', 'i4')])
+STATS_FILL = (np.nan, np.nan, np.nan, np.nan, 0)
+
+# Units of `ru_maxrss`
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# Scheduling modes for `BatchedExecutor`
+SCHEDULES = ('static', 'guided')
+# Fraction of the remaining work (divided by the number of workers) assigned to
+# each batch in guided scheduling
+GUIDED_FACTOR = 2
 
 # default lock - does nothing
 memory_lock = ctx.nullcontext()
 
 
-def set_locks(mem_lock, tqdm_lock):
+def set_locks(mem_lock, tqdm_lock, *shared):
     """
-    Initialize each process with a global variable lock.
+    Initialize each process with a global variable lock. Any additional shared
+    objects (eg. the failure counter) are passed to the worker when it starts.
     """
     global memory_lock
     memory_lock = mem_lock
@@ -96,13 +130,28 @@ class Framework(SlotHelper, LoggingMixin):
 
     def __init__(self, jobname=None, backend='multiprocessing', xfail=1,
                  **config):
-
+        """
+        Parameters
+        ----------
+        jobname : str, optional
+            Name of the job, shown in the progress bar. By default the name of
+            the class.
+        backend : str, optional
+            Name of the execution backend, by default 'multiprocessing'. One of
+            'process', 'thread', 'asyncio' (see `recipes.compute.backends`), or
+            any backend supported by `joblib.Parallel`. Coroutine `compute`
+            methods always use the 'asyncio' backend.
+        xfail : int, optional
+            Number of failed tasks after which the job is aborted, by default 1.
+        **config
+            Parameters for the backend.
+        """
         super().__init__(
             results=None,
             config=config,
             backend=str(backend),
             xfail=xfail,
-            nfail=sync_manager.Value('i', 0),
+            nfail=Counter(),
             jobname=(type(self).__name__ if jobname is None else str(jobname))
         )
 
@@ -122,27 +171,31 @@ class Framework(SlotHelper, LoggingMixin):
         if njobs in (-1, None):
             njobs = mp.cpu_count()
 
-        if len(self.results) == 1:
+        if not isinstance(self.results, RecordStore) and len(self.results) == 1:
             self.logger.info('Only one job in work queue, setting `njobs=1`.')
             njobs = 1
 
+        # coroutines are run on an event loop, also for a single worker
+        coroutine = inspect.iscoroutinefunction(self.compute)
+        backend = 'asyncio' if coroutine else self.backend
+
         # setup compute context
-        if njobs == 1:
+        if njobs == 1 and not coroutine:
             return self._compute, ctx.nullcontext(list), ()
 
-        # locks for managing output contention
-        mem_lock = sync_manager.Lock()
-        prg_lock = mp.RLock()
+        # pool of workers, and the locks for managing output contention
+        executor = get_backend(backend, njobs, **config)
+        mem_lock, prg_lock = executor.locks()
+
+        # failure counter shared by the workers
+        self.nfail = executor.Counter(self.nfail.value)
 
         # set lock for progress bar stream
         tqdm.set_lock(prg_lock)
 
-        # NOTE: object serialization is about x100-150 times faster with
-        # "multiprocessing" backend. ~0.1s vs 10s for "loky".
-        worker = delayed(self._compute)
-        executor = Parallel(njobs, self.backend, **config)
+        worker = delayed(self._acompute if coroutine else self._compute)
         context = ContextStack(
-            initialized(executor, set_locks, (mem_lock, prg_lock))
+            executor.initialize(set_locks, mem_lock, prg_lock, self.nfail)
         )
 
         # Adapt logging for progressbar
@@ -152,7 +205,8 @@ class Framework(SlotHelper, LoggingMixin):
 
         return worker, context, (mem_lock, prg_lock)
 
-    def get_workload(self, *data, progress_bar=False, jobname='', **kws):
+    def get_workload(self, *data, njobs=-1, progress_bar=False, jobname='',
+                     **kws):
         # workload iterable with progressbar if required
 
         self.logger.debug('Creating workload for {} items.', len(data))
@@ -211,7 +265,7 @@ class Framework(SlotHelper, LoggingMixin):
     def main(self, data, njobs, progress_bar, jobname, *args, **kws):
 
         # fetch work
-        workload = self.get_workload(*data,
+        workload = self.get_workload(*data, njobs=njobs,
                                      progress_bar=progress_bar, jobname=jobname)
 
         # setup compute context
@@ -237,39 +291,58 @@ class Framework(SlotHelper, LoggingMixin):
     def _compute(self, index, *args, **kws):
 
         # first check if we are good to continue
-        if self.nfail.value >= self.xfail:
-            # doing this here (instead of inside the except clause) avoids
-            # duplication by chained exception traceback when logging
-            raise AbortCompute(f'Reach exception threshold of {self.xfail}.')
+        self._check()
 
         # compute
         try:
             result = self.compute(*args, **kws)
+            if streamed := inspect.isgenerator(result):
+                # Results are written to the sink as they are produced, and
+                # errors raised while producing them are failures of the task
+                self.collect(index, result)
         except Exception as err:
-            #
-            self.logger.exception('Compute failed for index {}:\n{}', index, err)
-
-            # check if we should exit
-            with memory_lock:
-                nfail = self.nfail.value + 1
-                self.nfail.value = nfail
-
-                # check if we are beyond exception threshold
-                if nfail >= self.xfail:
-                    if nfail > 1:
-                        self.logger.critical('Exception threshold reached!')
-                        raise AbortCompute(
-                            f'Reach failure threshold of {self.xfail}.'
-                        ) from err
-                    else:
-                        raise err
-                else:
-                    self.logger.info('Continuing after {}/{} failures.',
-                                     nfail, self.xfail)
+            self._fail(index, err)
+        else:
+            if not streamed:
+                self.collect(index, result)
+
+    async def _acompute(self, index, *args, **kws):
+        # `_compute` for coroutine compute methods
+        self._check()
 
+        try:
+            result = await self.compute(*args, **kws)
+        except Exception as err:
+            self._fail(index, err)
         else:
             self.collect(index, result)
 
+    def _check(self):
+        if self.nfail.value >= self.xfail:
+            # doing this here (instead of inside the except clause) avoids
+            # duplication by chained exception traceback when logging
+            raise AbortCompute(f'Reach exception threshold of {self.xfail}.')
+
+    def _fail(self, index, err):
+        #
+        self.logger.exception('Compute failed for index {}:\n{}', index, err)
+
+        # check if we should exit
+        with memory_lock:
+            nfail = self.nfail.increment()
+
+        # check if we are beyond exception threshold
+        if nfail >= self.xfail:
+            if nfail > 1:
+                self.logger.critical('Exception threshold reached!')
+                raise AbortCompute(
+                    f'Reach failure threshold of {self.xfail}.'
+                ) from err
+
+            raise err
+
+        self.logger.info('Continuing after {}/{} failures.', nfail, self.xfail)
+
     def collect(self, index, result):
         # collect results
         self.results[index] = result
@@ -282,35 +355,125 @@ class Framework(SlotHelper, LoggingMixin):
         return self.results
 
 
+def _peak_rss():
+    # peak resident memory of this process in bytes
+    if resource is None:  # pragma: no cover
+        return np.nan
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
 class Executor(Framework):
     """
     Failure tolerant parallel task executor with flexible backend, data
     persistence and progress monitoring.
     """
 
+    __slots__ = ('done', 'stats', 'started')
+
+    __repr__ = Represent((..., 'completeness'),
+                         ignore=('results', 'stats', 'started'),
+                         remap={'nfail': 'nfail.value'},
+                         newline='\n')
+
     # aliases
     reset = Alias('reset_memory')
     get_index = Alias('select')
 
+    def __init__(self, jobname=None, backend='multiprocessing', xfail=1,
+                 **config):
+        super().__init__(jobname, backend, xfail, **config)
+        self.done = self.stats = None
+        self.started = np.nan
+
     def init_memory(self, shape, loc=None, fill=np.nan, overwrite=False, **kws):
         """
         Initialize shared memory synchronised access wrappers. Should only be
         run in the main process.
 
+        Completion of each task is tracked in a bitmap that is memory-mapped
+        alongside the results (at "<loc>.done.npy"), so that resuming an
+        interrupted run only needs to read one bit per task, irrespective of
+        the size or data type of the results. The timing and memory use of
+        each task are recorded in another memory map (at "<loc>.stats.npy").
+
         Parameters
         ----------
-        n:
-            number of frames
-        overwrite
+        shape : int or tuple of int
+            Shape of the results array. The first dimension is the number of
+            tasks.
+        loc : str or path-like, optional
+            File location for the results, by default None, which uses a
+            temporary file.
+        fill : object, optional
+            Initial value for the results, by default nan.
+        overwrite : bool, optional
+            Whether to overwrite existing results, by default False.
+        """
+        resume = (loc is not None) and Path(loc).exists() and not overwrite
+        self.results = load_memmap(loc, shape, fill=fill, overwrite=overwrite, **kws)
 
-        Returns
-        -------
+        filename = self._sidecar('done')
+        legacy = resume and not (filename and filename.exists())
+        self.done = load_bitmap(filename, len(self.results),
+                                overwrite=not resume)
+
+        if legacy:
+            # Results were saved without a completion bitmap. Infer completion
+            # from the results once.
+            self.logger.info('Creating completion bitmap for existing results '
+                             'at {!r}.', str(filename))
+            self.done.update(self._has_results())
 
+        self._init_stats(overwrite)
+
+    def init_store(self, n, loc=None, overwrite=False, **kws):
         """
-        self.results = load_memmap(loc, shape, fill=fill, overwrite=overwrite, **kws)
+        Initialize a streaming store for results of variable size, as an
+        alternative to the pre-allocated results array of `init_memory`. The
+        `compute` method may then return results of any size, or yield any
+        number of results for each task, which are written to disk as they are
+        produced. The results for task `i` are `self.results[i]`, a list of
+        arrays.
+
+        Parameters
+        ----------
+        n : int
+            Number of tasks.
+        loc : str or path-like, optional
+            Folder for the results, by default None, which uses a temporary
+            folder.
+        overwrite : bool, optional
+            Whether to overwrite existing results, by default False.
+        **kws
+            Parameters for `recipes.io.RecordStore`.
+        """
+        resume = (loc is not None) and Path(loc).exists() and not overwrite
+        self.results = RecordStore(loc, overwrite=overwrite, **kws)
+        self.done = load_bitmap(self._sidecar('done'), n, overwrite=not resume)
+        self._init_stats(overwrite)
+
+    def _init_stats(self, overwrite):
+        self.stats = load_memmap(self._sidecar('stats'), len(self.done),
+                                 STATS_DTYPE, STATS_FILL, overwrite=overwrite)
+
+    def _sidecar(self, name):
+        # location of auxiliary memory maps stored alongside the results.
+        # None (a temporary file) if the results are not file backed
+        results = self.results
+        if not isinstance(results, RecordStore):
+            results = np.ma.getdata(results)
+
+        if filename := getattr(results, 'filename', None):
+            filename = Path(filename)
+            return filename.with_name(f'{filename.stem}.{name}.npy')
 
     def reset_memory(self):
-        self.results[:] = np.nan
+        if isinstance(self.results, RecordStore):
+            self.results.clear()
+        else:
+            self.results[:] = np.nan
+        self.done.clear()
+        self.stats[:] = STATS_FILL
 
     def __call__(self, indices=None, *data, **kws):
         """
@@ -338,22 +501,27 @@ class Executor(Framework):
         return f'{type(self).__name__}({self.completeness})'
 
     # ------------------------------------------------------------------------ #
-    @property
-    def completed(self):
+    def _has_results(self):
         # boolean array flags True if frame has any measurement(s)
         return ~np.isnan(self.results).all(
             tuple({*range(self.results.ndim)} - {0})
         )
 
+    @property
+    def completed(self):
+        # boolean array flags True for tasks that completed successfully
+        return np.asarray(self.done)
+
     @property
     def completeness(self):
         if self.results is None:
             return '0/0'
 
-        return f'{self.completed.sum()}/{len(self.results)}'
+        return f'{self.done.count()}/{len(self.done)}'
 
     # ------------------------------------------------------------------------ #
-    def get_workload(self, indices=None, *distributed, progress_bar=None, jobname='', **kws):
+    def get_workload(self, indices=None, *distributed, njobs=-1,
+                     progress_bar=None, jobname='', **kws):
         # workload iterable with progressbar if required
 
         # get indices
@@ -379,16 +547,17 @@ class Executor(Framework):
         # get workload
         # NOTE: array data should not be "distributed", since there is a cpu and
         # memory overhead associated with pickling arrays vs pickling memmory
-        # maps, which will happen in the main process joblib automatically
-        # convert arrays to memmaps, so prefered recipe is to select data from
-        # the memory map within the worker process.
+        # maps. Arrays passed to `run` are placed in shared memory (or passed
+        # through if they are memmaps) and sent to workers by reference, so
+        # prefered recipe is to select data from the shared arrays within the
+        # worker process.
         return super().get_workload(indices, *distributed,
                                     jobname=jobname, progress_bar=progress_bar,
                                     initial=done.sum(), total=len(done), **kws)
 
     # @api.synonyms({'n_jobs': 'njobs', 'job_name': 'jobname'})
     def run(self, *data, indices=None, njobs=-1, progress_bar=None, jobname='',
-            args=(), **kws):
+            args=(), share=None, **kws):
         """
         Start a job. The workload will be split into
         chunks of size ``
@@ -412,6 +581,11 @@ class Executor(Framework):
             Job name to display in the progress bar.
         args: tuple
             Argument tuple passed to the workers.
+        share : bool, optional
+            Whether to copy large arrays in `data` to shared memory for the
+            duration of the job, so that workers map the arrays instead of
+            receiving a copy with each task. By default, arrays are shared
+            when the tasks run in multiple processes.
         **kws:
             Keyword parameters passed to the workers.
 
@@ -425,56 +599,373 @@ class Executor(Framework):
             raise FileNotFoundError('Initialize memory first by calling the '
                                     '`init_memory` method.')
 
+        if share is None:
+            share = (self.backend in PROCESS_BACKENDS) and (njobs != 1)
+
         # main compute
-        args = (*data, *args)
-        super().main((indices, ), njobs, progress_bar, jobname, *args, **kws)
+        self.started = time.time()
+        with (shared(*data) if share else ctx.nullcontext(data)) as data:
+            args = (*data, *args)
+            super().main((indices, ), njobs, progress_bar, jobname, *args, **kws)
+
         return self.finalize(*args, **kws)
 
     def select(self, index, *data):
         return _select(index, *data)
 
     def _compute(self, index, *distributed, args=(), **kws):
-        # select indexed arrays
-        _args = self.select(index, *distributed)
-        return super()._compute(index, *_args, *args, **kws)
+        with self._timed(index):
+            # select indexed arrays
+            _args = self.select(index, *distributed)
+            return super()._compute(index, *_args, *args, **kws)
+
+    async def _acompute(self, index, *distributed, args=(), **kws):
+        with self._timed(index):
+            _args = self.select(index, *distributed)
+            return await super()._acompute(index, *_args, *args, **kws)
+
+    @ctx.contextmanager
+    def _timed(self, index):
+        # Record the statistics of a task, including failed tasks. Each task is
+        # timed by exactly one worker, so no lock needed.
+        start, wall, cpu = time.time(), time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            if self.stats is not None:
+                self.stats[index] = (time.perf_counter() - wall,
+                                     time.process_time() - cpu,
+                                     _peak_rss(), start,
+                                     threading.get_native_id())
+
+    def finalize(self, *args, **kws):
+        if self.stats is not None:
+            self.logger.info('{}', self.report())
+        return super().finalize(*args, **kws)
+
+    def report(self, slowest=5):
+        """
+        Summary of the task statistics of the latest run: the distribution of
+        wall and cpu time per task, the slowest tasks, and the utilisation of
+        each worker. Comparing cpu to wall time distinguishes compute bound
+        tasks from those waiting on I/O, and low utilisation indicates idle
+        workers, eg. due to skewed task sizes.
+
+        Parameters
+        ----------
+        slowest : int, optional
+            Number of slowest tasks to list, by default 5.
+
+        Returns
+        -------
+        str
+        """
+        stats = self.stats
+        timed = np.flatnonzero(stats['start'] >= self.started)
+        if not len(timed):
+            timed = np.flatnonzero(~np.isnan(stats['start']))
+        if not len(timed):
+            return f'{self.jobname}: No tasks timed.'
+
+        stats = stats[timed]
+        wall, cpu = stats['wall'], stats['cpu']
+        end = stats['start'] + wall
+        span = end.max() - stats['start'].min()
+        q = np.percentile(wall, [50, 90, 99])
+        order = np.argsort(-wall, kind='stable')[:slowest]
+        lines = [
+            f'{self.jobname}: {len(timed)} tasks in {span:.3f}s '
+            f'({len(timed) / span if span else np.inf:.1f} tasks/s).',
+            f'Wall time per task: median {q[0]:.3g}s, 90% {q[1]:.3g}s, '
+            f'99% {q[2]:.3g}s, max {wall.max():.3g}s.',
+            f'CPU time / wall time: {cpu.sum() / wall.sum():.1%}. '
+            f'Peak memory: {np.nanmax(stats["rss"]) / 2 ** 20:.1f} MB.',
+            'Slowest tasks: ' + ', '.join(f'{i} ({w:.3g}s)' for i, w in
+                                          zip(timed[order], wall[order])),
+            'Workers:'
+        ]
+
+        for worker in np.unique(stats['worker']):
+            busy = wall[stats['worker'] == worker]
+            lines.append(f'    {worker}: {len(busy)} tasks, {busy.sum():.3f}s '
+                         f'busy ({busy.sum() / span if span else 1:.1%}).')
+
+        return '\n'.join(lines)
+
+    def collect(self, index, result):
+        super().collect(index, result)
+
+        # Flag completion only once the result has been written. Neighbouring
+        # tasks share a byte in the bitmap, so flips are serialized.
+        with memory_lock:
+            self.done.set(index)
+
+    # ------------------------------------------------------------------------ #
+    # Distributed execution
+
+    def distribute(self, broker, indices=None, **kws):
+        """
+        Submit the tasks that are not yet done to a task broker, from which
+        workers on other processes or machines claim them with `work`.
+
+        Parameters
+        ----------
+        broker : TaskBroker or str or path-like
+            The broker, or the location of its database.
+        indices : Iterable, optional
+            Indices of tasks to submit, by default all incomplete tasks.
+        **kws
+            Parameters for `TaskBroker` if `broker` is a location.
+
+        Returns
+        -------
+        TaskBroker
+        """
+        if self.results is None:
+            raise FileNotFoundError('Initialize memory first by calling the '
+                                    '`init_memory` method.')
+
+        if not isinstance(broker, TaskBroker):
+            broker = TaskBroker(broker, **kws)
+
+        if indices is None:
+            indices = self.done.indices(False)
+
+        broker.submit(indices)
+        self.logger.info('Submitted {} tasks to {}.', len(indices), broker)
+        return broker
+
+    def work(self, broker, *data, chunk=None, njobs=-1, worker=None, **kws):
+        """
+        Claim chunks of tasks from `broker` and compute them, until no tasks
+        remain. Results are written to the results of this executor, which
+        should be initialized with the same location as those of the
+        coordinator. Since workers on different machines write to the same
+        files, use a `RecordStore` (see `init_store`) for results shared over
+        a network file system. Memory-mapped results are safe for workers on
+        the same machine.
+
+        The failure threshold `xfail` applies to the total number of failures
+        across all workers.
+
+        Parameters
+        ----------
+        broker : TaskBroker or proxy
+            The broker, or a proxy for a remote broker returned by
+            `recipes.compute.broker.connect`.
+        *data : tuple
+            Data sequences, as for `run`.
+        chunk : int, optional
+            Number of tasks claimed at once, by default 4 per job.
+        njobs : int, optional
+            Number of concurrent workers on this machine, by default -1, which
+            uses the number of cpus.
+        worker : str, optional
+            Name of this worker reported to the broker, by default
+            "<hostname>:<pid>".
+        **kws
+            Parameters for `run`.
+
+        Raises
+        ------
+        AbortCompute
+            If the failure threshold is reached.
+        """
+        if self.results is None:
+            raise FileNotFoundError('Initialize memory first by calling the '
+                                    '`init_memory` method.')
+
+        njobs = resolve_njobs(njobs)
+        chunk = int(chunk or 4 * njobs)
+        worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+
+        # The completion flags and statistics of the coordinator are tracked by
+        # the broker. Workers record their own in temporary files, so that
+        # they never write bytes shared with tasks of other workers.
+        done, stats = self.done, self.stats
+        self.done = load_bitmap(None, len(done))
+        self.stats = load_memmap(None, len(done), STATS_DTYPE, STATS_FILL)
+        kws.setdefault('progress_bar', False)
+        share = kws.pop('share', None)
+        if share is None:
+            share = (self.backend in PROCESS_BACKENDS) and (njobs != 1)
+
+        # share data once for all chunks
+        try:
+            with (shared(*data) if share else ctx.nullcontext(data)) as data:
+                while True:
+                    self.nfail = Counter(broker.nfailed())
+                    self._check()
+                    if not (indices := broker.claim(worker, chunk)):
+                        break
+
+                    self.logger.debug('Worker {} claimed tasks {}.',
+                                      worker, indices)
+                    self.done.clear()
+                    started = time.time()
+                    try:
+                        self.run(*data, indices=indices, share=False,
+                                 njobs=min(njobs, len(indices)), **kws)
+                    finally:
+                        self._report(broker, indices, started)
+        finally:
+            self.done, self.stats = done, stats
+
+    def _report(self, broker, indices, started):
+        # report the outcome of a chunk of tasks to the broker
+        indices = np.asarray(indices)
+        completed = np.asarray(self.done)[indices]
+        attempted = self.stats['start'][indices] >= started
+        broker.complete(indices[completed].tolist())
+        broker.fail(indices[attempted & ~completed].tolist())
+        broker.release(indices[~attempted].tolist())
+
+    def gather(self, broker):
+        """
+        Flag the tasks completed by the workers of `broker` as done.
+
+        Returns
+        -------
+        results
+        """
+        for index in broker.indices(DONE):
+            self.done.set(index)
+        self.done.flush()
+
+        if failed := broker.indices(FAILED):
+            self.logger.warning('{} tasks failed: {}.', len(failed), failed)
+
+        return self.results
 
 
 class BatchedExecutor(Executor):
+    """
+    Executor that sends tasks to the workers in batches, reducing the overhead
+    of dispatching many small tasks.
+
+    Two scheduling modes are supported:
+        * 'static': The tasks are divided into one batch per worker.
+        * 'guided': Batches are dispatched to workers as they become free, and
+          start large, shrinking towards the end of the job. Each batch holds a
+          fixed fraction of the estimated remaining work, so that the tail of
+          the job is spread over all workers in small batches. The compute time
+          of each task is recorded (in a memory map alongside the results), and
+          used to estimate the remaining work as the job progresses. When
+          resuming a job, or running it again, tasks with the longest recorded
+          compute times are scheduled first.
+    """
+
+    __slots__ = ('schedule', 'batch_size')
+
+    def __init__(self, jobname=None, backend='multiprocessing', xfail=1,
+                 schedule='static', batch_size=None, **config):
+        """
+        Parameters
+        ----------
+        schedule : {'static', 'guided'}
+            Scheduling mode, by default 'static'.
+        batch_size : int, optional
+            For 'static' scheduling, the number of tasks in each batch, by
+            default the number of tasks divided by the number of workers. For
+            'guided' scheduling, the minimum batch size, by default 1.
+        """
+        super().__init__(jobname, backend, xfail, **config)
+
+        if schedule not in SCHEDULES:
+            raise ValueError(f'Invalid schedule {schedule!r}. Valid options '
+                             f'are: {SCHEDULES}.')
+
+        self.schedule = schedule
+        self.batch_size = batch_size
+
+    @property
+    def costs(self):
+        # compute time of each task in seconds
+        return None if self.stats is None else self.stats['wall']
 
     def setup(self, njobs, progress_bar, **config):
-        _, context, locks = super().setup(njobs, progress_bar, **config)
-        return delayed(self.loop), context, locks
+        worker, context, locks = super().setup(njobs, progress_bar, **config)
+        # run batches in the main process if there is only one worker
+        if worker == self._compute:
+            return self.loop, context, locks
+
+        coroutine = inspect.iscoroutinefunction(self.compute)
+        return delayed(self._aloop if coroutine else self.loop), context, locks
+
+    def get_workload(self, indices=None, *distributed, njobs=-1,
+                     batch_size=None, progress_bar=None, jobname='', **kws):
+
+        if indices is None:
+            indices = self.done.indices(False)
+        indices = np.fromiter(indices, int)
 
-    def get_workload(self, indices=None, *distributed,
-                     njobs=-1, batch_size=None,
-                     progress_bar=None, jobname=''):
+        if self.schedule == 'guided':
+            # longest tasks first
+            indices = indices[np.argsort(-self._estimate(indices), kind='stable')]
 
         #
         workload = super().get_workload(indices, *distributed,
-                                        progress_bar=progress_bar, jobname=jobname)
+                                        progress_bar=progress_bar,
+                                        jobname=jobname, **kws)
 
         if not workload:
             return ()
 
-        n = len(self.results)
+        n = len(indices)
         njobs = resolve_njobs(njobs)
+        if self.schedule == 'guided':
+            batches = self._guided(workload, indices, njobs)
+            self.logger.info('Work split into batches of decreasing size '
+                             '(guided schedule), using {} {}.', njobs,
+                             pluralize('worker', plural='concurrent workers',
+                                       n=njobs))
+        else:
+            # batches are sized for the full job, as before guided scheduling
+            n = len(self.results)
+            batch_size = (batch_size or self.batch_size or
+                          ((n // njobs) + (n % njobs)))
+            batches = mit.chunked(workload, batch_size)
+            n_batches = round(n / batch_size)
 
-        if batch_size is None:
-            batch_size = (n // njobs) + (n % njobs)
-
-        # divide work
-        batches = mit.chunked(workload, batch_size)
-        n_batches = round(n / batch_size)
-
-        #
-        self.logger.opt(lazy=True).info(
-            'Work split into {0[0]} batches of {0[1]} elements each, using {0[2]} {0[3]}.',
-            lambda: (n_batches, batch_size, njobs,
-                     pluralize('worker', plural='concurrent workers', n=njobs))
-        )
-
-        return batches
+            #
+            self.logger.opt(lazy=True).info(
+                'Work split into {0[0]} batches of {0[1]} elements each, using '
+                '{0[2]} {0[3]}.',
+                lambda: (n_batches, batch_size, njobs,
+                         pluralize('worker', plural='concurrent workers', n=njobs))
+            )
+
+        # each batch is the single argument to `loop`
+        return ((batch, ) for batch in batches)
+
+    def _estimate(self, indices):
+        # Estimated compute time of tasks. Tasks that have not been timed are
+        # assumed to take the mean time of those that have.
+        costs = self.costs[indices]
+        if (unknown := np.isnan(costs)).any():
+            costs[unknown] = 1 if unknown.all() else np.nanmean(costs)
+        return costs
+
+    def _guided(self, workload, indices, njobs):
+        # Guided self-scheduling: each batch takes 1 / (GUIDED_FACTOR * njobs)
+        # of the estimated remaining work. Estimates are refreshed for each
+        # batch, since the workers record the compute time of each task in the
+        # shared `costs` memory map as they go.
+        workload = iter(workload)
+        minimum = self.batch_size or 1
+        start = 0
+        while start < len(indices):
+            costs = np.cumsum(self._estimate(indices[start:]))
+            budget = costs[-1] / (GUIDED_FACTOR * njobs)
+            size = max(minimum, int(np.searchsorted(costs, budget, 'right')))
+            yield list(itt.islice(workload, size))
+            start += size
 
     def loop(self, itr, *args, **kws):
         for data in itr:
             self._compute(*data, *args, **kws)
+
+    async def _aloop(self, itr, *args, **kws):
+        # `loop` for coroutine compute methods
+        for data in itr:
+            await self._acompute(*data, *args, **kws)
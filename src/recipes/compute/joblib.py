@@ -87,7 +87,11 @@ def initialized(self, initializer=noop, args=(), **kws):
         return self
 
     if isinstance(self._backend, MultiprocessingBackend):
-        self._backend_args.update(initializer=initializer, initargs=args)
+        # arguments for the pool were renamed in joblib 1.3
+        pool_args = getattr(self, '_backend_kwargs', None)
+        if pool_args is None:
+            pool_args = self._backend_args
+        pool_args.update(initializer=initializer, initargs=args)
         return self
 
     if not hasattr(self._backend, '_workers'):
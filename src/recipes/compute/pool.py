@@ -1,225 +1,354 @@
+"""
+Supervised process pool.
+"""
 
 # std
 import os
 import time
+import pickle
 import threading
+import traceback
+import itertools as itt
 import multiprocessing as mp
+from collections import deque
+from multiprocessing.connection import wait
+
+# third-party
+import more_itertools as mit
 
 # relative
 from ..logging import LoggingMixin
 
 
-class ConservativePool(mp.pool.Pool):
-    """
-    Subclass of Pool which avoid making a potentially huge list when mapping over a function
-    and is therefor more memory efficient
-    """
+# ---------------------------------------------------------------------------- #
+# Interval in seconds at which workers signal that they are alive
+HEARTBEAT = 1.
+# A busy worker is considered hung after missing this many heartbeats
+MISSED_BEATS = 5
 
-    def _map_async(self, func, iterable, mapper, chunksize, callback=None,
-                   error_callback=None):
-        """
-        Helper function to implement map, starmap and their async counterparts.
-        """
-        if self._state != 0:
-            raise ValueError("Pool not running")
-            #
 
-        if chunksize is None:
-            raise ValueError('Need chunksize')
+# ---------------------------------------------------------------------------- #
+class WorkerLost(RuntimeError):
+    """A worker died or hung while running a task, and retries are exhausted."""
 
-        task_batches = self.__class__._get_tasks(func, iterable, chunksize)
-        result = mp.pool.MapResult(self._cache, chunksize, N, callback,
-                                   error_callback=error_callback)
-        self._taskqueue.put((((result._job, i, mapper, (x,), {})
-                              for i, x in enumerate(task_batches)), None))
-        return result
 
+def _beat(value, interval):
+    while True:
+        value.value = time.monotonic()
+        time.sleep(interval)
 
-class ProcessPool(LoggingMixin):
-    """A trimmed down version of mp.pool.Pool"""
 
-    def __init__(self, inq, outq=None, processes=None, **kws):
+def _picklable(err):
+    try:
+        pickle.dumps(err)
+    except Exception:
+        return RuntimeError(f'{type(err).__name__}: {err}')
+    return err
 
-        self.inq = inq
-        self.outq = outq
-        self.maintain = kws.get('maintain')
-        self._kws = kws
 
-        #self._state = RUN
+def _work(conn, beat, interval, initializer, initargs, maxtasks):
+    # Worker process main loop. Receives chunks of tasks over the pipe, and
+    # sends back a list of (success, result or (exception, traceback)) for each.
+    threading.Thread(target=_beat, args=(beat, interval), daemon=True).start()
+    if initializer is not None:
+        initializer(*initargs)
 
-        if processes is None:
-            processes = os.cpu_count() or 1
+    for _ in (itt.count() if maxtasks is None else range(maxtasks)):
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
 
-        self._processes = processes
-        self._pool = []
-        self._repopulate_pool()
+        if task is None:
+            break
 
-        self._worker_handler = threading.Thread(
-            target=ProcessPool._handle_workers, args=(self,))
-        self._worker_handler.daemon = True
-        self._worker_handler._state = RUN
-        self._worker_handler.start()
+        uid, func, chunk = task
+        results = []
+        for args in chunk:
+            try:
+                results.append((True, func(*args)))
+            except Exception as err:
+                results.append((False, (_picklable(err), traceback.format_exc())))
 
-        # self._worker_monitor = threading.Thread(target=ProcessPool._monitor_workers,
-        # args=(self,))
-        #self._worker_monitor._state = RUN
-        # self._worker_monitor.start()
+        conn.send((uid, results))
 
-    def _maintain_pool(self):
-        """Clean up any exited workers and start replacements for them.
-        """
-        if self._join_exited_workers() and self.maintain.is_set():
-            self._repopulate_pool()
-            time.sleep(0.1)
+    conn.close()
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'beat', 'task', 'started', 'completed')
+
+    def __init__(self, process, conn, beat):
+        self.process = process
+        self.conn = conn
+        self.beat = beat
+        self.task = None
+        self.started = None
+        self.completed = 0
+
+    def __repr__(self):
+        return f'Worker({self.process.pid})'
 
-    def _join_exited_workers(self):
-        """Cleanup after any worker processes which have exited due to reaching
-        their specified lifetime.  Returns True if any workers were cleaned up.
+
+# ---------------------------------------------------------------------------- #
+class SupervisedPool(LoggingMixin):
+    """
+    Process pool that supervises the health of its workers.
+
+    * Each worker signals that it is alive at a regular interval. A worker that
+      misses several heartbeats while running a task (eg. deadlocked), or that
+      runs a task for longer than `timeout`, is killed.
+    * Workers that die or are killed are replaced, and their task is sent to
+      another worker, up to `retries` times.
+    * Workers are replaced after completing `maxtasksperchild` tasks, which
+      caps the memory held by leaky tasks.
+    * Tasks are read lazily from the input iterable as workers become free, so
+      the task list is never materialized.
+
+    Workers are supervised (and replaced) while iterating over the results of
+    `imap` or `imap_unordered`, which is driven by events from the workers
+    rather than polling.
+
+    Examples
+    --------
+    >>> with SupervisedPool(4, maxtasksperchild=100, timeout=60) as pool:
+    ...     for result in pool.imap(func, items):
+    ...         ...
+    """
+
+    def __init__(self, processes=None, initializer=None, initargs=(),
+                 maxtasksperchild=None, heartbeat=HEARTBEAT,
+                 missed_beats=MISSED_BEATS, timeout=None, retries=1,
+                 context=None):
         """
-        cleaned = False
-        for i in reversed(range(len(self._pool))):
-            worker = self._pool[i]
-            if worker.exitcode is not None:
-                # worker exited
-                self.logger.info('cleaning up worker %d.' % i)
-                worker.join()
-                self.logger.info('joined {:s}.', worker)
-                cleaned = True
-                del self._pool[i]
-
-        #alive = sum([p.is_alive() for p in self._pool])
-        #worked = [p._completed.value() for p in self._pool]
-        #names = [p.name for p in self._pool]
-        # self.logger.info('Done cleaning. workers: {:d}; active: {:d};\n{:s}\n{:s}.'
-                # '' % (len(self._pool), alive, str(names), str(worked)))
-        return cleaned
-
-    def _repopulate_pool(self):
-        """Bring the number of pool processes up to the specified number,
-        for use after reaping workers which have exited.
+        Parameters
+        ----------
+        processes : int, optional
+            Number of worker processes, by default the number of cpus.
+        initializer : callable, optional
+            Function called with `initargs` when each worker starts.
+        initargs : tuple, optional
+            Arguments for `initializer`.
+        maxtasksperchild : int, optional
+            Number of task chunks a worker completes before it is replaced, by
+            default None, which keeps workers for the lifetime of the pool.
+        heartbeat : float, optional
+            Interval in seconds between heartbeats of the workers, by default 1.
+            Heartbeats are sent from a thread in the worker, so they stop while
+            a task runs code that holds the GIL (eg. a long call into a C
+            extension). Such a task appears hung once it runs for longer than
+            `missed_beats` heartbeats.
+        missed_beats : int, optional
+            Number of heartbeats a busy worker may miss before it is killed as
+            hung, by default 5. None disables the check, leaving only
+            `timeout`.
+        timeout : float, optional
+            Maximal time in seconds for a chunk of tasks, by default None,
+            which does not limit the time.
+        retries : int, optional
+            Number of times a task is retried after its worker was lost, by
+            default 1.
+        context : multiprocessing context, optional
+            Context used to start the workers.
         """
-        for _ in range(self._processes - len(self._pool)):
-            w = self.Process(self.inq, self.outq, **self._kws)
-            self._pool.append(w)
-            #w.name = w.name.replace('Process', 'PoolWorker')
-            w.daemon = False
-            w.start()
-            self.logger.info('Added worker.')
-
-        #alive = sum([p.is_alive() for p in self._pool])
-        self.logger.info('Repopulated: workers: {:d};.', len(self._pool))
-
-    @staticmethod
-    def _handle_workers(pool):
-        thread = threading.current_thread()
-
-        # Keep maintaining workers maintain condition is set
-        i = 0
-        while thread._state == RUN:
-            i += 1
-            if not (i % 5):
-                worked = [p._completed.value() for p in pool._pool]
-                pool.logger.debug('Tasks completed: {:s}.' % str(worked))
-            pool._maintain_pool()
-            time.sleep(0.1)
-
-        pool.logger.debug('worker handler exiting.')
-
-    # @staticmethod
-    # def _monitor_workers(pool):
-        #thread = threading.current_thread()
-
-        # while pool.maintain.is_set():#thread._state == RUN:
-        ##alive = sum([p.is_alive() for p in pool._pool])
-        # pool.logger.info('# workers: {:d}.' % (len(pool._pool),))
-        # time.sleep(0.1)
-
-        ##alive = sum([p.is_alive() for p in pool._pool])
-        #worked = [p._completed.value() for p in pool._pool]
-        #names = [p.name for p in pool._pool]
-        # pool.logger.info('workers: {:d};\n{:s}\n{:s}.'
-        # '' % (len(pool._pool), str(names), str(worked)))
-
-        #pool.logger.debug('_monitor_workers exiting.')
-
-    #
-    # def kill_switch(self, sentinel=None):
-        #self.logger.info('%s adding %i sentinels.' %(self, len(self._pool)))
-        # for w in self._pool:
-        # self.inq.put(sentinel)
-
-    # def close(self):
-        #self.logger.info('closing pool.')
-
-        # if self._state == RUN:
-        #self._state = CLOSE
-        #self._worker_handler._state = CLOSE
-
-        #self.logger.info('Adding {:d} sentinels.' %len(self._pool))
-        # for w in self._pool:
-        # self.inq.put(None)
-        #self.logger.debug('sentinel added.')
-
-    def join(self):
-
-        self.logger.debug('joining pool: {:s}.', self)
-        self.logger.info('# workers: {:d}; ', len(self._pool))
-
-        # Add a poison pill for each process in the pool
-        for _ in range(len(self._pool)):
-            self.inq.put(SENTINEL)
-
-        # NOTE:
-        # We expect that the pool will join all the exited processes.  However,
-        # sometimes we are stuck with processes that never read anything from the
-        # queue at all during their lifetime (only the dark lord knows why this
-        # happens). Here we circumvent the deadlock with a timeout and termination #HACK
-        # FIXME: Figure out why these processes sometimes get stuck like this to
-        # avoid all this cruft!
-        TIMEOUT = 5
-        kill_switch = False
-        start = time.time()
-        while time.time() - start <= TIMEOUT:
-            if any(p.is_alive() for p in self._pool):
-                time.sleep(.1)  # Just to avoid hogging the CPU
-            else:
-                self.logger.info('All processes successfully joined.')
-                break
+        self.processes = int(processes or os.cpu_count() or 1)
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.maxtasksperchild = maxtasksperchild
+        self.heartbeat = float(heartbeat)
+        self.missed_beats = missed_beats
+        self.timeout = timeout
+        self.retries = int(retries)
+        self.context = context or mp.get_context()
+        self.workers = []
+        self._maintain()
+
+    def __repr__(self):
+        return f'{type(self).__name__}(processes={self.processes})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
         else:
-            self.logger.warning('TIMEOUT!')
-            kill_switch = True
-
-        # stop worker handler that has been trying to join the exited processes
-        self._worker_handler._state = CLOSE
-        self._worker_handler.join()
-        self.logger.debug('_worker_handler joined.')
-
-        # We only enter this if we didn't 'break' above.
-        if kill_switch:
-            self.logger.warning(
-                'These processes did not join before %.1f timeout: (%s). '
-                'Killing them now.' % (TIMEOUT, ', '.join(map(str, self._pool)))
-            )
-            for p in self._pool:
-                p.terminate()
-                p.join()
-
-            self.logger.info('Killing spree complete.')
-
-        # the queue may not be empty because of passive workers
-        # (or some other reason!!??)
-        while True:
-            leftover = []
+            self.terminate()
+
+    # ------------------------------------------------------------------------ #
+    # Workers
+
+    def _spawn(self):
+        conn, child = self.context.Pipe()
+        beat = self.context.RawValue('d', time.monotonic())
+        process = self.context.Process(
+            target=_work, daemon=True,
+            args=(child, beat, self.heartbeat, self.initializer, self.initargs,
+                  self.maxtasksperchild)
+        )
+        process.start()
+        child.close()
+        return _Worker(process, conn, beat)
+
+    def _maintain(self):
+        # Remove workers that exited, or are exiting after reaching
+        # `maxtasksperchild`, and bring the pool up to size.
+        for worker in [w for w in self.workers if w.task is None and (
+                not w.process.is_alive() or
+                w.completed == self.maxtasksperchild)]:
+            self._remove(worker)
+
+        for _ in range(self.processes - len(self.workers)):
+            self.workers.append(self._spawn())
+
+    def _remove(self, worker, kill=False):
+        if kill:
+            worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        self.workers.remove(worker)
+
+    def _hung(self, worker, now):
+        if (self.missed_beats is not None and
+                now - worker.beat.value > self.missed_beats * self.heartbeat):
+            return 'missed heartbeat'
+        if self.timeout and now - worker.started > self.timeout:
+            return f'exceeded timeout of {self.timeout}s'
+
+    # ------------------------------------------------------------------------ #
+    # Task execution
+
+    def map(self, func, iterable, chunksize=1):
+        """Apply `func` to each item in `iterable`, returning a list."""
+        return list(self.imap(func, iterable, chunksize))
+
+    def imap(self, func, iterable, chunksize=1):
+        """
+        Lazily apply `func` to each item in `iterable`, yielding results in
+        order. Exceptions raised by `func` are re-raised here.
+        """
+        return self._run(func, ((item, ) for item in iterable), chunksize, True)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        """As `imap`, but yield results in the order they are completed."""
+        return self._run(func, ((item, ) for item in iterable), chunksize, False)
+
+    def starmap(self, func, iterable, chunksize=1):
+        """Apply `func` to each argument tuple in `iterable`, returning a list."""
+        return list(self._run(func, iterable, chunksize, True))
+
+    def _run(self, func, iterable, chunksize, ordered):
+        pending = enumerate(mit.chunked(iterable, chunksize))
+        retry = deque()
+        attempts = {}
+        results = {}
+        position = 0
+        exhausted = False
+
+        try:
+            while True:
+                self._maintain()
+
+                # dispatch to idle workers
+                for worker in self.workers:
+                    if worker.task is not None:
+                        continue
+
+                    task = retry.popleft() if retry else next(pending, None)
+                    if task is None:
+                        exhausted = True
+                        break
+
+                    worker.conn.send((task[0], func, task[1]))
+                    worker.task = task
+                    worker.started = worker.beat.value = time.monotonic()
+
+                # yield completed results
+                if ordered:
+                    while position in results:
+                        yield from _unpack(results.pop(position))
+                        position += 1
+                else:
+                    for uid in list(results):
+                        yield from _unpack(results.pop(uid))
+
+                busy = [w for w in self.workers if w.task is not None]
+                if exhausted and not (busy or retry or results):
+                    break
+
+                # wait for results, or workers dying
+                wait([w.conn for w in busy] + [w.process.sentinel for w in busy],
+                     self.heartbeat)
+
+                now = time.monotonic()
+                for worker in busy:
+                    if worker.conn.poll():
+                        try:
+                            uid, result = worker.conn.recv()
+                        except EOFError:
+                            pass
+                        else:
+                            results[uid] = result
+                            worker.task = None
+                            worker.completed += 1
+                            continue
+
+                    if not worker.process.is_alive():
+                        reason = f'died with exit code {worker.process.exitcode}'
+                    elif not (reason := self._hung(worker, now)):
+                        continue
+
+                    # lost worker
+                    uid, chunk = task = worker.task
+                    self.logger.warning('Worker {} {} while running task {}.',
+                                        worker, reason, uid)
+                    self._remove(worker, kill=True)
+                    attempts[uid] = attempts.get(uid, 0) + 1
+                    if attempts[uid] > self.retries:
+                        error = WorkerLost(f'Worker {reason} while running task '
+                                           f'{uid}, after {self.retries} retries.')
+                        results[uid] = [(False, (error, ''))] * len(chunk)
+                    else:
+                        retry.append(task)
+        finally:
+            # Results of tasks still running when the caller stops iterating
+            # would be mistaken for those of the next call. Replace those
+            # workers.
+            for worker in [w for w in self.workers if w.task is not None]:
+                self._remove(worker, kill=True)
+
+    # ------------------------------------------------------------------------ #
+    def close(self):
+        """Stop the workers once they are idle."""
+        for worker in self.workers:
             try:
-                leftover.append(self.inq.get_nowait())
-                self.inq.task_done()
-            except Empty:
-                logging.debug('Queue is empty!')
-                break
-        if len(leftover):
-            self.logger.warning('The following was left in the queue: %s.'
-                                % str(leftover))
-
-        # All the processes in the pool are now stopped
-        self.inq.join()
-        self.logger.info('Queue joined: %s.' % self)
+                worker.conn.send(None)
+            except OSError:
+                pass
+
+        # workers are idle, and exit promptly unless hung
+        for worker in list(self.workers):
+            worker.process.join((self.missed_beats or MISSED_BEATS) *
+                                self.heartbeat)
+            self._remove(worker, kill=worker.process.is_alive())
+
+    def terminate(self):
+        """Stop the workers immediately."""
+        for worker in list(self.workers):
+            self._remove(worker, kill=True)
+
+
+def _unpack(results):
+    for success, value in results:
+        if success:
+            yield value
+        else:
+            error, tb = value
+            raise error from (RemoteTraceback(tb) if tb else None)
+
+
+class RemoteTraceback(Exception):
+    """Traceback of an exception raised in a worker process."""
+
+    def __str__(self):
+        return self.args[0]
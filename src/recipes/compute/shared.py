@@ -0,0 +1,160 @@
+"""
+Numpy arrays in shared memory that are sent to worker processes by reference.
+"""
+
+# std
+import contextlib as ctx
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# third-party
+import numpy as np
+
+
+# ---------------------------------------------------------------------------- #
+# Arrays smaller than this are sent to workers by value
+MIN_SHARED_BYTES = 2 ** 20
+
+# Shared memory blocks that are attached in this process, by name. Blocks stay
+# attached for the lifetime of the process, so that tasks using the same array
+# map it only once.
+_attached = {}
+
+
+# ---------------------------------------------------------------------------- #
+def _attach(name):
+    if name in _attached:
+        return _attached[name]
+
+    try:
+        shm = SharedMemory(name, track=False)
+    except TypeError:  # pragma: no cover
+        # python < 3.13: the resource tracker would remove the block when this
+        # process exits, while the owner is still using it
+        shm = SharedMemory(name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+    _attached[name] = shm = (shm, _address(shm))
+    return shm
+
+
+def _address(shm):
+    return np.frombuffer(shm.buf, np.uint8).ctypes.data
+
+
+def _rebuild(name, offset, shape, strides, dtype):
+    shm, address = _attach(name)
+    a = np.ndarray.__new__(SharedArray, shape, dtype, shm.buf, offset, strides)
+    a._shm = (shm, address)
+    return a
+
+
+# ---------------------------------------------------------------------------- #
+class SharedArray(np.ndarray):
+    """
+    Array with data in a named shared memory block. When pickled, eg. to send a
+    task to a worker process, only the name of the block and the layout of the
+    array are sent, and the worker maps the same memory. Views (eg. the rows
+    selected for a task) are sent by reference as well, and their data is not
+    copied in the worker.
+
+    Create with `share`. The process that creates the array owns the shared
+    memory, and should release it with `unlink` once the workers are done.
+    """
+
+    def __array_finalize__(self, obj):
+        self._shm = getattr(obj, '_shm', None)
+
+    def __array_wrap__(self, arr, context=None, return_scalar=False):
+        # results of ufuncs and reductions are usually new arrays in private
+        # memory, which should not pose as being shared
+        if isinstance(arr, SharedArray) and arr._reference() is None:
+            arr = arr.view(np.ndarray)
+        return arr[()] if return_scalar else arr
+
+    def __reduce__(self):
+        if (ref := self._reference()) is None:
+            # data does not live in the shared block, eg. result of arithmetic
+            return np.asarray(self).__reduce__()
+        return _rebuild, ref
+
+    def _reference(self):
+        if self._shm is None or self.name not in _attached:
+            return
+
+        shm, address = self._shm
+        offset = self.__array_interface__['data'][0] - address
+        # extent of the data relative to the first element
+        lo = sum(s * (n - 1) for s, n in zip(self.strides, self.shape) if s < 0)
+        hi = sum(s * (n - 1) for s, n in zip(self.strides, self.shape) if s > 0)
+        if 0 <= offset + lo and offset + hi + self.itemsize <= shm.size:
+            return shm.name, offset, self.shape, self.strides, self.dtype.str
+
+    @property
+    def name(self):
+        """Name of the shared memory block."""
+        return None if self._shm is None else self._shm[0].name
+
+    def unlink(self):
+        """
+        Release the name of the shared memory block, so that the memory is
+        freed once all processes are done with it. The array remains usable
+        in this process, but can no longer be sent to workers by reference.
+        """
+        if self._shm and _attached.pop(self.name, None):
+            self._shm[0].unlink()
+
+
+def share(a):
+    """
+    Copy array `a` into shared memory. Arrays of objects are not supported,
+    since their data are pointers into the memory of this process.
+
+    Parameters
+    ----------
+    a : array-like
+        Data to share.
+
+    Returns
+    -------
+    SharedArray
+    """
+    a = np.asarray(a)
+    if a.dtype.hasobject:
+        raise TypeError('Cannot share arrays of objects between processes.')
+
+    shm = SharedMemory(create=True, size=max(a.nbytes, 1))
+    _attached[shm.name] = ref = (shm, _address(shm))
+
+    shared = np.ndarray.__new__(SharedArray, a.shape, a.dtype, shm.buf)
+    shared._shm = ref
+    shared[...] = a
+    return shared
+
+
+@ctx.contextmanager
+def shared(*data, min_bytes=MIN_SHARED_BYTES):
+    """
+    Context in which large arrays in `data` are copied to shared memory. Arrays
+    that are already file or memory backed (`np.memmap`, `SharedArray`), and
+    other objects are passed through unchanged. The shared memory is released
+    on exit.
+
+    Examples
+    --------
+    >>> with shared(images, labels) as (images, labels):
+    ...     executor.run(images, labels)
+    """
+    data = list(data)
+    created = []
+    for i, obj in enumerate(data):
+        if (type(obj) is np.ndarray and not obj.dtype.hasobject and
+                obj.nbytes >= min_bytes):
+            data[i] = share(obj)
+            created.append(data[i])
+
+    try:
+        yield tuple(data)
+    finally:
+        for a in created:
+            a.unlink()
@@ -4,11 +4,16 @@ Multi-dimensional arrays with synchronized element access
 
 
 # std
+import os
 import ctypes
+import numbers
+import threading
+import contextlib as ctx
 import multiprocessing as mp
 import multiprocessing.managers as mgr
 
 # third-party
+import psutil
 import numpy as np
 
 
@@ -245,6 +250,253 @@ mgr.SyncManager.register('Array', SyncedArray,
                          exposed=(set(mgr.public_methods(SyncedArray)) |
                                   set(methods_to_sync) - {'__repr__'}))
 
+
+# ---------------------------------------------------------------------------- #
+# Shared memory types that scale with the number of concurrent writers. Like
+# `mp.Value` and `mp.Array`, these can only be handed to a process when it
+# starts, eg. as arguments of `mp.Process`, or in the `initargs` of a pool.
+
+# Default number of locks for `BlockSyncedArray`, and slots for
+# `ShardedCounter`
+NLOCKS = 64
+NSLOTS = 4 * (mp.cpu_count() or 1)
+
+
+class ShardedCounter:
+    """
+    Shared-memory counter that is incremented without locking.
+
+    Each thread (in any process) increments its own slot in a shared array, so
+    concurrent increments never contend. A lock is taken only once per thread,
+    to claim its slot. The value of the counter is the sum over the slots.
+    Reading the value while other workers increment it gives a value that
+    includes a subset of the concurrent increments.
+
+    Slots keep their counts, but are reused: The slot of a thread that has
+    finished goes to the next thread started in the same process, and the slots
+    of a process that has exited (eg. a recycled pool worker) go to threads of
+    other processes. Threads beyond the number of slots (counting threads that
+    are alive at the same time across all processes) share the last slot, whose
+    increments are locked.
+    """
+
+    def __init__(self, initval=0, nslots=NSLOTS):
+        self.slots = mp.RawArray(ctypes.c_int64, int(nslots) + 1)
+        self.slots[0] = initval
+        # process id owning each slot
+        self.pids = mp.RawArray(ctypes.c_int64, int(nslots) + 1)
+        # number of claimed slots, and lock for claiming slots
+        self.claimed = mp.Value(ctypes.c_int64, 0)
+        self._init_local()
+
+    def __getstate__(self):
+        return self.slots, self.pids, self.claimed
+
+    def __setstate__(self, state):
+        self.slots, self.pids, self.claimed = state
+        self._init_local()
+
+    def _init_local(self):
+        # Per process state: the slot of each thread, and the threads owning
+        # the slots claimed by this process
+        self._local = threading.local()
+        self._owners = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.value})'
+
+    def _slot(self):
+        # Slot of the current thread. Thread local data survive a fork, so the
+        # slot is claimed by process id as well.
+        pid, slot = getattr(self._local, 'slot', (None, None))
+        if pid != os.getpid():
+            slot = self._claim()
+            self._local.slot = (os.getpid(), slot)
+        return slot
+
+    def _claim(self):
+        # Claim the slot of a finished thread of this process, or of a process
+        # that has exited, or a new one
+        thread = threading.current_thread()
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked: slots of the parent process are not ours to reuse
+                self._owners, self._pid = {}, os.getpid()
+
+            for slot, owner in self._owners.items():
+                if not owner.is_alive():
+                    self._owners[slot] = thread
+                    return slot
+
+            overflow = len(self.slots) - 1
+            with self.claimed.get_lock():
+                slot = self._reclaim()
+                if slot is None:
+                    self.claimed.value += 1
+                    slot = min(self.claimed.value, overflow)
+
+                if slot < overflow:
+                    self.pids[slot] = self._pid
+
+            if slot < overflow:
+                self._owners[slot] = thread
+            return slot
+
+    def _reclaim(self):
+        # Slot owned by a process that has exited, if any
+        for slot in range(1, min(self.claimed.value + 1, len(self.slots) - 1)):
+            pid = self.pids[slot]
+            if pid != self._pid and not psutil.pid_exists(pid):
+                return slot
+
+    def inc(self, val=1):
+        """Increment the counter."""
+        slot = self._slot()
+        if slot == len(self.slots) - 1:
+            # overflow slot is shared
+            with self.claimed.get_lock():
+                self.slots[slot] += val
+        else:
+            self.slots[slot] += val
+
+    def __iadd__(self, val):
+        self.inc(val)
+        return self
+
+    @property
+    def value(self):
+        return sum(self.slots)
+
+    def get_value(self):
+        return self.value
+
+
+class BlockSyncedArray:
+    """
+    Array in shared memory for concurrent writers, with locking by blocks of
+    rows instead of a single lock for the whole array.
+
+    Indexing the array (and the `data` array itself) is not synchronized, so
+    that workers that write to disjoint regions (eg. each task writing its own
+    rows of the results) do not wait for each other. Updates to regions that
+    may overlap, like reductions (`a[i] += x`), should be done while holding
+    the locks for the rows involved, either with the `locked` context, or via
+    the `add` method. Rows are assigned to locks in blocks of `block_size`, and
+    the blocks share `nlocks` locks in turn, so writers of different blocks
+    rarely contend.
+
+    Examples
+    --------
+    >>> totals = BlockSyncedArray((100, 3))
+    >>> # in the workers
+    >>> totals.add(index, result)
+    >>> with totals.locked(slice(10, 20)):
+    ...     totals[10:20] *= 2
+    """
+
+    def __init__(self, shape, fill=0, dtype=float, nlocks=NLOCKS, block_size=1):
+        """
+        Parameters
+        ----------
+        shape : int or tuple of int
+            Shape of the array.
+        fill : object, optional
+            Initial value, by default 0.
+        dtype : data-type, optional
+            Data type, by default float.
+        nlocks : int, optional
+            Number of locks, by default 64.
+        block_size : int, optional
+            Number of consecutive rows guarded by the same lock, by default 1.
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(np.atleast_1d(shape).tolist())
+        self._buffer = mp.RawArray(ctypes.c_char, max(int(np.prod(shape)), 1) *
+                                   dtype.itemsize)
+        self.locks = [mp.Lock() for _ in range(int(nlocks))]
+        self.block_size = int(block_size)
+        self._init(shape, dtype)
+        self.data[...] = fill
+
+    def _init(self, shape, dtype):
+        self.data = np.ndarray(shape, dtype, self._buffer)
+
+    def __getstate__(self):
+        return (self._buffer, self.locks, self.block_size, self.data.shape,
+                self.data.dtype)
+
+    def __setstate__(self, state):
+        self._buffer, self.locks, self.block_size, shape, dtype = state
+        self._init(shape, dtype)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.data!r})'
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        self.data[index] = value
+
+    def _lock_ids(self, rows):
+        # Indices of the locks guarding `rows` (first axis index of any kind),
+        # in sorted order, so that concurrent holders of multiple locks do not
+        # deadlock. Integers and slices are mapped to blocks arithmetically,
+        # only index arrays and masks are resolved against the rows.
+        if isinstance(rows, tuple):
+            rows = rows[0] if rows else slice(None)
+
+        n = len(self.data)
+        if isinstance(rows, numbers.Integral):
+            row = range(n)[rows]
+            return [(row // self.block_size) % len(self.locks)]
+
+        if isinstance(rows, slice):
+            rows = range(n)[rows]
+            if not rows:
+                return []
+
+            first, last = sorted((rows[0], rows[-1]))
+            if abs(rows.step) <= self.block_size:
+                # no block in between is skipped
+                return self._block_range(first // self.block_size,
+                                         last // self.block_size)
+
+            rows = np.arange(first, last + 1, abs(rows.step))
+        else:
+            rows = np.arange(n)[rows]
+
+        return np.unique((rows // self.block_size) % len(self.locks)).tolist()
+
+    def _block_range(self, first, last):
+        # locks for the consecutive blocks `first` to `last` (inclusive)
+        nlocks = len(self.locks)
+        if last - first + 1 >= nlocks:
+            return list(range(nlocks))
+        return sorted(block % nlocks for block in range(first, last + 1))
+
+    @ctx.contextmanager
+    def locked(self, rows=slice(None)):
+        """Context in which the locks guarding `rows` are held."""
+        with ctx.ExitStack() as stack:
+            for i in self._lock_ids(rows):
+                stack.enter_context(self.locks[i])
+            yield self.data
+
+    def add(self, index, value):
+        """Synchronized in-place addition `a[index] += value`."""
+        with self.locked(index):
+            self.data[index] += value
+
+
 if __name__ == '__main__':
     # some tests
     a = SyncedArray([1, 2, 3])
@@ -4,7 +4,10 @@ import io
 
 # relative
 from .gitignore import GitIgnore
-from .mmap import load_memmap, load_memmap_nans
+from .lines import LineIndex, map_lines
+from .listing import ListingCache
+from .mmap import Bitmap, load_bitmap, load_memmap, load_memmap_nans
+from .records import RecordStore
 from .utils import (
     backed_up, count_lines, deserialize, guess_format, iter_ext, iter_files,
     iter_lines, load_json, load_pickle, md5sum, open_any, read_line,
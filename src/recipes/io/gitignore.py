@@ -1,10 +1,37 @@
+"""
+Filter source trees with gitignore patterns.
 
+Patterns follow the gitignore specification (see `git help gitignore`):
+
+* Blank lines and lines starting with '#' are ignored. Trailing spaces are
+  ignored unless escaped with a backslash.
+* A leading '!' negates the pattern, re-including paths excluded by an earlier
+  pattern. The last matching pattern decides.
+* Patterns ending in '/' only match folders.
+* Patterns with a '/' at the start or in the middle are anchored to the folder
+  of the file that defines them. Other patterns match at any depth.
+* '*' and '?' do not match '/'. A leading '**/' matches in all folders, a
+  trailing '/**' matches everything inside, and '/**/' matches zero or more
+  folders.
+* Paths inside an excluded folder are excluded, and cannot be re-included.
+* `GitIgnore` applies the `.gitignore` files in subfolders to the paths below
+  them, with precedence over files in parent folders.
+
+The patterns of a list are compiled into a single regular expression, with a
+lookup table for patterns that are plain names, so each path is matched once
+irrespective of the number of patterns.
+"""
+
+# std
+import re
 import math
 import glob
-import fnmatch
 from pathlib import Path
 from collections import abc
 
+# relative
+from .listing import FOLDER, listdir
+
 
 # ---------------------------------------------------------------------------- #
 IGNORE_IMPLICIT = ('.git', )
@@ -12,12 +39,16 @@ IGNORE_IMPLICIT = ('.git', )
 # ---------------------------------------------------------------------------- #
 
 
-def get_repo_files(folder):
-
+def get_repo_files(folder, cache=None):
+    """
+    List the files in the repository at `folder` that are not ignored by its
+    `.gitignore` file. Folder listings are taken from `cache` (a `ListingCache`)
+    if given.
+    """
     if not (file := Path(folder) / '.gitignore').exists():
         raise FileNotFoundError(f"Could not find '{file!s}.'")
 
-    return list(GitIgnore(file).iterdir(folder))
+    return list(GitIgnore(file).iterdir(Path(folder), cache=cache))
 
 
 def read(path):
@@ -30,17 +61,135 @@ def read(path):
 
 
 def _read(path):
-    return filter(None, (line.strip(' ')
+    return filter(None, (_strip(line)
                          for line in path.read_text().splitlines()
                          if not line.startswith('#')))
 
 
+def _strip(line):
+    # remove trailing spaces, unless escaped
+    stripped = line.rstrip(' ')
+    if stripped.endswith('\\') and len(stripped) < len(line):
+        stripped += ' '
+    return stripped
+
+
+# ---------------------------------------------------------------------------- #
+# Pattern compiler
+
+def _translate(pattern):
+    # Translate a gitignore glob to a regular expression for the path relative
+    # to the folder of the pattern. Uses only non-capturing groups.
+    i, n = 0, len(pattern)
+    parts = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if (pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/')
+                    and (i + 2 == n or pattern[i + 2] == '/')):
+                # "**" as a whole path component
+                if i + 2 == n:
+                    parts.append('.*')
+                    i += 2
+                else:
+                    parts.append('(?:.*/)?')
+                    i += 3
+                continue
+
+            while i < n and pattern[i] == '*':
+                i += 1
+            parts.append('[^/]*')
+            continue
+
+        i += 1
+        if c == '?':
+            parts.append('[^/]')
+        elif c == '\\' and i < n:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+        elif c == '[' and (end := _class_end(pattern, i)):
+            body = re.sub(r'([&~|\\])', r'\\\1', pattern[i:end])
+            if body[0] in '!^':
+                body = '^' + body[1:]
+            parts.append(f'(?!/)[{body}]')
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+
+    return ''.join(parts)
+
+
+def _class_end(pattern, i):
+    # index of the closing bracket of a character class starting at `i`
+    j = i + (pattern[i:i + 1] in ('!', '^'))
+    j += (pattern[j:j + 1] == ']')
+    end = pattern.find(']', j)
+    return end if end != -1 else None
+
+
+def _parse(pattern):
+    # Split a pattern into (negated, folders only, literal name, regex). The
+    # literal name is given for patterns that match a plain name at any depth.
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+
+    folders = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+
+    if '/' in pattern:
+        # anchored
+        return negated, folders, None, _translate(pattern.lstrip('/'))
+
+    if not (glob.has_magic(pattern) or '\\' in pattern):
+        return negated, folders, pattern, None
+
+    return negated, folders, None, f'(?:.*/)?{_translate(pattern)}'
+
+
+class _Matcher:
+    # Compiled pattern list. For files and folders separately, a lookup table
+    # for the patterns that are names, and a regex for the rest with one group
+    # per pattern, in reverse order, so that the first matching alternative is
+    # the last matching pattern.
+
+    __slots__ = ('names', 'regex', 'rules')
+
+    def __init__(self, patterns):
+        self.names = ({}, {})
+        self.rules = ([None], [None])
+        regexes = ([], [])
+        for index, pattern in reversed(list(enumerate(patterns))):
+            negated, folders, name, regex = _parse(pattern)
+            for is_dir in ((True, ) if folders else (False, True)):
+                if name is not None:
+                    self.names[is_dir].setdefault(name, (index, negated))
+                else:
+                    regexes[is_dir].append(f'({regex})')
+                    self.rules[is_dir].append((index, negated))
+
+        self.regex = tuple(re.compile('|'.join(rx), re.DOTALL) if rx else None
+                           for rx in regexes)
+
+    def __call__(self, path, is_dir):
+        # Whether the path is ignored (True), re-included (False), or not
+        # matched (None)
+        best = self.names[is_dir].get(path.rpartition('/')[2])
+        if (regex := self.regex[is_dir]) and (match := regex.fullmatch(path)):
+            rule = self.rules[is_dir][match.lastindex]
+            if best is None or rule[0] > best[0]:
+                best = rule
+
+        return None if best is None else not best[1]
+
+
+# ---------------------------------------------------------------------------- #
 class GlobPatternList:
     """
-    Class to filter files matching any in a list of glob patterns.
+    Class to filter files matching any in a list of gitignore patterns.
     """
 
-    __slots__ = ('root', 'names', 'patterns')
+    __slots__ = ('root', 'patterns', '_matcher')
 
     @classmethod
     def from_file(cls, path):
@@ -51,10 +200,13 @@ class GlobPatternList:
 
     def __init__(self, root, patterns):
         self.root = Path(root)
-        self.names = list(IGNORE_IMPLICIT)
-        self.patterns = []
+        self.patterns = list(IGNORE_IMPLICIT)
+        self._matcher = None
         self.add(patterns)
 
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self.root)!r}, {self.patterns})'
+
     def add(self, items):
         if isinstance(items, str):
             self._add(items)
@@ -62,38 +214,99 @@ class GlobPatternList:
             list(map(self.add, items))
         else:
             raise TypeError(f'Invalid object type {type(items).__name__}: {items}.')
-        
+
     def _add(self, pattern):
-        items = (self.names, self.patterns)
-        if pattern:
-            items[glob.has_magic(pattern)].append(pattern.rstrip('/'))
-
-    def match(self, filename):
-        path = Path(filename).relative_to(self.root)
-        filename = str(path)
-        for pattern in self.patterns:
-            if fnmatch.fnmatchcase(filename, pattern):
+        if pattern and not pattern.startswith('#'):
+            self.patterns.append(pattern)
+            self._matcher = None
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            self._matcher = _Matcher(self.patterns)
+        return self._matcher
+
+    def verdict(self, path, is_dir=False):
+        """
+        Match the patterns of this list only, for a '/' separated `path`
+        relative to the root. Returns True if the path is ignored, False if it
+        is re-included by a negated pattern, or None if no pattern matches.
+        """
+        return self.matcher(path, is_dir)
+
+    # ------------------------------------------------------------------------ #
+    def _scopes(self, folder):
+        # Pattern lists that apply to the entries of `folder` (relative to the
+        # root), with the prefix of their root, in order of precedence
+        return (('', self), )
+
+    def _ignored(self, path, is_dir):
+        # match a relative path, assuming that its parent folders are included
+        folder = path.rpartition('/')[0]
+        for prefix, patterns in self._scopes(folder):
+            verdict = patterns.verdict(path[len(prefix):], is_dir)
+            if verdict is not None:
+                return verdict
+        return False
+
+    def match(self, filename, is_dir=None):
+        """
+        Whether `filename` is ignored, either by matching a pattern itself, or
+        by being inside an ignored folder.
+
+        Parameters
+        ----------
+        filename : str or Path
+            The path to match, inside the root folder.
+        is_dir : bool, optional
+            Whether the path is a folder, by default checked on disk.
+        """
+        path = Path(filename)
+        if is_dir is None:
+            is_dir = path.is_dir()
+
+        parts = path.relative_to(self.root).parts
+        for i in range(1, len(parts)):
+            if self._ignored('/'.join(parts[:i]), True):
                 return True
 
-        return filename.endswith(tuple(self.names))
+        return bool(parts) and self._ignored('/'.join(parts), is_dir)
+
+    def iterdir(self, folder=None, depth=any, cache=None):
+        """
+        Yield the files below `folder` (by default the root) that are not
+        ignored. Ignored folders are skipped without being listed.
 
-    def iterdir(self, folder=None, depth=any, _level=0):
+        Parameters
+        ----------
+        folder : str or Path, optional
+            Folder to list, inside the root folder.
+        depth : int, optional
+            Maximal depth of folders to list, by default any.
+        cache : ListingCache, optional
+            Cache of folder listings.
+        """
         depth = math.inf if depth is any else depth
-        folder = folder or self.root
+        folder = Path(folder or self.root)
+        path = '/'.join(folder.relative_to(self.root).parts)
+        yield from self._iterdir(folder, path, depth, cache)
 
-        _level += 1
-        if _level > depth:
+    def _iterdir(self, folder, path, depth, cache, level=1):
+        if level > depth:
             return
 
-        for path in folder.iterdir():
-            if self.match(path):
+        prefix = f'{path}/' if path else ''
+        for name, kind in listdir(folder, cache):
+            is_dir = (kind == FOLDER)
+            if self._ignored(prefix + name, is_dir):
                 continue
 
-            if path.is_dir():
-                yield from self.iterdir(path, depth, _level)
+            if is_dir:
+                yield from self._iterdir(folder / name, prefix + name, depth,
+                                         cache, level + 1)
                 continue
 
-            yield path
+            yield folder / name
 
     # alias
     iter = iterdir
@@ -101,9 +314,31 @@ class GlobPatternList:
 
 class GitIgnore(GlobPatternList):
     """
-    Class to read `.gitignore` files and filter source trees.
+    Class to read `.gitignore` files and filter source trees. The `.gitignore`
+    files in subfolders are read as they are needed.
     """
 
+    __slots__ = ('filename', 'nested', '_scope_cache')
+
     def __init__(self, filename='.gitignore'):
         path = Path(filename)
-        return super().__init__(path.parent, read(path))
+        super().__init__(path.parent, read(path))
+        self.filename = path.name
+        self.nested = {}
+        self._scope_cache = {}
+
+    def _nested(self, folder):
+        # pattern list for the file in `folder` (relative to the root), if any
+        if folder not in self.nested:
+            file = self.root / folder / self.filename
+            self.nested[folder] = (GlobPatternList.from_file(file)
+                                   if file.is_file() else None)
+        return self.nested[folder]
+
+    def _scopes(self, folder):
+        if (scopes := self._scope_cache.get(folder)) is None:
+            parts = folder.split('/') if folder else []
+            scopes = [(f'{sub}/', patterns) for i in range(len(parts), 0, -1)
+                      if (patterns := self._nested(sub := '/'.join(parts[:i])))]
+            scopes = self._scope_cache[folder] = (*scopes, ('', self))
+        return scopes
@@ -0,0 +1,333 @@
+"""
+Index of line offsets for random access into large text files.
+
+The index holds the byte offset at which each line starts. It is built with a
+vectorised search for newlines over a memory map of the file, and saved next
+to the file (at "<filename>.lines.npy"), together with the size and
+modification time of the file, so it is rebuilt only when the file changes.
+Reading a line is then a single seek, irrespective of the size of the file.
+
+Lines are delimited by '\\n', which includes windows line endings. Files with
+old Mac style ('\\r') line endings are treated as a single line.
+
+This module also provides `map_lines`, which applies a function to the lines
+of a large file in parallel, splitting the file at newline-aligned offsets.
+"""
+
+# std
+import io
+import os
+import mmap
+import itertools as itt
+from pathlib import Path
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# third-party
+import numpy as np
+from loguru import logger
+
+
+# ---------------------------------------------------------------------------- #
+INDEX_SUFFIX = '.lines.npy'
+
+# Size of the blocks in which the file is searched for newlines. Bounds the
+# temporary memory used while building the index.
+BLOCK_SIZE = 2 ** 26  # 64 MB
+
+NEWLINE = ord('\n')
+
+# Size in bytes of the chunks processed by each task in `map_lines`
+CHUNK_SIZE = 2 ** 24  # 16 MB
+
+# Number of chunks in flight (being processed, or waiting to be consumed) per
+# worker in `map_lines`
+PREFETCH = 2
+
+
+# ---------------------------------------------------------------------------- #
+def index_file(filename):
+    """Location of the line index for `filename`."""
+    filename = Path(filename)
+    return filename.with_name(f'{filename.name}{INDEX_SUFFIX}')
+
+
+def count_newlines(filename, block_size=BLOCK_SIZE):
+    """Count the newline characters in a file, reading it in blocks."""
+    count = 0
+    with open(filename, 'rb') as fp:
+        while block := fp.read(block_size):
+            count += block.count(b'\n')
+    return count
+
+
+def find_line_starts(filename, block_size=BLOCK_SIZE):
+    """
+    Byte offsets at which the lines of a file start, followed by the size of
+    the file.
+
+    Returns
+    -------
+    np.ndarray
+        Offsets, of length one more than the number of lines.
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return np.zeros(1, np.int64)
+
+    starts = [np.zeros(1, np.int64)]
+    with open(filename, 'rb') as fp, \
+            mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        data = np.frombuffer(buffer, np.uint8)
+        for offset in range(0, size, block_size):
+            block = data[offset:offset + block_size]
+            starts.append(np.flatnonzero(block == NEWLINE) + (offset + 1))
+        last = data[-1]
+        # release the buffer, so the memory map can be closed
+        del data, block
+
+    if last != NEWLINE:
+        # final line without newline
+        starts.append(np.array([size]))
+
+    return np.concatenate(starts).astype(np.int64, copy=False)
+
+
+# ---------------------------------------------------------------------------- #
+class LineIndex:
+    """
+    Byte offsets of the lines of a text file.
+
+    Examples
+    --------
+    >>> lines = LineIndex.load('huge.log')
+    >>> len(lines)
+    123456789
+    >>> list(lines.iter(-3))  # last three lines
+    """
+
+    __slots__ = ('filename', 'offsets')
+
+    @classmethod
+    def load(cls, filename, build=True, save=True):
+        """
+        Load the saved index for `filename`, or build it if the file changed
+        since it was indexed.
+
+        Parameters
+        ----------
+        filename : str or Path
+            The text file.
+        build : bool, optional
+            Whether to build the index if there is no valid saved index, by
+            default True. If False, None is returned instead.
+        save : bool, optional
+            Whether to save a newly built index next to the file, by default
+            True.
+
+        Returns
+        -------
+        LineIndex or None
+        """
+        filename = Path(filename)
+        stat = filename.stat()
+        stamp = (stat.st_size, stat.st_mtime_ns)
+
+        saved = index_file(filename)
+        try:
+            data = np.load(saved, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        else:
+            if len(data) > 2 and tuple(data[:2]) == stamp:
+                return cls(filename, data[2:])
+
+        if not build:
+            return
+
+        logger.debug("Indexing lines of '{!s}'.", filename)
+        offsets = find_line_starts(filename)
+        if save:
+            cls._save(saved, np.concatenate([stamp, offsets]))
+
+        return cls(filename, offsets)
+
+    @staticmethod
+    def _save(filename, data):
+        # write to a temporary file first, so readers never see a partial index
+        tmp = filename.with_name(f'.{filename.name}.{os.getpid()}')
+        try:
+            with open(tmp, 'wb') as fp:
+                np.save(fp, data)
+            os.replace(tmp, filename)
+        except OSError as err:
+            logger.debug("Could not save line index at '{!s}': {}", filename, err)
+            tmp.unlink(missing_ok=True)
+
+    def __init__(self, filename, offsets):
+        self.filename = Path(filename)
+        self.offsets = offsets
+
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self.filename)!r}, lines={len(self)})'
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def span(self, nr):
+        """Byte range `(start, stop)` of line `nr`, including its newline."""
+        nr = range(len(self))[nr]
+        return int(self.offsets[nr]), int(self.offsets[nr + 1])
+
+    def iter(self, *section, mode='r'):
+        """
+        Iterate over a section of lines, seeking directly to the first line.
+        Negative indices count from the end of the file.
+
+        Parameters
+        ----------
+        *section
+            The [start], stop, [step] lines, as for `slice`.
+        mode : {'r', 'rb'}
+            Whether to yield text (str) or binary (bytes) lines.
+
+        Yields
+        ------
+        str or bytes
+            Lines, including their newline.
+        """
+        start, stop, step = slice(*(section or (None, ))).indices(len(self))
+        if step < 1:
+            raise ValueError('Step for line sections must be a positive '
+                             f'integer, not {step}.')
+        if start >= stop:
+            return
+
+        fp = open(self.filename, 'rb')
+        fp.seek(int(self.offsets[start]))
+        with (fp if 'b' in mode else io.TextIOWrapper(fp)) as fp:
+            yield from itt.islice(fp, 0, stop - start, step)
+
+
+# ---------------------------------------------------------------------------- #
+def _strip_chars(strip, mode):
+    # Characters stripped from lines by default: system newlines. Note python
+    # translates system newlines to '\n' for files opened in text mode.
+    if strip is None:
+        strip = os.linesep
+    strip = strip or ''
+    if 'b' in mode and isinstance(strip, str):
+        strip = strip.encode()
+    return strip
+
+
+def iter_chunks(filename, chunk_size=CHUNK_SIZE):
+    """
+    Split a file into chunks of about `chunk_size` bytes that end at a line
+    boundary.
+
+    Yields
+    ------
+    start, stop : int
+        Byte range of the chunk.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as fp:
+        start = 0
+        while start < size:
+            fp.seek(start + chunk_size - 1)
+            # complete the line at the boundary
+            fp.readline()
+            stop = min(fp.tell(), size)
+            yield start, stop
+            start = stop
+
+
+def _map_chunk(filename, start, stop, func, mode, strip):
+    # apply `func` to the lines in a chunk of a file
+    with open(filename, 'rb') as fp:
+        fp.seek(start)
+        data = fp.read(stop - start)
+
+    lines = io.BytesIO(data)
+    if 'b' not in mode:
+        lines = io.TextIOWrapper(lines)
+
+    return [func(line.strip(strip)) for line in lines]
+
+
+def map_lines(filename, func, njobs=-1, ordered=True, chunk_size=CHUNK_SIZE,
+              mode='r', strip=None):
+    """
+    Apply `func` to each line of a file, using a pool of worker processes. The
+    file is split into chunks at line boundaries, which the workers read and
+    process independently.
+
+    Results are produced lazily. The number of chunks that are processed ahead
+    of the consumer of the results is bounded, so memory use does not grow
+    with the size of the file if the results are consumed slower than they
+    are computed.
+
+    Parameters
+    ----------
+    filename : str or Path
+        The text file.
+    func : callable
+        Function applied to each line. Should be picklable, eg. a function
+        defined at module level.
+    njobs : int, optional
+        Number of worker processes, by default -1, which uses the number of
+        cpus. With `njobs=1` the lines are processed in this process.
+    ordered : bool, optional
+        Whether results are yielded in the order of the lines, by default True.
+        Otherwise the results of each chunk are yielded as soon as it is done,
+        so a slow chunk does not hold up the others.
+    chunk_size : int, optional
+        Approximate size of the chunks in bytes, by default 16 MB.
+    mode : {'r', 'rb'}
+        Whether lines are passed to `func` as text (str) or binary (bytes).
+    strip : str, optional
+        Characters stripped from each line, by default newlines, as for
+        `iter_lines`.
+
+    Yields
+    ------
+    object
+        The result of `func` for each line.
+
+    Examples
+    --------
+    >>> total = sum(map_lines('huge.csv', parse_row, njobs=8))
+    """
+    strip = _strip_chars(strip, mode)
+    args = (func, mode, strip)
+    chunks = iter_chunks(filename, chunk_size)
+
+    njobs = os.cpu_count() if njobs in (-1, None) else int(njobs)
+    if njobs == 1:
+        for start, stop in chunks:
+            yield from _map_chunk(filename, start, stop, *args)
+        return
+
+    pool = ProcessPoolExecutor(njobs)
+    pending = deque()
+    try:
+        submit = (pool.submit(_map_chunk, filename, start, stop, *args)
+                  for start, stop in chunks)
+        pending.extend(itt.islice(submit, PREFETCH * njobs))
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.remove(future := done.pop())
+
+            results = future.result()
+            # replace the chunk before handing out its results
+            pending.extend(itt.islice(submit, 1))
+            yield from results
+    finally:
+        # `shutdown(cancel_futures=True)` needs python 3.9
+        for future in pending:
+            future.cancel()
+        pool.shutdown()
@@ -0,0 +1,209 @@
+"""
+Persistent cache of folder listings, for fast repeated scans of large trees.
+
+Adding, removing or renaming an entry in a folder updates the modification
+time of the folder. Rescanning a tree with a `ListingCache` therefore only
+needs one `stat` per folder, and re-lists only folders that changed since the
+last scan. Changes to the contents of files do not affect the listing, and are
+not tracked.
+"""
+
+# std
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+# third-party
+from platformdirs import user_cache_path
+
+
+# ---------------------------------------------------------------------------- #
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    path        TEXT PRIMARY KEY,
+    mtime       INTEGER NOT NULL,
+    scanned     INTEGER NOT NULL,
+    entries     TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Kinds of folder entries
+FOLDER, FILE, OTHER = 'd', 'f', 'o'
+
+# File systems record modification times with limited resolution. A folder
+# modified within this many seconds of being listed may have changed again
+# without updating its modification time, and is listed again on the next scan.
+RACY_SECONDS = 2
+
+# Number of updated listings after which they are committed to disk
+COMMIT_EVERY = 1000
+
+
+# ---------------------------------------------------------------------------- #
+def listdir(folder, cache=None):
+    """
+    List the entries of `folder`, using `cache` if given.
+
+    Parameters
+    ----------
+    folder : str or path-like
+        Folder to list.
+    cache : ListingCache, optional
+        Cache of listings.
+
+    Returns
+    -------
+    list of tuple
+        `(name, kind)` for each entry, where kind is 'd' for folders, 'f' for
+        files, and 'o' for anything else. Symbolic links have the kind of their
+        target. Empty if the folder cannot be listed.
+    """
+    if cache is None:
+        return _scandir(folder)
+    return cache.listdir(folder)
+
+
+def _scandir(folder):
+    # The entry types are those reported by the directory listing, so entries
+    # need not be stat'ed individually
+    entries = []
+    try:
+        itr = os.scandir(folder)
+    except OSError:
+        return entries
+
+    with itr:
+        for entry in itr:
+            try:
+                kind = (FOLDER if entry.is_dir() else
+                        FILE if entry.is_file() else OTHER)
+            except OSError:
+                kind = OTHER
+            entries.append((entry.name, kind))
+
+    return entries
+
+
+# ---------------------------------------------------------------------------- #
+class ListingCache:
+    """
+    Folder listings stored in an SQLite database, keyed by the path of the
+    folder and invalidated when its modification time changes.
+
+    Examples
+    --------
+    >>> cache = ListingCache('archive.db')
+    >>> files = list(iter_files('/archive', 'fits', True, cache=cache))
+    """
+
+    def __init__(self, filename=None):
+        """
+        Parameters
+        ----------
+        filename : str or Path, optional
+            Location of the database, by default "listing.db" in the user cache
+            folder.
+        """
+        if filename is None:
+            filename = user_cache_path('recipes') / 'listing.db'
+            filename.parent.mkdir(parents=True, exist_ok=True)
+
+        self.filename = Path(filename)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.filename), timeout=60,
+                                  check_same_thread=False)
+        # Write-ahead logging makes each commit a cheap append
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self._changes = 0
+
+    def __reduce__(self):
+        return type(self), (self.filename, )
+
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self.filename)!r})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM folders').fetchone()[0]
+
+    # ------------------------------------------------------------------------ #
+    def listdir(self, folder):
+        """
+        List the entries of `folder`, from the cache if the folder did not
+        change since it was last listed. See `listdir`.
+        """
+        path = os.path.abspath(folder)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._remove(path)
+            return []
+
+        with self.lock:
+            row = self.db.execute('SELECT mtime, scanned, entries FROM folders '
+                                  'WHERE path = ?', (path, )).fetchone()
+
+        if row and row[0] == mtime and mtime < row[1] - RACY_SECONDS * 10 ** 9:
+            return _decode(row[2])
+
+        # list the folder
+        scanned = time.time_ns()
+        entries = _scandir(path)
+        self._update(path, mtime, scanned, entries, row and _decode(row[2]))
+        return entries
+
+    def _update(self, path, mtime, scanned, entries, previous):
+        with self.lock:
+            # forget subfolders that no longer exist
+            if previous:
+                folders = {name for name, kind in entries if kind == FOLDER}
+                for name, kind in previous:
+                    if kind == FOLDER and name not in folders:
+                        self._remove(os.path.join(path, name))
+
+            self.db.execute('INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)',
+                            (path, mtime, scanned, _encode(entries)))
+            self._changes += 1
+            if self._changes >= COMMIT_EVERY:
+                self.flush()
+
+    def _remove(self, path):
+        # remove the listings of a folder and all folders below it
+        with self.lock:
+            self.db.execute('DELETE FROM folders WHERE path = ? OR '
+                            'substr(path, 1, ?) = ?',
+                            (path, len(path) + 1, path + os.sep))
+
+    def flush(self):
+        """Commit updated listings to disk."""
+        with self.lock:
+            self.db.commit()
+            self._changes = 0
+
+    def clear(self):
+        """Remove all listings."""
+        with self.lock:
+            self.db.execute('DELETE FROM folders')
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def _encode(entries):
+    return '\0'.join(kind + name for name, kind in entries)
+
+
+def _decode(text):
+    return [(item[1:], item[0]) for item in text.split('\0')] if text else []
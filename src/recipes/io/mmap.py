@@ -136,3 +136,97 @@ def load_memmap_nans(loc=None, shape=None, dtype=None, overwrite=False, **kws):
 
 
 # ---------------------------------------------------------------------------- #
+# Population count of each byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(1)
+
+
+class Bitmap:
+    """
+    A memory-mapped array of flags, packed 8 per byte. Useful for tracking
+    completion of tasks across processes and sessions, since scanning the
+    flags reads only `n / 8` bytes from disk.
+
+    Note that setting a flag is a read-modify-write of a byte shared with 7
+    neighbouring flags. Concurrent writers should therefore hold a lock while
+    setting flags.
+    """
+
+    __slots__ = ('data', 'n')
+
+    def __init__(self, data, n=None):
+        self.data = data
+        self.n = 8 * len(data) if n is None else int(n)
+        if len(data) != (size := -(-self.n // 8)):
+            raise ValueError(f'Bitmap of {self.n} flags requires {size} bytes, '
+                             f'received {len(data)}.')
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.count()}/{self.n})'
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return bool((self.data[index >> 3] >> (index & 7)) & 1)
+
+    def __setitem__(self, index, value):
+        self.set(index, value)
+
+    def __array__(self, dtype=None, copy=None):
+        flags = np.unpackbits(self.data, count=self.n, bitorder='little')
+        return flags.astype(dtype or bool)
+
+    def set(self, index, value=True):
+        """Set (or clear if `value` is False) the flag at `index`."""
+        i, bit = divmod(int(index), 8)
+        if value:
+            self.data[i] |= (1 << bit)
+        else:
+            self.data[i] &= ~np.uint8(1 << bit)
+
+    def clear(self):
+        """Clear all flags."""
+        self.data[:] = 0
+
+    def update(self, flags):
+        """Set all flags from the boolean array `flags`."""
+        self.data[:] = np.packbits(np.asarray(flags, bool), bitorder='little')
+
+    def count(self):
+        """Number of flags that are set."""
+        return int(_POPCOUNT[self.data].sum())
+
+    def all(self):
+        return self.count() == self.n
+
+    def indices(self, value=True):
+        """Indices of the flags that are set (or cleared if `value` is False)."""
+        flags = np.asarray(self)
+        return np.flatnonzero(flags if value else ~flags)
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+
+def load_bitmap(loc=None, n=None, overwrite=False):
+    """
+    Load or create a memory-mapped bitmap for `n` flags, initially cleared.
+
+    Parameters
+    ----------
+    loc : str or path-like, optional
+        File location, by default None, which creates a temporary file.
+    n : int, optional
+        Number of flags. Can be omitted when loading an existing bitmap, in
+        which case the number of flags is taken as 8 times the size of the file.
+    overwrite : bool, optional
+        Whether to overwrite an existing file, by default False.
+
+    Returns
+    -------
+    Bitmap
+    """
+    shape = None if n is None else -(-int(n) // 8)
+    data = load_memmap(loc, shape, np.uint8, 0, overwrite=overwrite)
+    return Bitmap(data, n)
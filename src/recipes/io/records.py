@@ -0,0 +1,317 @@
+"""
+Append-only on-disk store for results of variable size.
+
+Results are written as a log of records, each in `.npy` format, so that the
+size and number of results need not be known in advance. The store is a folder
+holding::
+
+    <writer>.<n>.log    data segments: concatenated `.npy` records. A new
+                        segment is started once the current one reaches
+                        `segment_size` bytes.
+    <writer>.idx        index: one fixed size entry per record with the key,
+                        write sequence number, item number within the write,
+                        segment and byte range of the record.
+
+Each process writes its own segments and index, so concurrent workers never
+contend for a file, and need no locking. Stores for the same folder share the
+writer of their process. The index entries for a key are only
+written once all its records are on disk, so the records of a key are either
+all visible, or not at all. Writes are stamped with the time at which they are
+committed, so that records for the same key written by different processes are
+read back in the order they became visible.
+"""
+
+# std
+import os
+import time
+import uuid
+import inspect
+import tempfile
+import threading
+from pathlib import Path
+from collections import abc
+
+# third-party
+import numpy as np
+from loguru import logger
+
+
+# ---------------------------------------------------------------------------- #
+INDEX_DTYPE = np.dtype([('key', '<i8'),
+                        ('seq', '<u8'),
+                        ('item', '<u4'),
+                        ('segment', '<u4'),
+                        ('offset', '<u8'),
+                        ('nbytes', '<u8')])
+
+SEGMENT_SIZE = 2 ** 28  # 256 MB
+
+# Readers for the `.npy` header by format version. Records with other versions
+# are loaded instead of memory-mapped.
+HEADER_READERS = {(1, 0): np.lib.format.read_array_header_1_0,
+                  (2, 0): np.lib.format.read_array_header_2_0}
+
+# Open writers by (pid, folder). Copies of a store sent to a worker process
+# with each task all write through the one writer of that process.
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+# ---------------------------------------------------------------------------- #
+class _Writer:
+    # Appends records to the segments of a single process.
+
+    def __init__(self, folder, segment_size):
+        self.name = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.folder = Path(folder)
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.segment = -1
+        self.seq = 0
+        self.data = None
+        self.index = open(self.folder / f'{self.name}.idx', 'ab')
+        self._next_segment()
+
+    def _next_segment(self):
+        if self.data:
+            self.data.close()
+
+        self.segment += 1
+        self.data = open(self.folder / f'{self.name}.{self.segment}.log', 'ab')
+
+    def write(self, key, items):
+        # The lock is only held while writing each record and committing the
+        # index, so that threads can produce their items concurrently
+        entries = []
+        for i, item in enumerate(items):
+            item = np.asanyarray(item)
+            with self.lock:
+                if self.data.tell() >= self.segment_size:
+                    self._next_segment()
+
+                offset = self.data.tell()
+                np.lib.format.write_array(self.data, item, allow_pickle=True)
+                entries.append((key, 0, i, self.segment, offset,
+                                self.data.tell() - offset))
+
+        entries = np.array(entries, INDEX_DTYPE)
+        with self.lock:
+            # data first, so that the index never refers to incomplete records
+            self.data.flush()
+
+            # sequence number of the write: strictly increasing in a process,
+            # and ordered by the time of commit across processes
+            entries['seq'] = self.seq = max(time.time_ns(), self.seq + 1)
+            self.index.write(entries.tobytes())
+            self.index.flush()
+            return len(entries)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class RecordStore(abc.Mapping):
+    """
+    Streaming store for results of unknown size, eg. variable length arrays or
+    records, keyed by an integer (eg. the index of a task). Any number of
+    results can be stored for each key.
+
+    Results are appended to files on disk as they arrive, so memory use does not
+    grow with the size of the output. The store can be shared with worker
+    processes, which each write their own files.
+
+    Reading the store returns arrays: `store[key]` is the list of results for
+    `key`, in the order they were written. Writing to an existing key appends
+    to its results.
+
+    Examples
+    --------
+    >>> store = RecordStore('results')
+    >>> store.write(0, (np.arange(n) for n in range(3)))
+    >>> store[1] = 'spam'
+    >>> store[0]
+    [array([], dtype=int64), array([0]), array([0, 1])]
+    """
+
+    def __init__(self, loc=None, segment_size=SEGMENT_SIZE, mmap_mode=None,
+                 overwrite=False):
+        """
+        Parameters
+        ----------
+        loc : str or path-like, optional
+            Folder for the store, by default None, which creates a temporary
+            folder.
+        segment_size : int, optional
+            Size in bytes beyond which a new data segment is started, by
+            default 256 MB.
+        mmap_mode : {None, 'r'}, optional
+            If 'r', arrays are memory-mapped from the data segments when read,
+            instead of loaded. Arrays of objects are always loaded.
+        overwrite : bool, optional
+            Whether to remove existing results, by default False.
+        """
+        if loc is None:
+            loc = tempfile.mkdtemp(suffix='.records')
+
+        self.filename = Path(loc)
+        self.segment_size = int(segment_size)
+        self.mmap_mode = mmap_mode
+        self._index = np.empty(0, INDEX_DTYPE)
+        self._files = np.empty(0, object)
+        self._stats = None
+
+        if overwrite and self.filename.exists():
+            self.clear()
+
+        if not self.filename.exists():
+            logger.debug('Creating record store at {!r}.', str(self.filename))
+            self.filename.mkdir(parents=True)
+
+    def __reduce__(self):
+        # workers write through the writer of their process
+        return type(self), (self.filename, self.segment_size, self.mmap_mode)
+
+    def __repr__(self):
+        return (f'{type(self).__name__}({str(self.filename)!r}, '
+                f'keys={len(self)}, records={len(self.index)})')
+
+    # ------------------------------------------------------------------------ #
+    # Writing
+
+    @property
+    def _writer_key(self):
+        return (os.getpid(), self.filename.resolve())
+
+    @property
+    def writer(self):
+        # writers are owned by a single process: a store inherited by a forked
+        # worker process starts its own, which is shared by all stores for the
+        # same folder in that process
+        key = self._writer_key
+        writer = _writers.get(key)
+        if writer is None:
+            with _writers_lock:
+                writer = _writers.get(key)
+                if writer is None:
+                    writer = _writers[key] = _Writer(self.filename,
+                                                     self.segment_size)
+        return writer
+
+    def write(self, key, items):
+        """
+        Write a sequence of results for `key`. `items` may be a generator, in
+        which case the results are written as they are produced. Results
+        become visible to readers once all of them have been written.
+
+        Returns
+        -------
+        int
+            The number of results written.
+        """
+        return self.writer.write(int(key), items)
+
+    def __setitem__(self, key, result):
+        # Generators are streamed item by item, anything else is a single
+        # result for `key`
+        self.write(key, result if inspect.isgenerator(result) else (result, ))
+
+    def close(self):
+        """Close the writer of this process for the store's folder."""
+        with _writers_lock:
+            writer = _writers.pop(self._writer_key, None)
+        if writer:
+            writer.close()
+
+    def clear(self):
+        """Remove all results."""
+        self.close()
+        for file in self.filename.glob('*.idx'):
+            name = file.stem
+            for path in (file, *self.filename.glob(f'{name}.*.log')):
+                path.unlink()
+
+        self._stats = None
+
+    # ------------------------------------------------------------------------ #
+    # Reading
+
+    @property
+    def index(self):
+        """
+        Index of all records sorted by key, then by write sequence number and
+        item number for each key.
+        Reloaded when any of the writers have added results.
+        """
+        files = sorted(self.filename.glob('*.idx'))
+        stats = [(file.name, file.stat().st_size) for file in files]
+        if stats != self._stats:
+            self._load_index(files)
+            self._stats = stats
+        return self._index
+
+    def _load_index(self, files):
+        index, names = [], []
+        for file in files:
+            # a writer may be appending, read only complete entries
+            count = file.stat().st_size // INDEX_DTYPE.itemsize
+            entries = np.fromfile(file, INDEX_DTYPE, count)
+            index.append(entries)
+            names.extend([file.stem] * len(entries))
+
+        if not index:
+            self._index, self._files = np.empty(0, INDEX_DTYPE), np.empty(0, object)
+            return
+
+        index = np.concatenate(index)
+        order = np.lexsort((index['item'], index['seq'], index['key']))
+        self._index = index[order]
+        self._files = np.array(names, object)[order]
+
+    def keys(self):
+        """Unique keys in the store, sorted."""
+        return np.unique(self.index['key'])
+
+    def __iter__(self):
+        yield from self.keys().tolist()
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        keys = self.index['key']
+        i = np.searchsorted(keys, key)
+        return bool(i < len(keys) and keys[i] == key)
+
+    def __getitem__(self, key):
+        keys = self.index['key']
+        start, stop = np.searchsorted(keys, key), np.searchsorted(keys, key, 'right')
+        if start == stop:
+            raise KeyError(key)
+
+        return [self._read(self._files[i], self._index[i])
+                for i in range(start, stop)]
+
+    def records(self):
+        """Iterate over all `(key, result)` pairs, ordered by key."""
+        index = self.index
+        for name, entry in zip(self._files, index):
+            yield int(entry['key']), self._read(name, entry)
+
+    def _read(self, name, entry):
+        filename = self.filename / f'{name}.{entry["segment"]}.log'
+        with open(filename, 'rb') as fp:
+            fp.seek(int(entry['offset']))
+            if self.mmap_mode is None:
+                return np.lib.format.read_array(fp, allow_pickle=True)
+
+            version = np.lib.format.read_magic(fp)
+            read_header = HEADER_READERS.get(version)
+            shape, fortran, dtype = ((None, None, np.dtype(object))
+                                     if read_header is None else read_header(fp))
+            if dtype.hasobject:
+                fp.seek(int(entry['offset']))
+                return np.lib.format.read_array(fp, allow_pickle=True)
+
+            return np.memmap(fp, dtype, self.mmap_mode, fp.tell(), shape,
+                             'F' if fortran else 'C')
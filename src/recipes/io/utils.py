@@ -3,10 +3,10 @@
 # std
 import io
 import os
+import re
 import math
 import glob
 import json
-import mmap
 import pickle
 import shutil
 import hashlib
@@ -16,6 +16,7 @@ import itertools as itt
 import contextlib as ctx
 from pathlib import Path
 from warnings import warn
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 # third-party
 import more_itertools as mit
@@ -27,6 +28,8 @@ from ..containers import ensure
 from ..functionals import echo0
 from ..string.delimited import braces
 from ..shell.bash import brace_expand_iter
+from .lines import LineIndex, _strip_chars, count_newlines
+from .listing import FILE, FOLDER, ListingCache, listdir
 
 
 # ---------------------------------------------------------------------------- #
@@ -123,7 +126,8 @@ def save_json(filename, data, **kws):
 #             yield pattern
 
 
-def iter_files(path_or_pattern, extensions='*', recurse=False, ignore=()):
+def iter_files(path_or_pattern, extensions='*', recurse=False, ignore=(),
+               njobs=1, cache=None):
     """
     Generator that yields all files in a directory tree with given file
     extension(s), optionally recursing down the directory tree. Brace expansion
@@ -147,6 +151,17 @@ def iter_files(path_or_pattern, extensions='*', recurse=False, ignore=()):
     recurse : bool, default=True
         Whether or not to recurse down the directory tree.  The same as using 
         ".../**/..." in the glob pattern.
+    ignore : str or tuple of str
+        Glob pattern(s) for paths to exclude, matched against the full path of
+        each file. Folders are not descended into if all paths below them
+        match a pattern, eg. '*/build/*'.
+    njobs : int, default=1
+        Number of threads listing folders concurrently while recursing. Files
+        are yielded in arbitrary order if more than one.
+    cache : ListingCache or str or path-like or bool, optional
+        Cache of folder listings, or the location of its database (True for the
+        default location). Folders that did not change since they were cached
+        are not listed again. By default, folders are always listed.
 
     Examples
     --------
@@ -166,21 +181,38 @@ def iter_files(path_or_pattern, extensions='*', recurse=False, ignore=()):
         ignore = (ignore, )
 
     ignore = list(mit.collapse(map(brace_expand_iter, ignore)))
+    # a cache opened here from its location is also closed here
+    owned = None
+    if cache is False:
+        cache = None
+    elif cache is not None and not isinstance(cache, ListingCache):
+        cache = owned = ListingCache(None if cache is True else cache)
+
+    try:
+        for file in _iter_files(path_or_pattern, ensure.tuple(extensions),
+                                recurse, _compile(ignore),
+                                _compile([p for p in ignore if p.endswith('*')]),
+                                njobs, cache):
+            yield Path(file)
+    finally:
+        if owned is not None:
+            owned.close()
+        elif cache is not None:
+            cache.flush()
 
-    for file in _iter_files(path_or_pattern, ensure.tuple(extensions), recurse):
-        for ignored in ignore:
-            if fnm.fnmatchcase(str(file), ignored):
-                logger.debug("Ignoring '{!s}' matching pattern {!r}.", file, ignored)
-                break
-        else:
-            yield file
+
+def _compile(patterns):
+    # single regex matching any of the glob patterns
+    if patterns:
+        return re.compile('|'.join(map(fnm.translate, patterns)))
 
 
 def _maybe_newline(string, width=40, indent=' ' * 2):
     return f'\n{indent}{string}' if len(string) > width else string
 
 
-def _iter_files(path_or_pattern, extensions='*', recurse=False):
+def _iter_files(path_or_pattern, extensions='*', recurse=False, ignore=None,
+                prune=None, njobs=1, cache=None):
 
     logger.debug('Iterating over: {}. extensions = {}, recurse={}',
                  path_or_pattern, extensions, recurse)
@@ -201,38 +233,101 @@ def _iter_files(path_or_pattern, extensions='*', recurse=False):
         for path in itr:
             # recurse
             # logger.trace('Recursing into: {!s}.', path)
-            yield from iter_files(path, extensions, recurse)
+            yield from _iter_files(path, extensions, recurse, ignore, prune,
+                                   njobs, cache)
         return
 
     # handle input strings without special patterns here. This can be a file or
     # directory path
     path = Path(path_or_pattern)
 
+    # Paths are matched against ignore patterns in normalized form, eg.
+    # 'data/sub/b.txt' for files below './data'
+    root = str(path)
+
     # Return the input if it is an existing file. This break the recurrence.
     if path.is_file():
-        yield path
+        if not _ignored(root, ignore):
+            yield root
         return
 
     # iterate all files with given extensions
-    extensions = ensure.tuple(extensions)
-    extensions = f'{{{",".join((ext.lstrip(".") for ext in extensions))}}}'
-    # recurse?
-    pattern = f'{path!s}/{"**/" * recurse}*.{extensions}'
-
     if path.is_dir():
         logger.debug('Received folder: {}', path)
-        logger.debug('Recursing on: {}', pattern)
-        yield from iter_files(pattern, recurse=recurse)
+        names = _compile([f'*.{ext.lstrip(".")}' for ext in
+                          mit.collapse(map(brace_expand_iter, extensions))])
+        for file in _walk(root, names, recurse, prune, njobs, cache):
+            if not _ignored(file, ignore):
+                yield file
         return
 
     # Non-existing path
     raise ValueError(
-        f"Could not any resolve files for the input pattern: '{pattern!s}'. "
+        f"Could not any resolve files for the input pattern: '{path!s}'. "
         'Please supply a path to a valid existing directory, or '
         'alternitively a glob pattern, or bash brace expansion pattern.'
     )
 
 
+def _ignored(path, ignore):
+    if ignore and ignore.match(path):
+        logger.debug("Ignoring '{!s}'.", path)
+        return True
+    return False
+
+
+def _walk(root, names, recurse=False, prune=None, njobs=1, cache=None):
+    # Yield paths of files in `root` with names matching the `names` regex,
+    # listing each folder once. Hidden files and folders are skipped, as with
+    # glob.
+    if not recurse or njobs in (None, 1):
+        folders = [root]
+        while folders:
+            files, subfolders = _scan(folders.pop(), names, prune, cache)
+            yield from files
+            if recurse:
+                folders.extend(reversed(subfolders))
+        return
+
+    # list subtrees concurrently
+    pool = ThreadPoolExecutor(njobs)
+    pending = set()
+    try:
+        pending.add(pool.submit(_scan, root, names, prune, cache))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subfolders = future.result()
+                pending.update(pool.submit(_scan, folder, names, prune, cache)
+                               for folder in subfolders)
+                yield from files
+    finally:
+        # `shutdown(cancel_futures=True)` needs python 3.9
+        for future in pending:
+            future.cancel()
+        pool.shutdown()
+
+
+def _scan(folder, names, prune, cache=None):
+    # List a folder, returning the matching files and the subfolders that are
+    # not pruned
+    files, folders = [], []
+    for name, kind in listdir(folder, cache):
+        if name.startswith('.'):
+            continue
+
+        path = os.path.join(folder, name)
+        if kind == FOLDER:
+            if prune and prune.match(path + os.sep):
+                logger.debug("Pruning '{!s}'.", path)
+            else:
+                folders.append(path)
+        elif kind == FILE and names.match(name):
+            files.append(path)
+
+    return files, folders
+
+
 def iter_ext(files, extensions='*'):
     """
     Yield all the files that exist with the same root and stem but different
@@ -271,11 +366,15 @@ def open_any(filelike, mode='r'):
     raise TypeError(f'Invalid file-like object of type {type(filelike)}.')
 
 
-def iter_lines(filelike, *section, mode='r', strip=None):
+def iter_lines(filelike, *section, mode='r', strip=None, index=None):
     """
     File line iterator for text files. Optionally return only a section of the
     file. Trailing newline character are stripped by default.
 
+    For files given by name, sections that do not start at the first line are
+    read by seeking to the first line with a `LineIndex`, and negative indices
+    count from the end of the file.
+
     Two basic function signatures are accepted:
         iter_lines(filename, stop)
         iter_lines(filename, start, stop[, step])
@@ -296,6 +395,11 @@ def iter_lines(filelike, *section, mode='r', strip=None):
         translates system specific newlines in the file to '\\n', for files
         opened in text mode. Use `strip=''` or `strip=False` to leave lines
         unmodified.
+    index : bool, optional
+        Whether to seek to the section using a line index. By default None,
+        which uses the index if it is saved and up to date with the file, or
+        builds it if the section has negative indices. True always uses the
+        index, building and saving it if needed, and False never does.
 
     Examples
     --------
@@ -310,15 +414,21 @@ def iter_lines(filelike, *section, mode='r', strip=None):
     # NOTE python automatically translate system newlines to '\n' for files
     # opened in text mode, but not in binary mode:
     #   https://stackoverflow.com/a/38075790/1098683
-    if strip is None:
-        strip = os.linesep
-    strip = strip or ''
-    if 'b' in mode and isinstance(strip, str):
-        strip = strip.encode()
+    strip = _strip_chars(strip, mode)
 
     # handle possible inf in section
     section = tuple(None if _ == math.inf else _ for _ in section) or (None, )
 
+    if isinstance(filelike, (str, Path)) and index is not False:
+        start = section[0] if len(section) > 1 else None
+        negative = any(i is not None and i < 0 for i in section)
+        build = bool(index or negative)
+        if (index or negative or start) and (
+                (lines := LineIndex.load(filelike, build=build)) is not None):
+            for s in lines.iter(*section, mode=mode):
+                yield s.strip(strip)
+            return
+
     with open_any(filelike, mode) as fp:
         for s in itt.islice(fp, *section):
             yield s.strip(strip)
@@ -326,7 +436,7 @@ def iter_lines(filelike, *section, mode='r', strip=None):
 
 # @ doc.splice(iter_lines)
 def read_lines(filename, *section, mode='r', strip=None, filtered=None,
-               log=False):
+               log=False, index=None):
     """
     Read a subset of lines from a given file.
 
@@ -350,7 +460,7 @@ def read_lines(filename, *section, mode='r', strip=None, filtered=None,
         Lines from the file
     """
     # Read file content
-    content = iter_lines(filename, *section, mode=mode, strip=strip)
+    content = iter_lines(filename, *section, mode=mode, strip=strip, index=index)
     if filtered is not False:
         if filtered is True:
             filtered = None
@@ -366,9 +476,27 @@ def read_lines(filename, *section, mode='r', strip=None, filtered=None,
     return content
 
 
-def read_line(filename, nr, mode='r', strip=None):
-    return next(iter_lines(filename, nr, nr + 1,
-                           mode=mode, strip=strip))
+def read_line(filename, nr, mode='r', strip=None, index=None):
+    """
+    Read line number `nr` from a file. Negative line numbers count from the
+    end of the file.
+
+    Parameters
+    ----------
+    index : bool, optional
+        Whether to seek to the line using a line index, as for `iter_lines`.
+        By default None, which uses a saved index that is up to date with the
+        file. For negative line numbers, an index is then built if needed, but
+        not saved.
+    """
+    section = (nr, (nr + 1) or None)
+    if index is None and nr < 0 and isinstance(filename, (str, Path)):
+        lines = LineIndex.load(filename, save=False)
+        return next(lines.iter(*section, mode=mode)).strip(
+            _strip_chars(strip, mode))
+
+    return next(iter_lines(filename, *section, mode=mode, strip=strip,
+                           index=index))
 
 
 def _show_lines(filename, lines, n=10, dots='.\n' * 3):
@@ -398,15 +526,18 @@ def count_lines(filename):
     if not os.path.exists(filename):
         raise ValueError(f'No such file: {filename!r}.')
 
-    if os.path.getsize(filename) == 0:
+    if (size := os.path.getsize(filename)) == 0:
         return 0
 
-    with open(filename, 'r+') as fp:
-        count = 0
-        buffer = mmap.mmap(fp.fileno(), 0)
-        while buffer.readline():
-            count += 1
-        return count
+    if (lines := LineIndex.load(filename, build=False)) is not None:
+        return len(lines)
+
+    # count newlines, and the final line if it has none
+    with open(filename, 'rb') as fp:
+        fp.seek(size - 1)
+        last = fp.read(1)
+
+    return count_newlines(filename) + (last != b'\n')
 
 
 def write_lines(stream, lines, eol='\n', eof=''):
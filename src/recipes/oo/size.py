@@ -18,7 +18,11 @@ def get_object_size(obj_0):
     Recursively iterate to sum size of object & members.
     """
 
-    def inner(obj, _seen_ids=set()):
+    # NOTE: ids are tracked per top level call. A mutable default here would
+    # persist between calls and cause previously seen objects to size as 0
+    _seen_ids = set()
+
+    def inner(obj):
         obj_id = id(obj)
         if obj_id in _seen_ids:
             return 0
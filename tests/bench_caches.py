@@ -0,0 +1,53 @@
+"""
+Benchmark the call overhead of the `cached` decorator against
+`functools.lru_cache`. Run as a script:
+
+$ python tests/bench_caches.py
+"""
+
+# std
+import timeit
+import functools as ftl
+
+# local
+from recipes.caching import cached
+
+
+# ---------------------------------------------------------------------------- #
+def func(a, b=0, *c, **kws):
+    return a
+
+
+CASES = {
+    'positional':   ((1, 2), {}),
+    'defaults':     ((1, ), {}),
+    'keywords':     ((1, ), {'b': 2}),
+    'variadic':     ((1, 2, 3), {'x': 4}),
+}
+
+
+def bench(number=100_000, repeat=5):
+    decorators = {'lru_cache': ftl.lru_cache(128),
+                  'cached': cached(capacity=128)}
+
+    print(f'{"":<12}', *(f'{name:>12}' for name in decorators),
+          f'{"ratio":>8}', sep='')
+
+    for case, (args, kws) in CASES.items():
+        times = []
+        for decorator in decorators.values():
+            wrapped = decorator(func)
+            wrapped(*args, **kws)   # prime the cache
+            t = min(timeit.repeat(lambda: wrapped(*args, **kws),
+                                  number=number, repeat=repeat))
+            times.append(t / number)
+
+        print(f'{case:<12}', *(f'{t * 1e6:>10.2f}µs' for t in times),
+              f'{times[1] / times[0]:>8.1f}', sep='')
+
+
+if __name__ == '__main__':
+    from loguru import logger
+
+    logger.disable('recipes')
+    bench()
@@ -0,0 +1,97 @@
+# third-party
+import pytest
+
+# local
+from recipes.io.gitignore import GitIgnore, GlobPatternList, get_repo_files
+
+
+# ---------------------------------------------------------------------------- #
+GITIGNORE = r"""
+# comment
+*.log
+!keep.log
+build/
+/root.txt
+doc/*.txt
+**/foo
+a/**/b
+logs/**
+!logs/important/
+*.py[co]
+\#hash
+nested/x[!0-9]
+""" + 'trailing\\ \n'  # escaped trailing space
+
+FILES = {
+    # path: ignored
+    'x.log': True,
+    'keep.log': False,
+    'src/y.log': True,
+    'build/z': True,
+    'src/build/z': True,
+    'root.txt': True,
+    'src/root.txt': False,
+    'doc/d.txt': True,
+    'doc/sub/e.txt': False,
+    'src/foo/f': True,
+    'a/b/g': True,
+    'a/x/y/b/h': True,
+    'logs/l': True,
+    'logs/important/m': True,
+    'm.pyc': True,
+    'm.py': False,
+    '#hash': True,
+    'trailing ': True,
+    'nested/xa': True,
+    'nested/x1': False,
+    'nested/sub/keep.q': False,
+    'nested/sub/r.q': True,
+    '.git/config': True,
+}
+
+
+@pytest.fixture
+def repo(tmp_path):
+    (tmp_path / '.gitignore').write_text(GITIGNORE)
+    for name in FILES:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    (tmp_path / 'nested/.gitignore').write_text('*.q\n!keep.q\n')
+    return tmp_path
+
+
+def test_repo_files(repo):
+    files = {path.relative_to(repo).as_posix() for path in get_repo_files(repo)}
+    assert files == {'.gitignore', 'nested/.gitignore',
+                     *(name for name, ignored in FILES.items() if not ignored)}
+
+
+@pytest.mark.parametrize('name', FILES)
+def test_match(repo, name):
+    assert GitIgnore(repo / '.gitignore').match(repo / name) is FILES[name]
+
+
+@pytest.mark.parametrize(
+    'pattern, path, is_dir, expected',
+    [('*.txt', 'a/b.txt', False, True),
+     ('/*.txt', 'a/b.txt', False, None),
+     ('build/', 'build', False, None),
+     ('build/', 'build', True, True),
+     ('a/**', 'a/b/c', False, True),
+     ('**/c', 'a/b/c', False, True),
+     ('a/**/c', 'a/c', False, True),
+     ('a?c', 'a/c', False, None),
+     ('[!a]', 'b', False, True),
+     ('[!a]', 'a', False, None)]
+)
+def test_verdict(pattern, path, is_dir, expected):
+    assert GlobPatternList('.', [pattern]).verdict(path, is_dir) is expected
+
+
+def test_last_match_wins():
+    patterns = GlobPatternList('.', ['*.txt', '!keep.txt', 'keep.txt'])
+    assert patterns.verdict('keep.txt') is True
+    patterns.add('!*.txt')
+    assert patterns.verdict('keep.txt') is False
@@ -1,4 +1,7 @@
 
+# std
+import glob
+
 # third-party
 import pytest
 
@@ -67,9 +70,50 @@ test_iter_lines = Expected(io.iter_lines)(
 )
 
 
-# test_iter_files = Expected(io.iter_files)(
-#     ()
-# )
+@pytest.fixture
+def tree(tmp_path):
+    for name in ('a.txt', 'b.py', 'c', '.hidden.txt',
+                 'sub/d.txt', 'sub/deep/e.txt', 'sub/deep/f.py',
+                 'build/g.txt', 'build/deep/h.txt', '.git/i.txt'):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+    return tmp_path
+
+
+def _glob(root, extensions, recurse):
+    return {file for ext in extensions
+            for file in glob.glob(f'{root}/{"**/" * recurse}*.{ext}',
+                                  recursive=recurse)}
+
+
+@pytest.mark.parametrize('extensions', ['*', 'txt', ('txt', 'py')])
+@pytest.mark.parametrize('recurse', [False, True])
+@pytest.mark.parametrize('njobs', [1, 4])
+def test_iter_files(tree, extensions, recurse, njobs):
+    files = set(map(str, io.iter_files(tree, extensions, recurse, njobs=njobs)))
+    assert files == _glob(tree, io.utils.ensure.tuple(extensions), recurse)
+
+
+def test_iter_files_ignore(tree):
+    files = io.iter_files(tree, 'txt', True, ignore=('*/build/*', '*/d.txt'))
+    assert {file.relative_to(tree).as_posix() for file in files} == \
+        {'a.txt', 'sub/deep/e.txt'}
+
+
+@pytest.mark.parametrize('njobs', [1, 4])
+def test_iter_files_ignore_relative(tree, monkeypatch, njobs):
+    # patterns match the normalized path, not the path as given
+    monkeypatch.chdir(tree)
+    files = io.iter_files('./sub', 'txt', True, ignore='sub/deep/*', njobs=njobs)
+    assert {file.as_posix() for file in files} == {'sub/d.txt'}
+
+
+def test_iter_files_pattern(tree):
+    files = io.iter_files(f'{tree}/{{a.txt,b.py,sub}}', 'txt')
+    assert {file.relative_to(tree).as_posix() for file in files} == \
+        {'a.txt', 'b.py', 'sub/d.txt'}
+
 
 # TODO: test iter_files!!!!!!!
 # iter_files('/root/{main,ch*}', 'tex') # with expansion
@@ -0,0 +1,108 @@
+# std
+import itertools as itt
+
+# third-party
+import pytest
+
+# local
+from recipes import io
+from recipes.io.lines import (
+    LineIndex, find_line_starts, index_file, iter_chunks
+)
+
+
+# ---------------------------------------------------------------------------- #
+
+@pytest.fixture(params=['\n', '\r\n'])
+def textfile(tmp_path, request):
+    filename = tmp_path / 'lines.txt'
+    filename.write_bytes(request.param.join(map(str, range(100))).encode())
+    return filename
+
+
+@pytest.mark.parametrize('content', [b'', b'\n', b'a', b'a\n', b'a\n\nb'])
+@pytest.mark.parametrize('block_size', [1, 2, 64])
+def test_find_line_starts(tmp_path, content, block_size):
+    filename = tmp_path / 'lines.txt'
+    filename.write_bytes(content)
+    offsets = find_line_starts(filename, block_size)
+    assert offsets[-1] == len(content)
+    assert [content[i:j] for i, j in zip(offsets, offsets[1:])] == \
+        content.splitlines(keepends=True)
+
+
+def test_read_line(textfile):
+    assert io.read_line(textfile, 5) == '5'
+    assert io.read_line(textfile, -1) == '99'
+    assert io.read_line(textfile, -1, mode='rb', strip='\r\n') == b'99'
+    # reading is free of side effects unless an index is requested
+    assert not index_file(textfile).exists()
+    assert io.read_line(textfile, 7, index=True) == '7'
+    assert index_file(textfile).exists()
+    assert io.count_lines(textfile) == 100
+
+
+def test_read_lines(textfile):
+    assert io.read_lines(textfile, -3, None) == ['97', '98', '99']
+    assert io.read_lines(textfile, 10, 20, 5) == ['10', '15']
+    assert io.read_lines(textfile, 10, 12, mode='rb', strip='\r\n') == \
+        [b'10', b'11']
+
+    # without index
+    assert io.read_lines(textfile, 10, 12, index=False) == ['10', '11']
+
+
+def test_invalidate(textfile):
+    LineIndex.load(textfile)
+    with textfile.open('a') as fp:
+        fp.write('\nspam')
+
+    # older index is not used
+    assert LineIndex.load(textfile, build=False) is None
+    assert io.read_line(textfile, -1) == 'spam'
+    assert io.count_lines(textfile) == 101
+
+
+def test_count_lines(textfile):
+    assert io.count_lines(textfile) == 100
+    assert not index_file(textfile).exists()
+
+
+# ---------------------------------------------------------------------------- #
+
+def _length(line):
+    return len(line)
+
+
+def _parse(line):
+    if line == '50':
+        raise ValueError('Failed deliberately.')
+    return int(line)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 2 ** 20])
+def test_iter_chunks(textfile, chunk_size):
+    content = textfile.read_bytes()
+    chunks = list(iter_chunks(textfile, chunk_size))
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == len(content)
+    assert all(stop == start for (_, stop), (start, _) in zip(chunks, chunks[1:]))
+    assert all(content[stop - 1:stop] == b'\n' for _, stop in chunks[:-1])
+
+
+@pytest.mark.parametrize('njobs', [1, 2])
+@pytest.mark.parametrize('ordered', [True, False])
+def test_map_lines(textfile, njobs, ordered):
+    expected = list(map(_length, io.read_lines(textfile, filtered=False)))
+    results = list(io.map_lines(textfile, _length, njobs, ordered, chunk_size=16))
+    if not ordered:
+        results, expected = sorted(results), sorted(expected)
+    assert results == expected
+
+
+def test_map_lines_error(textfile):
+    results = io.map_lines(textfile, _parse, 2, chunk_size=16)
+    # results of earlier chunks are not affected
+    assert list(itt.islice(results, 40)) == list(range(40))
+    with pytest.raises(ValueError):
+        list(results)
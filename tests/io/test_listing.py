@@ -0,0 +1,96 @@
+# std
+import os
+import shutil
+
+# third-party
+import pytest
+
+# local
+from recipes import io
+from recipes.io.gitignore import get_repo_files
+
+
+# ---------------------------------------------------------------------------- #
+
+def age(*folders, mtime=1e9):
+    # set the modification time of folders to the distant past, so that their
+    # listings are not considered racy
+    for folder in folders:
+        os.utime(folder, (mtime, mtime))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / 'tree'
+    for name in ('a.txt', 'sub/b.txt', 'sub/deep/c.txt'):
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    age(root, root / 'sub', root / 'sub/deep')
+    return root
+
+
+def names(files, root):
+    return sorted(file.relative_to(root).as_posix() for file in files)
+
+
+def test_listing_cache(tmp_path, tree):
+    cache = io.ListingCache(tmp_path / 'listing.db')
+    expected = ['a.txt', 'sub/b.txt', 'sub/deep/c.txt']
+    assert names(io.iter_files(tree, 'txt', True, cache=cache), tree) == expected
+    assert len(cache) == 3
+
+    # changes that leave the modification time of the folder unchanged are
+    # not seen, since the listing is taken from the cache
+    (tree / 'sub/new.txt').touch()
+    age(tree / 'sub')
+    assert names(io.iter_files(tree, 'txt', True, cache=cache), tree) == expected
+
+    # modified folders are listed again
+    age(tree / 'sub', mtime=2e9)
+    assert 'sub/new.txt' in names(io.iter_files(tree, 'txt', True, cache=cache),
+                                  tree)
+
+    # listings of removed folders are dropped
+    shutil.rmtree(tree / 'sub/deep')
+    age(tree / 'sub', mtime=3e9)
+    assert names(io.iter_files(tree, 'txt', True, cache=cache), tree) == \
+        ['a.txt', 'sub/b.txt', 'sub/new.txt']
+    assert len(cache) == 2
+
+
+def test_listing_cache_persistent(tmp_path, tree):
+    filename = tmp_path / 'listing.db'
+    list(io.iter_files(tree, 'txt', True, cache=filename))
+    assert len(io.ListingCache(filename)) == 3
+
+
+def test_listing_cache_closed(tmp_path, tree, monkeypatch):
+    closed = []
+
+    def close(self, close=io.ListingCache.close):
+        closed.append(self)
+        close(self)
+
+    monkeypatch.setattr(io.ListingCache, 'close', close)
+    monkeypatch.setattr(io.ListingCache, '__len__',
+                        lambda self: pytest.fail('Counted the cache entries.'))
+
+    # caches opened by `iter_files` are closed, others are left open
+    list(io.iter_files(tree, 'txt', True, cache=tmp_path / 'listing.db'))
+    assert len(closed) == 1
+
+    cache = io.ListingCache(tmp_path / 'listing.db')
+    list(io.iter_files(tree, 'txt', True, cache=cache))
+    assert len(closed) == 1
+
+
+def test_repo_files_cached(tmp_path, tree):
+    (tree / '.gitignore').write_text('deep\n')
+    age(tree)
+    cache = io.ListingCache(tmp_path / 'listing.db')
+    files = names(get_repo_files(tree), tree)
+    assert files == ['.gitignore', 'a.txt', 'sub/b.txt']
+    assert names(get_repo_files(tree, cache), tree) == files
+    assert names(get_repo_files(tree, cache), tree) == files
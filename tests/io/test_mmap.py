@@ -0,0 +1,40 @@
+
+# third-party
+import pytest
+import numpy as np
+
+# local
+from recipes.io import load_bitmap
+
+
+# ---------------------------------------------------------------------------- #
+
+class TestBitmap:
+
+    def test_set(self, tmp_path):
+        bits = load_bitmap(tmp_path / 'flags.npy', 13)
+        assert len(bits.data) == 2
+        assert bits.count() == 0
+
+        bits.set(0)
+        bits[12] = True
+        bits.set(5)
+        bits.set(5, False)
+        assert bits[0] and bits[12] and not bits[5]
+        assert bits.count() == 2
+        assert list(bits.indices()) == [0, 12]
+        assert np.asarray(bits).sum() == 2
+
+    def test_persist(self, tmp_path):
+        bits = load_bitmap(tmp_path / 'flags.npy', 20)
+        bits.update(np.arange(20) % 3 == 0)
+        bits.flush()
+
+        clone = load_bitmap(tmp_path / 'flags.npy', 20)
+        assert list(clone.indices()) == list(range(0, 20, 3))
+        assert not clone.all()
+
+    def test_size_mismatch(self, tmp_path):
+        load_bitmap(tmp_path / 'flags.npy', 20)
+        with pytest.raises(ValueError):
+            load_bitmap(tmp_path / 'flags.npy', 100)
@@ -0,0 +1,118 @@
+
+# std
+import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# third-party
+import pytest
+import numpy as np
+
+# local
+from recipes.io import RecordStore
+
+
+# ---------------------------------------------------------------------------- #
+
+def _write(store, key):
+    return store.write(key, (np.arange(n) for n in range(key)))
+
+
+class TestRecordStore:
+
+    def test_write(self, tmp_path):
+        store = RecordStore(tmp_path / 'results')
+        assert store.write(2, (np.arange(n) for n in range(3))) == 3
+        store[0] = 'spam'
+        store[0] = {'eggs': 1}
+
+        assert list(store) == [0, 2]
+        assert 2 in store and 1 not in store
+        assert [len(a) for a in store[2]] == [0, 1, 2]
+        assert store[0][0] == 'spam'
+        assert store[0][1].item() == {'eggs': 1}
+        with pytest.raises(KeyError):
+            store[1]
+
+    def test_failed_generator(self, tmp_path):
+        # results of a key only become visible once all have been written
+        def produce():
+            yield np.ones(3)
+            raise ValueError
+
+        store = RecordStore(tmp_path / 'results')
+        with pytest.raises(ValueError):
+            store.write(0, produce())
+        assert 0 not in store
+
+    def test_append_order(self, tmp_path):
+        store = RecordStore(tmp_path / 'results')
+        other = RecordStore(store.filename)
+        store.write(0, ['a', 'b'])
+        store.write(1, ['x'])
+        store.write(0, ['c', 'd'])
+        store.close()  # a separate writer for the next writes
+        other.write(0, ['e'])
+        store.write(0, ['f'])
+        assert [a.item() for a in store[0]] == list('abcdef')
+
+    def test_retry(self, tmp_path):
+        # a task that crashed while writing is retried by another worker
+        def produce(n):
+            yield from range(n)
+            raise SystemExit
+
+        store = RecordStore(tmp_path / 'results')
+        with pytest.raises(SystemExit):
+            store.write(0, produce(3))
+        store.write(1, [1])
+
+        # a partial index entry left by the crash
+        with open(store.writer.index.name, 'ab') as fp:
+            fp.write(b'\0' * 10)
+        store.close()
+
+        retry = RecordStore(store.filename)
+        retry.write(0, range(3))
+        assert [a.item() for a in store[0]] == [0, 1, 2]
+        assert list(store) == [0, 1]
+
+    @pytest.mark.parametrize('mmap_mode', [None, 'r'])
+    def test_segments(self, tmp_path, mmap_mode):
+        store = RecordStore(tmp_path / 'results', segment_size=256,
+                            mmap_mode=mmap_mode)
+        data = [np.random.randn(n, 2) for n in range(20)]
+        for i, a in enumerate(data):
+            store[i] = a
+
+        assert len(list(store.filename.glob('*.log'))) > 1
+        assert all((store[i][0] == a).all() for i, a in enumerate(data))
+
+        store = RecordStore(store.filename, overwrite=True)
+        assert len(store) == 0
+
+    def test_workers(self, tmp_path):
+        store = RecordStore(tmp_path / 'results')
+        store = pickle.loads(pickle.dumps(store))
+        with ProcessPoolExecutor(2) as pool:
+            assert list(pool.map(_write, [store] * 5, range(5))) == list(range(5))
+
+        assert list(store) == [1, 2, 3, 4]
+        assert len(list(store.records())) == 10
+
+    def test_writer_per_process(self, tmp_path):
+        # copies of the store sent with each task share the worker's writer
+        store = RecordStore(tmp_path / 'results')
+        with ProcessPoolExecutor(2) as pool:
+            list(pool.map(_write, [store] * 20, range(20)))
+
+        assert len(list(store.filename.glob('*.idx'))) <= 2
+        assert len(list(store.records())) == sum(range(20))
+
+    def test_threads(self, tmp_path):
+        store = RecordStore(tmp_path / 'results')
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(_write, [store] * 20, range(20)))
+
+        assert len(list(store.filename.glob('*.idx'))) == 1
+        assert all([len(a) for a in store[i]] == list(range(i))
+                   for i in range(1, 20))
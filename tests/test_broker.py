@@ -0,0 +1,108 @@
+# std
+from concurrent.futures import ProcessPoolExecutor
+
+# third-party
+import pytest
+import numpy as np
+
+# local
+from recipes.compute.executor import AbortCompute, Executor
+from recipes.compute.broker import TaskBroker, connect, serve
+
+
+# ---------------------------------------------------------------------------- #
+
+class Square(Executor):
+    def compute(self, x):
+        if x == 3:
+            raise ValueError('Failed deliberately.')
+        return x * x
+
+
+def test_broker(tmp_path):
+    broker = TaskBroker(tmp_path / 'tasks.db')
+    broker.submit(range(5))
+    assert broker.claim('a', 2) == [0, 1]
+    assert broker.claim('b', 2) == [2, 3]
+
+    broker.complete([0, 1])
+    assert broker.fail([2]) == 1
+    broker.release([3])
+    assert broker.counts() == {'done': 2, 'failed': 1, 'pending': 2}
+    assert broker.claim('b', 5) == [3, 4]
+    assert broker.claim('b') == []
+    assert not broker.finished()
+
+
+def test_lease(tmp_path):
+    # tasks of workers that do not report back are handed out again
+    broker = TaskBroker(tmp_path / 'tasks.db', lease=0)
+    broker.submit(range(2))
+    assert broker.claim('a', 2) == [0, 1]
+    assert broker.claim('b', 2) == [0, 1]
+
+
+def _work(loc, db):
+    exe = Square(xfail=2)
+    exe.init_memory(10, loc)
+    exe.work(TaskBroker(db), np.arange(10.), chunk=2, njobs=1)
+
+
+def test_distributed(tmp_path):
+    loc, db = tmp_path / 'results.npy', tmp_path / 'tasks.db'
+    exe = Square(xfail=2)
+    exe.init_memory(10, loc)
+    broker = exe.distribute(db)
+
+    with ProcessPoolExecutor(2) as pool:
+        for future in [pool.submit(_work, loc, db) for _ in range(2)]:
+            future.result()
+
+    assert broker.finished()
+    assert broker.indices('failed') == [3]
+
+    exe.gather(broker)
+    assert exe.completeness == '9/10'
+    done = exe.completed
+    assert (exe.results[done] == np.arange(10.)[done] ** 2).all()
+
+
+def test_xfail(tmp_path):
+    exe = Square(xfail=1)
+    exe.init_memory(10)
+    broker = exe.distribute(tmp_path / 'tasks.db')
+    with pytest.raises(ValueError):
+        exe.work(broker, np.arange(10.), chunk=4, njobs=1)
+
+    # later workers stop once the threshold is reached
+    with pytest.raises(AbortCompute):
+        exe.work(broker, np.arange(10.), chunk=4, njobs=1)
+
+    assert broker.counts() == {'done': 3, 'failed': 1, 'pending': 6}
+
+
+def test_serve(tmp_path):
+    exe = Square(xfail=2)
+    exe.init_memory(10)
+    broker = exe.distribute(tmp_path / 'tasks.db')
+    server = serve(broker, ('127.0.0.1', 0), b'secret')
+    try:
+        exe.work(connect(server.address, b'secret'), np.arange(10.), njobs=1)
+    finally:
+        server.stop_event.set()
+
+    exe.gather(broker)
+    assert exe.completeness == '9/10'
+
+
+def test_serve_many(tmp_path):
+    brokers = [TaskBroker(tmp_path / f'tasks{i}.db') for i in range(2)]
+    servers = [serve(broker, ('127.0.0.1', 0), b'secret') for broker in brokers]
+    try:
+        for i, (broker, server) in enumerate(zip(brokers, servers)):
+            broker.submit(range(i + 1))
+            assert connect(server.address, b'secret').counts() == \
+                {'pending': i + 1}
+    finally:
+        for server in servers:
+            server.stop_event.set()
@@ -2,17 +2,30 @@
 
 
 # std
+import gc
+import os
+import sys
+import time
 import tempfile
+import warnings
+import subprocess
 import itertools as itt
 from pathlib import Path
 from collections import defaultdict, OrderedDict as odict
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # third-party
 import pytest
 import numpy as np
 
 # local
+from recipes.caching import hashers
 from recipes.caching.manager import CacheManager as Cache
+from recipes.caching.packed import PackedCache
+from recipes.caching.sqlite import SQLiteCache
+from recipes.caching.caches import (ARCCache, LFUCache, LRUCache, TTLCache,
+                                    TinyLFUCache, parse_bytes, sizeof)
 from recipes.caching.decor import (CacheRejectionWarning, Ignore, Reject,
                                    cached, check_hashable_defaults)
 
@@ -57,7 +70,9 @@ def get_tmp_filename(ext='pkl'):
 
 @pytest.fixture(params=[Cache(2),
                         Cache(2, get_tmp_filename('json')),
-                        Cache(2, get_tmp_filename('pkl'))])
+                        Cache(2, get_tmp_filename('pkl')),
+                        Cache(2, get_tmp_filename('db')),
+                        Cache(2, get_tmp_filename('cache'))])
 def cache(request):
     return request.param
 
@@ -156,6 +171,21 @@ def case6(file, **kws):
         return 1
 
 
+calls = defaultdict(int)
+
+
+@cached(concurrent=True)
+def case_concurrent(a):
+    calls[a] += 1
+    time.sleep(0.05)
+    return a * 2
+
+
+@cached.to_file(get_tmp_filename(), shared=True)
+def case_shared(a):
+    return a * 2
+
+
 # ----------------------------------- Tests ---------------------------------- #
 
 
@@ -189,6 +219,448 @@ class TestLRUCache:
         assert cache.data == odict([(3, 3), (4, 4)])
 
 
+class TestPolicies:
+
+    @pytest.mark.parametrize('kls', [LFUCache, TTLCache, ARCCache, TinyLFUCache])
+    def test_capacity(self, kls):
+        cache = kls(3)
+        for i in range(10):
+            cache[i] = i
+            assert len(cache) <= 3
+            assert cache[i] == i
+
+    def test_lfu(self):
+        cache = LFUCache(2)
+        cache[1] = 1
+        cache[2] = 2
+        cache[1], cache[1], cache[2]
+        cache[3] = 3
+        assert set(cache) == {1, 3}
+        assert cache.counts == {1: 3, 3: 1}
+
+        # the new item is never evicted in favour of itself
+        cache[4] = 4
+        assert set(cache) == {1, 4}
+
+    def test_ttl(self):
+        cache = TTLCache(2, ttl=0.05)
+        cache[1] = 1
+        assert 1 in cache
+        time.sleep(0.06)
+        assert 1 not in cache
+        assert cache.get(1) is None
+
+        cache[2] = 2
+        time.sleep(0.06)
+        cache[3] = 3
+        cache[4] = 4
+        # expired item evicted
+        assert list(cache) == [3, 4]
+
+    @pytest.mark.parametrize('kls', [ARCCache, TinyLFUCache, LFUCache])
+    def test_scan_resistant(self, kls):
+        # a frequently used working set survives a scan of one-hit wonders
+        cache = kls(10)
+        for _ in range(5):
+            for i in range(5):
+                cache.get(i) or cache.__setitem__(i, i)
+
+        for i in range(100, 200):
+            cache[i] = i
+
+        assert sum(i in cache for i in range(5)) >= 4
+
+    @pytest.mark.parametrize('kls', [LFUCache, TTLCache, ARCCache, TinyLFUCache])
+    @pytest.mark.parametrize('ext', ['pkl', 'json'])
+    def test_persistence(self, kls, ext):
+        policy = kls.__name__[:-5].lower()
+        cache = Cache(3, get_tmp_filename(ext), policy)
+        for i in range(5):
+            cache[i] = i
+
+        clone = Cache.load(cache.filename)
+        assert type(clone.data) is kls
+        assert clone.data.params() == cache.data.params()
+        assert dict(clone.data) == dict(cache.data)
+
+
+class TestWriteBehind:
+
+    @pytest.mark.parametrize('ext', ['pkl', 'json'])
+    def test_flush(self, ext):
+        filename = get_tmp_filename(ext)
+        cache = Cache(10, filename, write_behind={'interval': 60,
+                                                  'threshold': 3})
+        cache[1] = 1
+        cache[2] = 2
+        # nothing written yet
+        assert not filename.exists()
+
+        cache[3] = 3
+        # threshold reached
+        time.sleep(0.2)
+        assert Cache.load(filename).data == {1: 1, 2: 2, 3: 3}
+
+        cache[4] = 4
+        cache.flush()
+        assert Cache.load(filename).data == {1: 1, 2: 2, 3: 3, 4: 4}
+
+    def test_close(self):
+        filename = get_tmp_filename()
+        cache = Cache(10, filename, write_behind=60)
+        cache[1] = 1
+        cache.writer.close()
+        assert not cache.writer.thread.is_alive()
+        assert Cache.load(filename).data == {1: 1}
+        # no stray temporary files
+        assert not list(filename.parent.glob(f'.{filename.name}.*'))
+
+    def test_release(self):
+        # the background thread does not keep the cache alive
+        filename = get_tmp_filename()
+        cache = Cache(10, filename, write_behind=60)
+        cache[1] = 1
+        thread = cache.writer.thread
+        del cache
+
+        thread.join(5)
+        assert not thread.is_alive()
+        assert Cache.load(filename).data == {1: 1}
+
+    def test_release_cycle(self):
+        # pending changes are written when the cache is collected in a cycle
+        filename = get_tmp_filename()
+        cache = Cache(10, filename, write_behind=60)
+        cache[1] = 1
+        thread = cache.writer.thread
+        cycle = [cache]
+        cycle.append(cycle)
+        del cache, cycle
+        gc.collect()
+
+        thread.join(5)
+        assert not thread.is_alive()
+        assert Cache.load(filename).data == {1: 1}
+
+
+class TestShared:
+
+    def test_merge(self):
+        filename = get_tmp_filename()
+        cache1 = Cache(10, filename, shared=True)
+        cache2 = Cache(10, filename, shared=True)
+
+        cache1[1] = 1
+        cache2[2] = 2
+        # second process merged instead of overwriting
+        assert Cache.load(filename).data == {1: 1, 2: 2}
+
+        # lookup hits entry saved by other process
+        assert 2 not in cache1.data
+        assert cache1.get(2) == 2
+        assert cache1[2] == 2
+
+    def test_processes(self):
+        with ProcessPoolExecutor(4, mp.get_context('fork')) as pool:
+            assert list(pool.map(case_shared, range(8))) == list(range(0, 16, 2))
+
+        assert set(Cache.load(case_shared.__cache__.filename).data) == \
+            {(i, ) for i in range(8)}
+
+        # results computed in the workers are available here
+        case_shared(7)
+        assert case_shared.cache_info().hits == 1
+
+    def test_packed_rejected(self):
+        # packed files support a single writer only
+        with pytest.raises(ValueError):
+            Cache(10, get_tmp_filename('cache'), shared=True)
+
+
+@pytest.mark.parametrize('ext, kls', [('db', SQLiteCache),
+                                      ('cache', PackedCache)])
+class TestIncremental:
+
+    def test_persistence(self, ext, kls):
+        filename = get_tmp_filename(ext)
+        cache = Cache(3, filename, 'lfu')
+        assert cache.incremental
+        for i in range(5):
+            cache[i] = np.arange(i)
+
+        assert len(cache.data) == 3
+        assert cache.info().evictions == 2
+
+        clone = Cache.load(filename)
+        assert (clone.capacity, clone.policy) == (3, 'lfu')
+        assert set(clone.data) == {2, 3, 4}
+        assert (clone[4] == np.arange(4)).all()
+
+    def test_lfu(self, ext, kls):
+        cache = kls(get_tmp_filename(ext), 2, policy='lfu')
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'], cache['a'], cache['b']
+        cache['c'] = 3
+        assert dict(cache.items()) == {'a': 1, 'c': 3}
+
+    def test_maxbytes(self, ext, kls):
+        cache = kls(get_tmp_filename(ext), '3KB')
+        assert (cache.capacity, cache.maxbytes) == (None, 3072)
+        for i in range(4):
+            cache[i] = np.zeros(100)
+
+        assert list(cache) == [1, 2, 3]
+        assert cache.nbytes <= cache.maxbytes
+
+        # too large to cache
+        cache['big'] = np.zeros(1000)
+        assert 'big' not in cache
+        assert len(cache) == 3
+
+    def test_migrate(self, ext, kls):
+        cache = Cache(3)
+        cache[1] = 1
+        cache.enable(get_tmp_filename(ext))
+        assert cache.incremental
+        assert cache[1] == 1
+
+    def test_decorator(self, ext, kls):
+        @cached.to_file(get_tmp_filename(ext))
+        def func(a, b=1):
+            return a * b
+
+        assert func(2) == func(2) == 2
+        assert func.cache_info().hits == 1
+
+
+class TestSQLite:
+
+    def test_totals(self):
+        # running count and size follow updates, deletions and reopening
+        filename = get_tmp_filename('db')
+        cache = SQLiteCache(filename, 10)
+        for i in range(5):
+            cache[i] = np.zeros(i)
+        cache[4] = np.zeros(100)
+        del cache[0]
+        nbytes = cache.nbytes
+        cache.close()
+
+        cache = SQLiteCache(filename)
+        assert (len(cache), cache.nbytes) == (4, nbytes)
+        assert cache._execute('SELECT SUM(size) FROM cache').fetchone()[0] == nbytes
+        cache.clear()
+        assert (len(cache), cache.nbytes) == (0, 0)
+
+    def test_digest_hash_seed(self):
+        # keys with sets of str are found by processes with other hash seeds
+        code = ('from recipes.caching.sqlite import digest; '
+                'print(digest((1, frozenset("abcdef"), '
+                'frozenset({frozenset("xyz"), "q"}))).hex())')
+        digests = {subprocess.run([sys.executable, '-c', code], check=True,
+                                  capture_output=True, text=True,
+                                  env={**os.environ, 'PYTHONHASHSEED': seed}
+                                  ).stdout
+                   for seed in '123'}
+        assert len(digests) == 1
+
+
+class TestPacked:
+
+    @pytest.mark.parametrize('policy', ['lru', 'lfu'])
+    def test_evict_order(self, policy):
+        cache = PackedCache(get_tmp_filename('cache'), 50, policy=policy)
+        for i in range(50):
+            cache[i] = i
+        for i in range(25):
+            cache[i]
+        for i in range(50, 75):
+            cache[i] = i
+
+        assert set(cache) == {*range(25), *range(50, 75)}
+
+    def test_evict_maxbytes(self):
+        # evictions that look beyond the first batch of candidates
+        cache = PackedCache(get_tmp_filename('cache'), maxbytes='64KB')
+        for i in range(200):
+            cache[i] = np.zeros(8)
+        cache['big'] = np.zeros(6000)
+
+        assert 'big' in cache
+        assert cache.nbytes <= cache.maxbytes
+        assert set(cache) == {*range(200 - len(cache) + 1, 200), 'big'}
+
+    def test_grow(self):
+        cache = PackedCache(get_tmp_filename('cache'), 1000)
+        slots = cache.slots
+        for i in range(500):
+            cache[i] = i
+
+        assert cache.slots > slots
+        assert len(cache) == 500
+        assert all(cache[i] == i for i in range(500))
+
+    def test_rebuild_header(self, monkeypatch):
+        # the rewritten file is complete before it replaces the old one
+        import os
+        from recipes.caching import packed
+
+        headers = []
+
+        def replace(src, dst, replace=os.replace):
+            headers.append(Path(src).read_bytes()[:packed.HEADER.size])
+            replace(src, dst)
+
+        monkeypatch.setattr(os, 'replace', replace)
+        cache = PackedCache(get_tmp_filename('cache'), 1000)
+        for i in range(100):
+            cache[i] = i
+        cache._rebuild()
+
+        magic, slots, count, *_ = packed.HEADER.unpack(headers[-1])
+        assert magic == packed.MAGIC
+        assert (slots, count) == (cache.slots, 100)
+
+    def test_compact(self):
+        filename = get_tmp_filename('cache')
+        cache = PackedCache(filename, 10)
+        for i in range(200):
+            cache[i % 10] = bytes(2 ** 14)
+
+        # records of replaced values are dropped on rewrite
+        assert Path(filename).stat().st_size < 200 * 2 ** 14 / 2
+        assert list(cache) == list(range(10))
+
+    def test_reopen(self):
+        filename = get_tmp_filename('cache')
+        cache = PackedCache(filename, 3, policy='lfu')
+        for i in range(3):
+            cache[i] = np.arange(i)
+        cache[0]
+        cache.close()
+
+        clone = PackedCache(filename)
+        assert clone.params() == {'capacity': 3, 'maxbytes': None,
+                                  'policy': 'lfu'}
+        clone[3] = 3
+        assert set(clone) == {0, 2, 3}
+
+    def test_invalid(self):
+        filename = get_tmp_filename('cache')
+        filename.write_bytes(b'not a cache')
+        with pytest.raises(ValueError):
+            PackedCache(filename)
+
+
+class TestHashers:
+
+    def test_shape(self):
+        assert hashers.digest(np.zeros((2, 3))) != hashers.digest(np.zeros((3, 2)))
+        assert hashers.digest(np.zeros(3)) != hashers.digest(np.zeros(3, int))
+
+    @pytest.mark.parametrize(
+        'view',
+        [lambda a: a[:, ::2], lambda a: a[::-1], lambda a: a[1:, 1:]]
+    )
+    def test_strided(self, view):
+        a = view(np.arange(20.).reshape(4, 5))
+        assert hashers.digest(a) == hashers.digest(a.copy())
+
+    def test_order(self):
+        a = np.arange(20.).reshape(4, 5)
+        assert hashers.digest(np.asfortranarray(a)) == hashers.digest(a)
+        assert hashers.digest(a.T) == hashers.digest(a.T.copy())
+        assert hashers.digest(a.T) != hashers.digest(a.reshape(5, 4))
+
+    def test_structured(self):
+        a = np.zeros(3, [('a', '<i4'), ('b', '<f4')])
+        assert hashers.digest(a) != hashers.digest(np.zeros(3, [('x', '<f8')]))
+        assert hashers.digest(a) != hashers.digest(a.astype([('a', '<i4'),
+                                                             ('c', '<f4')]))
+        assert hashers.digest(a[::2]) == hashers.digest(a[::2].copy())
+
+    def test_nested(self):
+        assert (hashers.digest({'a': [1, {'x', 'y'}], 'b': 1.}) ==
+                hashers.digest({'b': 1., 'a': [1, {'y', 'x'}]}))
+        items = (1, 1., '1', b'1', True, None, (1, ), ('1', ), np.int64(1))
+        assert len(set(map(hashers.digest, items))) == len(items)
+        assert hashers.digest(('ab', 'c')) != hashers.digest(('a', 'bc'))
+
+    def test_memmap(self):
+        filename = get_tmp_filename('dat')
+        np.memmap(filename, mode='w+', shape=(100, )).flush()
+        data = np.memmap(filename, mode='r', shape=(100, ))
+
+        assert hashers.digest(data) == hashers.digest(
+            np.memmap(filename, mode='r', shape=(100, )))
+        assert hashers.digest(data) != hashers.digest(
+            np.memmap(filename, mode='r', shape=(50, ), offset=50))
+        # views are hashed by content
+        assert hashers.digest(data[10:]) == hashers.digest(np.zeros(90, 'u1'))
+
+    def test_decorator(self):
+        @cached(typed={np.ndarray: hashers.hexdigest})
+        def func(a, b=1):
+            return a.sum() * b
+
+        func(np.ones(3))
+        func(np.ones(3))
+        info = func.cache_info()
+        assert (info.hits, info.misses) == (1, 1)
+
+
+class TestByteCapacity:
+
+    @pytest.mark.parametrize(
+        'size, expected',
+        [(100, 100), ('100', 100), ('100B', 100), ('2K', 2048),
+         ('1.5 KiB', 1536), ('512MB', 2 ** 29), ('1gb', 2 ** 30)]
+    )
+    def test_parse_bytes(self, size, expected):
+        assert parse_bytes(size) == expected
+
+    def test_parse_bytes_raises(self):
+        with pytest.raises(ValueError):
+            parse_bytes('many bytes')
+
+    def test_sizeof(self):
+        assert sizeof(np.zeros(100)) == 800
+        assert sizeof(np.zeros((1000, 1000))[::10]) == 800_000
+        assert sizeof(bytearray(100)) == 100
+
+    def test_evict(self):
+        cache = LRUCache('2.5KB')
+        assert (cache.capacity, cache.maxbytes) == (None, 2560)
+
+        for i in range(3):
+            cache[i] = np.zeros(100)
+        assert list(cache) == [0, 1, 2]
+
+        cache[0]
+        cache[3] = np.zeros(100)
+        assert list(cache) == [2, 0, 3]
+        assert cache.nbytes <= cache.maxbytes
+        assert cache.nbytes == sum(cache.sizes.values())
+
+        # item larger than the capacity is not kept
+        cache[4] = np.zeros(1000)
+        assert 4 not in cache
+
+        cache.pop(2)
+        cache.popitem()
+        assert cache.nbytes == sum(cache.sizes.values())
+
+    def test_manager(self):
+        cache = Cache('2KB', get_tmp_filename())
+        for i in range(3):
+            cache[i] = np.zeros(100)
+
+        clone = Cache.load(cache.filename)
+        assert list(clone.data) == list(cache.data)
+        assert clone.nbytes == cache.nbytes == cache.info().bytes
+
+
 class TestPersistence():
 
     filename = get_tmp_filename()
@@ -339,8 +811,74 @@ class TestDecorator():
             func(a)
             assert func.__cache__ == initial
 
+    def test_cache_info(self):
+        @cached(capacity=2)
+        def func(a):
+            return a
+
+        for a in (1, 1, 2, 3, {4}):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', CacheRejectionWarning)
+                func(a)
+
+        info = func.cache_info()
+        assert (info.hits, info.misses, info.evictions, info.rejected,
+                info.size, info.capacity) == (1, 3, 1, 1, 2, 2)
+        assert info.bytes > 0
+        assert info.time_saved == info.mean_compute_time
+
+    @pytest.mark.parametrize(
+        'args, kws, expected',
+        [((6, ), {}, (6, 0, (), ())),
+         ((6, 1, 2), {}, (6, 1, (2, ), ())),
+         ((), {'b': 1, 'a': 6}, (6, 1, (), ())),
+         (([1], ), {'x': [2]}, ((1, ), 0, (), (('x', (2, )), )))]
+    )
+    def test_key(self, args, kws, expected):
+        assert case1b.__factory__.get_key(*args, **kws) == expected
+
+    def test_key_ignore(self):
+        assert case2.__factory__.get_key(1, verbose=False) == (1, )
+        assert case5.__factory__.get_key('1') == (1, )
+
+    def test_key_raises(self):
+        with pytest.raises(TypeError):
+            case1b.__factory__.get_key()
+
+    def test_key_shadowing(self):
+        # parameters named like the helpers of the generated key function
+        @cached(typed={'_typed_': str})
+        def _convert_(_type_, _convert_=1, _typed_=2, **_convert_kws_):
+            return _type_
+
+        assert _convert_([1]) == [1]
+        assert _convert_.__factory__.get_key([1], x=[2]) == \
+            ((1, ), 1, '2', (('x', (2, )), ))
+
     def test_typed_raises_on_invalid_name(self):
         with pytest.raises(ValueError):
             @cached(typed={'a': int})
             def case6(b):
                 return
+
+
+class TestConcurrent:
+
+    def test_single_flight(self):
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(case_concurrent, [1, 2] * 8))
+
+        assert results == [2, 4] * 8
+        assert calls == {1: 1, 2: 1}
+        assert len(case_concurrent.__cache__.flights) == 0
+
+        info = case_concurrent.cache_info()
+        assert (info.hits, info.misses) == (14, 2)
+
+    def test_serialize(self):
+        cache = Cache(2, get_tmp_filename(), concurrent=True)
+        cache[1] = 1
+
+        clone = Cache.load(cache.filename)
+        assert clone.data == cache.data
+        assert not clone.concurrent
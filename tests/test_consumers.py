@@ -0,0 +1,97 @@
+
+# std
+import os
+
+# third-party
+import pytest
+
+# local
+from recipes.compute.pool import WorkerLost
+from recipes.compute.consumers import Pipeline
+
+
+# ---------------------------------------------------------------------------- #
+
+def double(x):
+    return 2 * x
+
+
+def spread(x):
+    # fan out
+    yield from range(x)
+
+
+def odd(x):
+    if x % 2:
+        return x
+
+
+def fail(x):
+    if x == 3:
+        raise ValueError('Failed deliberately.')
+    return x
+
+
+def die(x):
+    if x == 3:
+        os._exit(1)
+    return x
+
+
+def items():
+    yield from range(5)
+    raise RuntimeError('Input failed.')
+
+
+# ---------------------------------------------------------------------------- #
+
+def test_pipeline():
+    pipeline = Pipeline((double, 3), (spread, 2), odd, maxsize=2)
+    results = pipeline(range(10))
+    assert sorted(results) == sorted(i for x in range(10)
+                                     for i in range(2 * x) if i % 2)
+    assert not pipeline.workers
+
+
+def test_pipeline_failed_item():
+    # the error is raised once the remaining items are done
+    results = []
+    with pytest.raises(ValueError):
+        for result in Pipeline((fail, 2), double).run(range(5)):
+            results.append(result)
+    assert sorted(results) == [0, 2, 4, 8]
+
+
+def test_pipeline_failed_input():
+    pipeline = Pipeline(double)
+    results = []
+    with pytest.raises(RuntimeError):
+        for result in pipeline.run(items()):
+            results.append(result)
+    assert sorted(results) == [0, 2, 4, 6, 8]
+
+
+def test_pipeline_lost_worker():
+    pipeline = Pipeline((die, 2))
+    with pytest.raises(WorkerLost):
+        pipeline(range(5))
+    assert not pipeline.workers
+
+
+def test_pipeline_invalid():
+    with pytest.raises(ValueError):
+        Pipeline((double, 0))
+
+
+def test_pipeline_stop_early():
+    # the feeder, blocked on the full input queue, exits when the consumer
+    # stops iterating
+    pipeline = Pipeline(double, maxsize=2)
+    results = pipeline.run(range(1000))
+    assert next(results) == 0
+    feeder = pipeline.feeder
+    results.close()
+
+    feeder.join(5)
+    assert not feeder.is_alive()
+    assert not (pipeline.workers or pipeline.queues)
@@ -0,0 +1,223 @@
+
+# std
+import pickle
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.reduction import ForkingPickler
+
+# third-party
+import pytest
+import numpy as np
+
+# local
+from recipes.functionals import noop
+from recipes.compute.backends import SharedCounter
+from recipes.compute.shared import SharedArray, share
+from recipes.compute.executor import BatchedExecutor, Executor
+
+
+# ---------------------------------------------------------------------------- #
+
+class Square(Executor):
+    def compute(self, x):
+        if x == 3:
+            raise ValueError('Failed deliberately.')
+        return x * x
+
+
+def test_resume(tmp_path):
+    loc = tmp_path / 'results.npy'
+    data = np.arange(10.)
+
+    exe = Square(xfail=2)
+    exe.init_memory(10, loc)
+    exe(None, data, njobs=1, progress_bar=False)
+    assert exe.completeness == '9/10'
+    assert list(np.flatnonzero(~exe.completed)) == [3]
+
+    # resume: only the failed task remains
+    exe = Square(xfail=2)
+    exe.init_memory(10, loc)
+    assert exe.completeness == '9/10'
+    assert list(exe.get_workload()) == [(3, )]
+
+    exe.reset_memory()
+    assert exe.completeness == '0/10'
+
+
+def test_integer_results(tmp_path):
+    # completion does not depend on the values of the results
+    exe = Square(xfail=2)
+    exe.init_memory(5, tmp_path / 'results.npy', fill=0)
+    exe([0, 1], np.arange(5), njobs=1, progress_bar=False)
+    assert exe.completeness == '2/5'
+
+
+class Double(BatchedExecutor):
+    def compute(self, x):
+        return 2 * x
+
+
+def batch_sizes(workload):
+    return [len(batch) for batch, in workload]
+
+
+def test_guided():
+    exe = Double(schedule='guided')
+    exe.init_memory(100)
+    sizes = batch_sizes(exe.get_workload(njobs=4))
+    assert sum(sizes) == 100
+    assert sizes[0] == 100 // (2 * 4)
+    assert sizes == sorted(sizes, reverse=True)
+
+    exe(None, np.arange(100), njobs=1, progress_bar=False)
+    assert exe.completeness == '100/100'
+    assert (exe.results == 2 * np.arange(100)).all()
+    assert not np.isnan(exe.costs).any()
+
+
+def test_guided_longest_first():
+    exe = Double(schedule='guided')
+    exe.init_memory(10)
+    exe.costs[:] = 1
+    exe.costs[7] = 10
+    (batch, ), *_ = exe.get_workload(njobs=2)
+    assert batch[0] == (7, )
+
+
+def test_static():
+    exe = Double(schedule='static')
+    exe.init_memory(10)
+    assert batch_sizes(exe.get_workload(njobs=3)) == [4, 4, 2]
+    exe(None, np.arange(10), njobs=1, progress_bar=False)
+    assert exe.completeness == '10/10'
+
+
+def test_static_default():
+    # batches are split in index order, sized for the full job
+    exe = Double()
+    exe.init_memory(10)
+    assert exe.schedule == 'static'
+    assert [[i for i, in batch] for batch, in exe.get_workload(njobs=4)] == \
+        [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert batch_sizes(exe.get_workload(njobs=4, batch_size=3)) == [3, 3, 3, 1]
+    assert batch_sizes(exe.get_workload([2, 5, 7], njobs=4)) == [3]
+
+
+# ---------------------------------------------------------------------------- #
+class AsyncSquare(Executor):
+    async def compute(self, x):
+        await asyncio.sleep(0)
+        if x == 3:
+            raise ValueError('Failed deliberately.')
+        return x * x
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process', 'multiprocessing'])
+def test_backend(backend):
+    exe = Square(backend=backend, xfail=2)
+    exe.init_memory(10)
+    exe(None, np.arange(10.), njobs=2, progress_bar=False)
+    assert exe.completeness == '9/10'
+    assert exe.nfail.value == 1
+    assert exe.results[9] == 81
+    if backend != 'thread':
+        assert isinstance(exe.nfail, SharedCounter)
+
+    # memory maps are pickled by reference for the backend's tasks only
+    assert np.memmap not in ForkingPickler._extra_reducers
+
+
+def test_backend_abort():
+    exe = Square(backend='thread', xfail=1)
+    exe.init_memory(10)
+    with pytest.raises(ValueError):
+        exe([3, 4], np.arange(10.), njobs=2, progress_bar=False)
+
+
+@pytest.mark.parametrize('njobs', [1, 3])
+def test_asyncio(njobs):
+    exe = AsyncSquare(xfail=2)
+    exe.init_memory(10)
+    exe(None, np.arange(10.), njobs=njobs, progress_bar=False)
+    assert exe.completeness == '9/10'
+    assert (exe.results[exe.completed] == np.delete(np.arange(10.), 3) ** 2).all()
+
+
+def test_shared_counter():
+    counter = SharedCounter(1)
+    with ProcessPoolExecutor(2, initializer=noop, initargs=(counter, )) as pool:
+        values = sorted(pool.map(SharedCounter.increment, [counter] * 4))
+    assert values == [2, 3, 4, 5]
+    assert counter.value == 5
+
+
+class Ragged(Executor):
+    def compute(self, n):
+        if n == 3:
+            raise ValueError('Failed deliberately.')
+        yield from (np.arange(i) for i in range(n))
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_store(tmp_path, backend):
+    exe = Ragged(backend=backend, xfail=2)
+    exe.init_store(6, tmp_path / 'results')
+    exe(None, np.arange(6), njobs=2, progress_bar=False)
+    assert exe.completeness == '5/6'
+    assert list(exe.results) == [1, 2, 4, 5]
+    assert [len(a) for a in exe.results[4]] == [0, 1, 2, 3]
+
+    # resume
+    exe = Ragged(xfail=2)
+    exe.init_store(6, tmp_path / 'results')
+    assert list(exe.get_workload()) == [(3, )]
+
+
+class Shared(Executor):
+    def compute(self, row):
+        # rows are views into shared memory, not copies
+        return isinstance(row, SharedArray) and not row.flags.owndata
+
+
+@pytest.mark.parametrize('share', [True, False])
+def test_share(share):
+    exe = Shared(backend='process')
+    exe.init_memory(8, fill=0)
+    data = np.ones((8, 2 ** 17))
+    exe(None, data, njobs=2, progress_bar=False, share=share)
+    assert exe.completeness == '8/8'
+    assert exe.results.all() == share
+
+
+def _total(a):
+    return a.sum()
+
+
+def test_shared_array():
+    a = share(np.arange(20.).reshape(4, 5))
+    try:
+        assert type(a + 1) is np.ndarray
+        with ProcessPoolExecutor(2) as pool:
+            totals = list(pool.map(_total, [a, a[1], a[:, ::-2]]))
+        assert totals == [a.sum(), a[1].sum(), a[:, ::-2].sum()]
+        # views are sent by reference
+        assert len(pickle.dumps(a[:, 1:])) < len(pickle.dumps(a[:, 1:] * 1))
+    finally:
+        a.unlink()
+
+
+def test_stats(tmp_path):
+    exe = Square(backend='thread', xfail=2)
+    exe.init_memory(10, tmp_path / 'results.npy')
+    exe(None, np.arange(10.), njobs=2, progress_bar=False)
+
+    # failed tasks are timed too
+    stats = np.load(tmp_path / 'results.stats.npy')
+    assert (stats['wall'] >= 0).all()
+    assert (stats['rss'] > 0).all()
+    assert 1 <= len(np.unique(stats['worker'])) <= 2
+
+    report = exe.report(slowest=3)
+    assert report.startswith('Square: 10 tasks')
+    assert report.count('busy') == len(np.unique(stats['worker']))
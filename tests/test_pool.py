@@ -0,0 +1,118 @@
+
+# std
+import os
+import time
+import signal
+import itertools as itt
+
+# third-party
+import pytest
+
+# local
+from recipes.compute.pool import SupervisedPool, WorkerLost
+
+
+# ---------------------------------------------------------------------------- #
+
+def square(x):
+    return x * x
+
+
+def pid(_):
+    return os.getpid()
+
+
+def fail(x):
+    if x == 3:
+        raise ValueError('Failed deliberately.')
+    return x
+
+
+def crash_once(args):
+    # kill the worker the first time the task is run
+    x, marker = args
+    if x == 2 and not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return x
+
+
+def hang(x):
+    if x == 1:
+        # stop the process, so it misses heartbeats
+        os.kill(os.getpid(), signal.SIGSTOP)
+    return x
+
+
+def pause(x):
+    if x == 1:
+        # stop the process for a while, as a long call holding the GIL would
+        if os.fork() == 0:
+            time.sleep(0.5)
+            os.kill(os.getppid(), signal.SIGCONT)
+            os._exit(0)
+        os.kill(os.getpid(), signal.SIGSTOP)
+    return x
+
+
+def sleep(x):
+    time.sleep(x)
+    return x
+
+
+# ---------------------------------------------------------------------------- #
+
+def test_imap():
+    with SupervisedPool(2) as pool:
+        assert list(pool.imap(square, range(10), chunksize=3)) == \
+            [x * x for x in range(10)]
+        assert sorted(pool.imap_unordered(square, range(10))) == \
+            [x * x for x in range(10)]
+        assert pool.starmap(pow, [(2, 3), (3, 2)]) == [8, 9]
+
+
+def test_imap_lazy():
+    # infinite input
+    with SupervisedPool(2) as pool:
+        assert list(itt.islice(pool.imap(square, itt.count()), 5)) == \
+            [0, 1, 4, 9, 16]
+        # pool is usable after abandoning the iterator
+        assert pool.map(square, [3]) == [9]
+
+
+def test_error():
+    with SupervisedPool(2) as pool:
+        with pytest.raises(ValueError):
+            pool.map(fail, range(5))
+
+
+def test_maxtasksperchild():
+    with SupervisedPool(1, maxtasksperchild=2) as pool:
+        pids = pool.map(pid, range(6))
+    assert len(set(pids)) == 3
+
+
+def test_crash(tmp_path):
+    marker = str(tmp_path / 'crashed')
+    with SupervisedPool(2) as pool:
+        assert pool.map(crash_once, [(x, marker) for x in range(5)]) == \
+            list(range(5))
+        assert len(pool.workers) == 2
+
+
+def test_hung():
+    with SupervisedPool(2, heartbeat=0.05, retries=0) as pool:
+        with pytest.raises(WorkerLost):
+            pool.map(hang, range(3))
+
+
+def test_hung_disabled():
+    with SupervisedPool(2, heartbeat=0.05, missed_beats=None) as pool:
+        assert pool.map(pause, range(3)) == [0, 1, 2]
+
+
+def test_timeout():
+    with SupervisedPool(1, timeout=0.2, retries=1) as pool:
+        with pytest.raises(WorkerLost):
+            pool.map(sleep, [0, 5])
+        assert pool.map(sleep, [0]) == [0]
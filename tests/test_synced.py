@@ -0,0 +1,100 @@
+
+# std
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+
+# third-party
+import pytest
+import numpy as np
+
+# local
+from recipes.compute.synced import BlockSyncedArray, ShardedCounter
+
+
+# ---------------------------------------------------------------------------- #
+
+def count(counter, n):
+    for _ in range(n):
+        counter.inc()
+
+
+def accumulate(array, n):
+    for i in range(n):
+        array.add(i % len(array), 1)
+        with array.locked(slice(None)):
+            array[:] += 1
+
+
+def test_sharded_counter():
+    counter = ShardedCounter(5)
+    workers = [mp.Process(target=count, args=(counter, 1000)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    count(counter, 1000)
+    for worker in workers:
+        worker.join()
+    assert counter.value == 5005
+
+
+def test_sharded_counter_threads():
+    counter = ShardedCounter(nslots=2)
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(count, [counter] * 8, [500] * 8))
+    assert counter.value == 4000
+
+
+def test_sharded_counter_reuse():
+    # slots of finished threads are reused
+    counter = ShardedCounter(nslots=2)
+    for _ in range(10):
+        thread = threading.Thread(target=count, args=(counter, 10))
+        thread.start()
+        thread.join()
+
+    assert counter.value == 100
+    assert counter.claimed.value == 1
+
+
+def test_sharded_counter_recycled_processes():
+    # slots of processes that exited are reused
+    counter = ShardedCounter(nslots=2)
+    for _ in range(6):
+        worker = mp.Process(target=count, args=(counter, 10))
+        worker.start()
+        worker.join()
+
+    assert counter.value == 60
+    assert counter.claimed.value == 1
+
+
+def test_block_synced_array():
+    array = BlockSyncedArray((10, 2), nlocks=4, block_size=2)
+    workers = [mp.Process(target=accumulate, args=(array, 100))
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert (array.data == 40 + 400).all()
+    assert array._lock_ids(slice(0, 4)) == [0, 1]
+    assert array._lock_ids([9, 0]) == [0]
+    assert array._lock_ids(np.arange(10) > 7) == [0]
+
+    # disjoint writes need no lock
+    array[3] = -1
+    assert (np.asarray(array)[3] == -1).all()
+
+
+@pytest.mark.parametrize(
+    'rows',
+    [0, 9, -1, slice(None), slice(3, 4), slice(5, 5), slice(None, None, -1),
+     slice(1, None, 3), slice(8, 0, -5), slice(0, 10, 7), [1, -2],
+     (slice(2, 5), 0)]
+)
+def test_lock_ids(rows):
+    array = BlockSyncedArray((10, 2), nlocks=3, block_size=2)
+    first = rows[0] if isinstance(rows, tuple) else rows
+    expected = np.unique((np.arange(10)[first] // 2) % 3).tolist()
+    assert array._lock_ids(rows) == expected